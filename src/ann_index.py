@@ -0,0 +1,204 @@
+# Approximate nearest neighbour search: IVF + product quantization
+# k-means picks coarse lists, each vector's residual is stored as m uint8 codes.
+# a query scans only the nprobe closest lists, scoring codes with a lookup table
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from retrieval import top_k_indices
+
+def kmeans(X, k, iters=20, seed=0, sample=50_000, block=16384):
+    rng = np.random.default_rng(seed)
+    if len(X) > sample:
+        X = X[rng.choice(len(X), sample, replace=False)]
+    X = np.asarray(X, dtype=np.float32)
+    k = min(k, len(X))
+    centroids = X[rng.choice(len(X), k, replace=False)].copy()
+
+    for _ in range(iters):
+        assign = assign_nearest(X, centroids, block)
+        counts = np.bincount(assign, minlength=k)
+        # per cluster sums via one sort instead of a scatter add
+        order = np.argsort(assign, kind='stable')
+        sums = np.zeros_like(centroids)
+        present = np.flatnonzero(counts)
+        sums[present] = np.add.reduceat(X[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[present])
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # reseed empty clusters from random points
+        if empty.any():
+            centroids[empty] = X[rng.choice(len(X), int(empty.sum()), replace=False)]
+    return centroids
+
+def assign_nearest(X, centroids, block=16384):
+    # argmin ||x - c||^2 == argmax 2 x.c - ||c||^2
+    c_norms = (centroids ** 2).sum(axis=1)
+    out = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), block):
+        out[start:start + block] = np.argmax(2 * X[start:start + block] @ centroids.T - c_norms, axis=1)
+    return out
+
+class IVFPQIndex:
+    def __init__(self, centroids, codebooks, codes, list_offsets, list_ids, nprobe=8, vectors_digest=None):
+        self.centroids = centroids        # (nlist, dim)
+        self.codebooks = codebooks        # (m, ksub, dsub)
+        self.codes = codes                # (N, m) uint8, grouped by list
+        self.list_offsets = list_offsets  # (nlist + 1,)
+        self.list_ids = list_ids          # (N,) doc id of each code row
+        self.nprobe = nprobe
+        self.vectors_digest = vectors_digest  # of the document vectors it was built from
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    def __len__(self):
+        return len(self.list_ids)
+
+    @classmethod
+    def build(cls, vectors, nlist=None, m=32, ksub=256, iters=20, seed=0):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+
+        print(f"training {nlist} coarse centroids...")
+        centroids = kmeans(vectors, nlist, iters, seed)
+        assign = assign_nearest(vectors, centroids)
+
+        # pad so the dimensions split evenly into m sub vectors
+        dsub = -(-dim // m)
+        residuals = np.zeros((n, m * dsub), dtype=np.float32)
+        residuals[:, :dim] = vectors - centroids[assign]
+        residuals = residuals.reshape(n, m, dsub)
+
+        print(f"training {m} product quantizers...")
+        ksub = min(ksub, n)
+        codebooks = np.zeros((m, ksub, dsub), dtype=np.float32)
+        codes = np.empty((n, m), dtype=np.uint8)
+        for j in range(m):
+            book = kmeans(residuals[:, j], ksub, iters, seed + j + 1)
+            codebooks[j, :len(book)] = book
+            codes[:, j] = assign_nearest(residuals[:, j], codebooks[j])
+
+        # group rows by list so each list is one contiguous slice
+        order = np.argsort(assign, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))])
+        return cls(centroids, codebooks, np.ascontiguousarray(codes[order]), list_offsets, order.astype(np.int64))
+
+    def search(self, query_vecs, k=10, nprobe=None):
+        # query_vecs: (q, dim) unit vectors, returns (ids, scores) arrays of shape (q, k)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        query_vecs = np.atleast_2d(np.asarray(query_vecs, dtype=np.float32))
+        m, ksub, dsub = self.codebooks.shape
+
+        coarse = query_vecs @ self.centroids.T
+        probes = top_k_indices(coarse, nprobe)
+
+        ids_out = np.full((len(query_vecs), k), -1, dtype=np.int64)
+        scores_out = np.full((len(query_vecs), k), -np.inf, dtype=np.float32)
+        for qi, q in enumerate(query_vecs):
+            # inner product lookup table: lut[j, c] = q_j . codebook[j, c]
+            padded = np.zeros(m * dsub, dtype=np.float32)
+            padded[:len(q)] = q
+            lut = np.einsum('jd,jcd->jc', padded.reshape(m, dsub), self.codebooks)
+
+            lists = probes[qi]
+            starts = self.list_offsets[lists]
+            ends = self.list_offsets[lists + 1]
+            rows = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(lists) else np.zeros(0, dtype=np.int64)
+            if not len(rows):
+                continue
+
+            base = np.repeat(coarse[qi, lists], ends - starts)
+            scores = base + lut[np.arange(m), self.codes[rows]].sum(axis=1)
+
+            top = top_k_indices(scores, k)
+            ids_out[qi, :len(top)] = self.list_ids[rows[top]]
+            scores_out[qi, :len(top)] = scores[top]
+        return ids_out, scores_out
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ('centroids', 'codebooks', 'codes', 'list_offsets', 'list_ids'):
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'type': 'ivfpq', 'size': len(self), 'nlist': len(self.centroids),
+                       'm': self.codebooks.shape[0], 'nprobe': self.nprobe,
+                       'vectors_digest': self.vectors_digest}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        # memory mapped, so workers share the pages and startup is instant
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mode)
+                  for name in ('centroids', 'codebooks', 'codes', 'list_offsets', 'list_ids')}
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # small arrays are read on every query, keep them in ram
+        for name in ('centroids', 'codebooks', 'list_offsets'):
+            arrays[name] = np.array(arrays[name])
+        return cls(nprobe=meta.get('nprobe', 8), vectors_digest=meta.get('vectors_digest'), **arrays)
+
+def recall_report(ann, exact, query_vecs, k=10, nprobes=(1, 2, 4, 8, 16, 32, 64), refines=(1, 4)):
+    # recall@k of the ann index against brute force, with latency per setting
+    # exact is a VectorIndex over the same vectors
+    exact.use_ann(ann)
+    sims = exact.similarities(query_vecs)
+    truth = top_k_indices(sims, k)
+    kth = np.take_along_axis(sims, truth[:, -1:], axis=1)
+
+    t = time.perf_counter()
+    exact.similarities(query_vecs)
+    exact_ms = (time.perf_counter() - t) * 1000 / len(query_vecs)
+
+    rows = []
+    for refine in refines:
+        for nprobe in nprobes:
+            if nprobe > len(ann.centroids):
+                break
+            t = time.perf_counter()
+            ids, _ = exact.ann_top_k(query_vecs, k, nprobe, refine)
+            ms = (time.perf_counter() - t) * 1000 / len(query_vecs)
+            # a hit is any result scoring at least the true k-th best,
+            # so duplicate documents with tied scores are not counted as misses
+            true_scores = np.take_along_axis(sims, np.where(ids >= 0, ids, 0), axis=1)
+            hits = ((true_scores >= kth - 1e-5) & (ids >= 0)).sum(axis=1)
+            rows.append({'nprobe': nprobe, 'refine': refine, f'recall@{k}': float(np.mean(hits)) / k, 'ms_per_query': ms})
+            print(f"nprobe={nprobe:<4} refine={refine:<3} recall@{k}={rows[-1][f'recall@{k}']:.3f}  {ms:.3f} ms/query")
+    print(f"exact search: {exact_ms:.3f} ms/query")
+    return {'k': k, 'num_queries': len(query_vecs), 'size': len(ann), 'exact_ms_per_query': exact_ms, 'results': rows}
+
+def main():
+    from vector_search import load_vector_index
+
+    parser = argparse.ArgumentParser(description="build the ivf-pq index from the document vectors")
+    parser.add_argument('--output', default='models/ann_index')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--m', type=int, default=32)
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=500, help="document vectors used as recall queries")
+    parser.add_argument('--report', default='results/ann_recall.json')
+    args = parser.parse_args()
+
+    exact = load_vector_index()
+    vectors = exact.doc_block(0, len(exact))
+
+    ann = IVFPQIndex.build(vectors, nlist=args.nlist, m=args.m)
+    ann.nprobe = args.nprobe
+    ann.vectors_digest = exact.digest
+    ann.save(args.output)
+    print(f"saved index to {args.output}")
+
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    report = recall_report(ann, exact, sample)
+
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"report saved to {args.report}")
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,8 @@ import numpy as np
 import torch
 from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
 import re
-from collections import Counter
+import copy
+from collections import Counter, OrderedDict
 import pandas as pd
 
 import random
@@ -17,6 +18,19 @@ sys.path.append(os.path.dirname(__file__))
 
 from preprocess import clean_malayalam_text, tokenize_malayalam
 from retrieval import BM25, search
+from paging import search_page
+from vector_search import load_vector_index
+from rerank import CrossEncoderReranker
+from autocomplete import SuggestionTrie, suggest
+from fuzzy import SymSpell
+from docstore import load_documents
+from impact_index import ImpactIndex, enabled as impact_enabled
+from substring_index import SubstringIndex
+from passages import PassageIndex, passage_texts, CLASSIFY_WORDS, CLASSIFY_STRIDE, MAX_CLASSIFY_PASSAGES
+from snapshots import SnapshotWatcher
+from inference_cache import InferenceCache, model_version, svm_labels
+import instrument
+from instrument import stage
 
 # Configure page settings
 st.set_page_config(page_title="Malayalam Search", page_icon="🔍", layout="wide")
@@ -63,41 +77,153 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_resource
-def load_resources():
-    resources = {}
+def load_resources(paths, previous=None, unchanged=()):
+    # paths: artifact name -> file, from a published snapshot or the build outputs.
+    # runs in the snapshot watcher's thread on reloads, so errors are collected
+    # and shown by the page rather than raised through st. on a reload, objects
+    # whose artifacts are unchanged are taken over from previous instead of loaded
+    resources = {'errors': []}
+
+    def reuse(names, keys):
+        if previous is None or not all(n in unchanged for n in names) or not all(k in previous for k in keys):
+            return False
+        for k in keys:
+            resources[k] = previous[k]
+        return True
     
     # Load BM25 index
     try:
-        with open('models/bm25_index.pkl', 'rb') as f:
-            resources['bm25'] = pickle.load(f)
-        with open('data/processed_corpus.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        resources['documents'] = [item['text'] for item in data]
-        resources['original_docs'] = [item.get('original_text', item['text']) for item in data]
+        if not reuse(['bm25_index.pkl', 'impact_index.npz'], ['bm25', 'speller']):
+            with open(paths['bm25_index.pkl'], 'rb') as f:
+                resources['bm25'] = pickle.load(f)
+            # score-at-a-time index, only for large corpora (or MIR_IMPACT=1) and only
+            # when it was built from this very bm25 index
+            if impact_enabled(resources['bm25']) and os.path.exists(paths['impact_index.npz']):
+                impact = ImpactIndex.load(paths['impact_index.npz'])
+                if impact.matches(resources['bm25']):
+                    resources['bm25'].use_impact(impact)
+                else:
+                    resources['errors'].append("Impact index is stale, rebuild it with src/impact_index.py")
+            # fuzzy expansion of misspelled query terms, built from the index vocabulary
+            resources['speller'] = SymSpell.from_index(resources['bm25'])
+        # compressed store when built, only the shown results get decompressed;
+        # without texts for its doc ids there is no bm25 search either
+        try:
+            resources['original_docs'] = load_documents(paths['docstore'], num_docs=len(resources['bm25'].doc_len))
+        except ValueError:
+            del resources['bm25']
+            raise
+        resources['documents'] = resources['original_docs']
+        # documents ranked by their best passage, snippets from that passage
+        if not reuse(['passage_index.pkl', 'bm25_index.pkl'], ['passages']) and os.path.exists(paths['passage_index.pkl']):
+            passages = PassageIndex.load(paths['passage_index.pkl'])
+            if passages.matches(resources['bm25']):
+                resources['passages'] = passages
+    except Exception as e:
+        resources['errors'].append(f"Error loading BM25: {e}")
+        
+    # Load character n-gram index for partial word search
+    try:
+        if not reuse(['substring_index.npz'], ['substrings']) and os.path.exists(paths['substring_index.npz']):
+            resources['substrings'] = SubstringIndex.load(paths['substring_index.npz'])
+        # its doc ids only resolve in the corpus it was built from; ingestion does
+        # not update it, so after an ingest it stays out until rebuilt
+        if 'substrings' in resources and ('bm25' not in resources or
+                                          not resources['substrings'].matches(resources['bm25'])):
+            resources['errors'].append("Substring index does not match the BM25 index, rebuild it with src/substring_index.py")
+            del resources['substrings']
     except Exception as e:
-        st.error(f"Error loading BM25: {e}")
+        resources['errors'].append(f"Error loading substring index: {e}")
+
+    # Load document vectors for vector search
+    try:
+        if not reuse(['vectorizer_ir.pkl', 'doc_vectors.pkl', 'ann_index'], ['vectors']) and \
+                os.path.exists(paths['doc_vectors.pkl']):
+            resources['vectors'] = load_vector_index(paths['vectorizer_ir.pkl'], paths['doc_vectors.pkl'],
+                                                     ann_dir=paths['ann_index'])
+    except Exception as e:
+        resources['errors'].append(f"Error loading document vectors: {e}")
         
     # Load SVM model
     try:
-        with open('models/classifier.pkl', 'rb') as f:
-            resources['svm'] = pickle.load(f)
-        with open('models/vectorizer.pkl', 'rb') as f:
-            resources['vectorizer'] = pickle.load(f)
+        if not reuse(['classifier.pkl', 'vectorizer.pkl'], ['svm', 'vectorizer', 'svm_version']):
+            with open(paths['classifier.pkl'], 'rb') as f:
+                resources['svm'] = pickle.load(f)
+            with open(paths['vectorizer.pkl'], 'rb') as f:
+                resources['vectorizer'] = pickle.load(f)
+            resources['svm_version'] = model_version(paths['classifier.pkl'], paths['vectorizer.pkl'])
     except Exception as e:
-        st.error(f"Error loading SVM Classifier: {e}")
+        resources['errors'].append(f"Error loading SVM Classifier: {e}")
 
     # Load BERT model
     try:
-        model_path = 'models/bert_classifier'
-        if os.path.exists(model_path):
+        model_path = paths['bert_classifier']
+        if not reuse(['bert_classifier'], ['bert_tokenizer', 'bert_model', 'bert_version']) and \
+                os.path.exists(model_path):
             resources['bert_tokenizer'] = DistilBertTokenizer.from_pretrained(model_path)
             resources['bert_model'] = DistilBertForSequenceClassification.from_pretrained(model_path)
+            resources['bert_version'] = model_version(model_path)
+    except Exception as e:
+        resources['errors'].append(f"Error loading BERT Classifier: {e}")
+
+    # Load autocomplete trie
+    try:
+        if not reuse(['autocomplete.npz'], ['suggestions']) and os.path.exists(paths['autocomplete.npz']):
+            resources['suggestions'] = SuggestionTrie.load(paths['autocomplete.npz'])
+    except Exception as e:
+        resources['errors'].append(f"Error loading suggestions: {e}")
+
+    # classifier outputs by text and model version, checked before any model runs;
+    # one connection for the life of the process
+    try:
+        if not reuse([], ['inference_cache']):
+            resources['inference_cache'] = InferenceCache()
+    except Exception as e:
+        resources['errors'].append(f"Error opening inference cache: {e}")
+
+    # Load cross-encoder re-ranker
+    try:
+        if os.path.exists(paths['bert_reranker']) and 'original_docs' in resources:
+            if reuse(['bert_reranker'], ['reranker']):
+                # same model, reading the new version's documents
+                resources['reranker'] = copy.copy(previous['reranker'])
+                resources['reranker'].passages = resources['original_docs']
+                resources['reranker'].cache = OrderedDict()
+            else:
+                resources['reranker'] = CrossEncoderReranker(resources['original_docs'], paths['bert_reranker'])
     except Exception as e:
-        st.error(f"Error loading BERT Classifier: {e}")
+        resources['errors'].append(f"Error loading re-ranker: {e}")
         
     return resources
 
+@st.cache_resource
+def resource_watcher():
+    # one per server process: loads the live snapshot, then swaps in newly
+    # published ones in the background (see snapshots.py)
+    return SnapshotWatcher(load_resources)
+
+def set_query(text):
+    st.session_state['query'] = text
+
+def more_results(query, resources):
+    # next page from the cursor, continuing the ranking cached by the first page
+    paged = st.session_state['paged']
+    results, cursor = search_page(query, resources['bm25'], resources['documents'], cursor=paged['cursor'],
+                                  speller=resources.get('speller'), passages=resources.get('passages'))
+    paged['results'] = paged['results'] + results
+    paged['cursor'] = cursor
+
+def log_query(query, filename='data/query_log.txt'):
+    # feeds autocomplete.py and the benchmarks
+    try:
+        with open(filename, 'a', encoding='utf-8') as f:
+            f.write(' '.join(query.split()) + '\n')
+    except OSError:
+        pass
+
+# longer texts are shown without highlighting, the regexes would run over all of it
+HIGHLIGHT_CHARS = 20000
+
 def highlight_text(text, query):
     if not query:
         return text
@@ -111,10 +237,18 @@ def highlight_text(text, query):
         highlighted = pattern.sub(r'<span style="background-color: #FFFF00; color: black; font-weight: bold;">\1</span>', highlighted)
     return highlighted
 
-resources = load_resources()
+# one version for the whole rerun, even if a newer one is swapped in meanwhile
+index_version, resources = resource_watcher().get()
+for error in resources['errors']:
+    st.error(error)
 
 # Sidebar navigation menu
-page = st.sidebar.selectbox("Navigate", ["Search", "Classify", "Corpus Stats"])
+pages = ["Search", "Classify", "Corpus Stats"]
+if instrument.ENABLED:
+    pages.append("Metrics")
+page = st.sidebar.selectbox("Navigate", pages)
+if index_version:
+    st.sidebar.caption(f"Index version {index_version}")
 
 if page == "Search":
     # Centered search layout
@@ -130,7 +264,22 @@ if page == "Search":
             st.markdown("<h1 style='text-align: center; color: #4285F4;'>Malayalam Search</h1>", unsafe_allow_html=True)
             
         # Search input field
-        query = st.text_input("", placeholder="Search Malayalam Documents...", label_visibility="collapsed")
+        query = st.text_input("", placeholder="Search Malayalam Documents...", label_visibility="collapsed", key='query')
+
+        # completions of what was typed, clicking one searches for it
+        if query and 'suggestions' in resources:
+            completions = [c for c in suggest(resources['suggestions'], query, k=5) if c != query.strip()]
+            if completions:
+                s_cols = st.columns(len(completions))
+                for s_col, completion in zip(s_cols, completions):
+                    with s_col:
+                        st.button(completion, key=f"suggest_{completion}", on_click=set_query, args=(completion,))
+        
+        modes = ["BM25", "Vector", "Hybrid"] if 'vectors' in resources else ["BM25"]
+        if 'substrings' in resources:
+            modes.append("Substring")
+        mode = st.radio("Ranking", modes, horizontal=True, label_visibility="collapsed")
+        rerank = 'reranker' in resources and st.checkbox("Re-rank with BERT")
         
         # Action buttons
         b_col1, b_col2, b_col3, b_col4 = st.columns([1, 2, 2, 1])
@@ -142,25 +291,59 @@ if page == "Search":
     # Display search results
     if query: # Streamlit reruns on enter in text_input
         if 'bm25' in resources:
-            results = search(query, resources['bm25'], resources['documents'], top_k=10)
+            cursor = None
+            with stage('search'):
+                if mode == "Substring":
+                    results = resources['substrings'].search(query, resources['documents'], top_k=10)
+                elif mode == "BM25" and not rerank:
+                    # kept across reruns, "More results" appends the following pages
+                    paged = st.session_state.get('paged')
+                    if paged is None or paged['key'] != (query, index_version):
+                        first, next_cursor = search_page(query, resources['bm25'], resources['documents'],
+                                                         speller=resources.get('speller'),
+                                                         passages=resources.get('passages'))
+                        paged = {'key': (query, index_version), 'results': first, 'cursor': next_cursor}
+                        st.session_state['paged'] = paged
+                    results, cursor = paged['results'], paged['cursor']
+                else:
+                    results = search(query, resources['bm25'], resources['documents'], top_k=10,
+                                     mode=mode.lower(), vectors=resources.get('vectors'),
+                                     reranker=resources['reranker'] if rerank else None,
+                                     speller=resources.get('speller'), passages=resources.get('passages'))
+                # a root inside compound words is no index term, look for it as a substring
+                if mode != "Substring" and not results and 'substrings' in resources:
+                    results = resources['substrings'].search(query, resources['documents'], top_k=10)
+                    if results:
+                        st.info("No matching terms, showing documents that contain the query inside words")
             
+            # streamlit reruns on every click, log each search once
+            if st.session_state.get('logged_query') != query:
+                log_query(query)
+                st.session_state['logged_query'] = query
             st.markdown(f"About {len(results)} results")
             
-            for i, res in enumerate(results):
-                doc_id = res['doc_id']
-                score = res['score']
-                text = resources['original_docs'][doc_id]
-                
-                # Create text snippet
-                snippet = text[:300] + "..." if len(text) > 300 else text
-                highlighted_snippet = highlight_text(snippet, query)
-                
-                st.markdown(f"### [{doc_id}] Document {doc_id}")
-                st.markdown(f"<small style='color:green'>Score: {score:.4f}</small>", unsafe_allow_html=True)
-                st.markdown(highlighted_snippet, unsafe_allow_html=True)
-                with st.expander("View Full Text"):
-                    st.markdown(highlight_text(text, query), unsafe_allow_html=True)
-                st.markdown("---")
+            with stage('render'):
+                for i, res in enumerate(results):
+                    doc_id = res['doc_id']
+                    score = res['score']
+                    text = resources['original_docs'][doc_id]
+                    
+                    # Create text snippet, the best passage when there is a passage index
+                    snippet = res.get('snippet') or (text[:300] + "..." if len(text) > 300 else text)
+                    highlighted_snippet = highlight_text(snippet, query)
+                    
+                    st.markdown(f"### [{doc_id}] Document {doc_id}")
+                    st.markdown(f"<small style='color:green'>Score: {score:.4f}</small>", unsafe_allow_html=True)
+                    st.markdown(highlighted_snippet, unsafe_allow_html=True)
+                    with st.expander("View Full Text"):
+                        if len(text) <= HIGHLIGHT_CHARS:
+                            st.markdown(highlight_text(text, query), unsafe_allow_html=True)
+                        else:
+                            st.text(text)
+                    st.markdown("---")
+
+            if cursor:
+                st.button("More results", on_click=more_results, args=(query, resources))
                 
     elif lucky_clicked:
         if 'documents' in resources:
@@ -180,15 +363,22 @@ elif page == "Classify":
     with col1:
         if st.button("Classify with SVM"):
             if 'svm' in resources and input_text:
-                # Preprocess input text
-                cleaned = clean_malayalam_text(input_text)
-                tokens = tokenize_malayalam(cleaned)
-                processed_text = ' '.join(tokens)
+                def svm_outputs(texts):
+                    # Preprocess input text
+                    processed = [' '.join(tokenize_malayalam(clean_malayalam_text(t))) for t in texts]
+                    
+                    # Vectorize and predict
+                    with stage('svm_transform'):
+                        vec = resources['vectorizer'].transform(processed)
+                    # decision values, the linear svm has no probabilities
+                    with stage('svm_predict'):
+                        return resources['svm'].decision_function(vec), None
                 
-                # Vectorize and predict
-                vec = resources['vectorizer'].transform([processed_text])
-                # Predict
-                pred = resources['svm'].predict(vec)[0]
+                if 'inference_cache' in resources:
+                    logits, _ = resources['inference_cache'].cached(resources['svm_version'], [input_text], svm_outputs)
+                else:
+                    logits, _ = svm_outputs([input_text])
+                pred = svm_labels(resources['svm'], np.asarray(logits).reshape(1, -1))[0]
                 
                 if pred == 1:
                     st.success("SVM Prediction: **Politics (രാഷ്ട്രീയം)**")
@@ -202,16 +392,29 @@ elif page == "Classify":
     with col2:
         if st.button("Classify with BERT"):
             if 'bert_model' in resources and input_text:
-                # Tokenize input text
-                inputs = resources['bert_tokenizer'](input_text, return_tensors="pt", truncation=True, padding=True, max_length=128)
-                # Predict with BERT
-                with torch.no_grad():
-                    outputs = resources['bert_model'](**inputs)
+                # the model reads 128 tokens, so long texts go in as a batch of passages
+                # and the text counts as politics when any passage does
+                texts = passage_texts(input_text, CLASSIFY_WORDS, CLASSIFY_STRIDE, MAX_CLASSIFY_PASSAGES) or [input_text]
                 
-                logits = outputs.logits
-                probs = torch.nn.functional.softmax(logits, dim=-1)
-                pred = torch.argmax(probs, dim=-1).item()
-                confidence = probs[0][pred].item()
+                def bert_outputs(batch):
+                    # only passages missing from the cache get here
+                    with stage('bert_tokenize'):
+                        inputs = resources['bert_tokenizer'](batch, return_tensors="pt", truncation=True, padding=True, max_length=128)
+                    # Predict with BERT
+                    with stage('bert_forward'), torch.no_grad():
+                        outputs = resources['bert_model'](**inputs)
+                    logits = outputs.logits
+                    return logits.numpy(), torch.nn.functional.softmax(logits, dim=-1).numpy()
+                
+                if 'inference_cache' in resources:
+                    _, probs = resources['inference_cache'].cached(resources['bert_version'], texts, bert_outputs)
+                else:
+                    _, probs = bert_outputs(texts)
+                best = int(np.argmax(probs[:, 1]))
+                pred = int(np.argmax(probs[best]))
+                confidence = float(probs[best][pred])
+                if len(texts) > 1:
+                    st.caption(f"Classified as {len(texts)} passages")
                 
                 if pred == 1:
                     st.success(f"BERT Prediction: **Politics (രാഷ്ട്രീയം)** (Conf: {confidence:.2f})")
@@ -230,23 +433,38 @@ elif page == "Corpus Stats":
         num_docs = len(resources['documents'])
         col1.metric("Total Documents", num_docs)
         
-        # Calculate vocabulary stats
-        all_tokens = []
-        for doc in resources['documents']:
-            all_tokens.extend(doc.split())
+        # Calculate vocabulary stats from the index instead of the texts
+        bm25 = resources['bm25']
+        if not getattr(bm25, 'postings', None):
+            bm25.build_index()
+        word_counts = Counter({word: int(tfs.sum()) for word, (_, tfs) in bm25.postings.items()})
         
-        vocab_size = len(set(all_tokens))
+        vocab_size = len(word_counts)
         col2.metric("Vocabulary Size", vocab_size)
         
-        avg_len = len(all_tokens) / num_docs
+        avg_len = bm25.avg_len
         col3.metric("Avg Doc Length", f"{avg_len:.0f} words")
         
         st.subheader("Top 20 Frequent Words")
-        word_counts = Counter(all_tokens)
         common_words = word_counts.most_common(20)
         
         df = pd.DataFrame(common_words, columns=['Word', 'Count'])
         st.bar_chart(df.set_index('Word'))
         
         st.subheader("Sample Documents")
-        st.json(resources['original_docs'][:3])
+        st.json([resources['original_docs'][i] for i in range(min(3, num_docs))])
+
+elif page == "Metrics":
+    st.header("Stage Timings")
+    stats = instrument.snapshot()
+    if stats['stages']:
+        rows = [{'stage': name, 'count': v['count'], 'mean ms': v['mean_ms'], 'p50 ms': v['p50_ms'],
+                 'p95 ms': v['p95_ms'], 'p99 ms': v['p99_ms']} for name, v in stats['stages'].items()]
+        st.dataframe(pd.DataFrame(rows).set_index('stage'))
+    else:
+        st.write("No timings recorded yet.")
+    
+    st.download_button("Download Prometheus metrics", instrument.prometheus_text(), file_name="metrics.prom")
+    st.download_button("Download JSON", json.dumps(stats, indent=2), file_name="metrics.json")
+    if st.button("Reset"):
+        instrument.reset()
@@ -0,0 +1,188 @@
+# Query autocomplete from a compact array backed trie
+# completions are corpus words whose stem is an index term, weighted by document
+# frequency, plus past searches from data/query_log.txt.
+# every node stores its best completions so a lookup is one walk down the prefix
+
+import os
+import json
+import pickle
+import time
+import argparse
+import numpy as np
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from preprocess import clean_malayalam_text, tokenize_malayalam, simple_stem
+from retrieval import BM25  # needed to unpickle the index
+
+TOP_K = 8
+QUERY_LOG_WEIGHT = 5  # one logged search counts as much as 5 documents
+
+class SuggestionTrie:
+    def __init__(self, first_child, num_children, labels, top_offsets, top_ids, weights, blob, offsets):
+        # node i's children are the nodes first_child[i] ... + num_children[i], sorted by label;
+        # labels[j] is the character on the edge into node j.
+        # the completions of node i are top_ids[top_offsets[i]:top_offsets[i + 1]], best first.
+        # plain typed arrays: compact, and indexing them from python is cheap
+        self.first_child = array('i', first_child)
+        self.num_children = array('i', num_children)
+        self.labels = array('i', labels)
+        self.top_offsets = array('i', top_offsets)
+        self.top_ids = array('i', top_ids)
+        self.weights = array('d', weights)
+        # completion strings as one utf-8 blob
+        self.blob = bytes(blob)
+        self.offsets = array('q', offsets)
+
+    def __len__(self):
+        return len(self.weights)
+
+    @classmethod
+    def build(cls, weighted, k=TOP_K):
+        # weighted: {completion: weight}
+        items = sorted(weighted.items(), key=lambda kv: (-kv[1], kv[0]))
+
+        # dict trie first; strings go in by weight, so the first k to reach
+        # a node are its k heaviest completions
+        children = [{}]
+        top = [[]]
+        for sid, (s, _) in enumerate(items):
+            node = 0
+            if len(top[0]) < k:
+                top[0].append(sid)
+            for ch in s:
+                nxt = children[node].get(ch)
+                if nxt is None:
+                    nxt = children[node][ch] = len(children)
+                    children.append({})
+                    top.append([])
+                node = nxt
+                if len(top[node]) < k:
+                    top[node].append(sid)
+
+        # flatten breadth first so the children of every node are contiguous
+        n = len(children)
+        order = [0]
+        first_child = np.zeros(n, dtype=np.int32)
+        num_children = np.zeros(n, dtype=np.int32)
+        labels = np.zeros(n, dtype=np.int32)
+        i = 0
+        while i < len(order):
+            kids = sorted(children[order[i]].items())
+            first_child[i] = len(order)
+            num_children[i] = len(kids)
+            for ch, child in kids:
+                labels[len(order)] = ord(ch)
+                order.append(child)
+            i += 1
+
+        top_offsets = np.zeros(n + 1, dtype=np.int32)
+        top_offsets[1:] = np.cumsum([len(top[old]) for old in order])
+        top_ids = np.array([sid for old in order for sid in top[old]], dtype=np.int32)
+
+        encoded = [s.encode('utf-8') for s, _ in items]
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        weights = np.array([w for _, w in items], dtype=np.float64)
+        return cls(first_child, num_children, labels, top_offsets, top_ids, weights, b''.join(encoded), offsets)
+
+    def find(self, prefix):
+        # node reached by prefix, or -1
+        node = 0
+        for ch in prefix:
+            lo = self.first_child[node]
+            hi = lo + self.num_children[node]
+            c = ord(ch)
+            j = bisect_left(self.labels, c, lo, hi)
+            if j == hi or self.labels[j] != c:
+                return -1
+            node = j
+        return node
+
+    def string(self, sid):
+        return self.blob[self.offsets[sid]:self.offsets[sid + 1]].decode('utf-8')
+
+    def complete(self, prefix, k=TOP_K):
+        # [(completion, weight)] best first
+        node = self.find(prefix)
+        if node < 0:
+            return []
+        start = self.top_offsets[node]
+        end = min(self.top_offsets[node + 1], start + k)
+        return [(self.string(s), self.weights[s]) for s in self.top_ids[start:end]]
+
+    def save(self, filename):
+        np.savez(filename, **{name: np.frombuffer(getattr(self, name), dtype=np.uint8) if name == 'blob'
+                             else np.asarray(getattr(self, name))
+                             for name in ('first_child', 'num_children', 'labels', 'top_offsets',
+                                          'top_ids', 'weights', 'blob', 'offsets')})
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            return cls(**{name: f[name] for name in f.files})
+
+def suggest(trie, query, k=TOP_K):
+    # completes the whole query (logged searches, single words) and its last word
+    text = ' '.join(clean_malayalam_text(query).split())
+    if not text:
+        return []
+    found = dict(trie.complete(text, k))
+    head, _, last = text.rpartition(' ')
+    if head:
+        for word, w in trie.complete(last, k):
+            found.setdefault(head + ' ' + word, w)
+    return [s for s, _ in sorted(found.items(), key=lambda kv: -kv[1])[:k]]
+
+def load_query_log(filename='data/query_log.txt'):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def suggestion_weights(original_docs, vocab, queries):
+    # surface forms, so completions are real words rather than stems
+    df = Counter()
+    for text in original_docs:
+        words = set(tokenize_malayalam(clean_malayalam_text(text), stem=False))
+        df.update(w for w in words if simple_stem(w) in vocab)
+    weighted = {w: float(c) for w, c in df.items()}
+    for q, c in Counter(' '.join(clean_malayalam_text(q).split()) for q in queries).items():
+        if q:
+            weighted[q] = weighted.get(q, 0.0) + QUERY_LOG_WEIGHT * c
+    return weighted
+
+def main():
+    parser = argparse.ArgumentParser(description="build the autocomplete trie")
+    parser.add_argument('--corpus', default='data/processed_corpus.json')
+    parser.add_argument('--index', default='models/bm25_index.pkl')
+    parser.add_argument('--queries', default='data/query_log.txt')
+    parser.add_argument('--output', default='models/autocomplete.npz')
+    args = parser.parse_args()
+
+    print("loading data...")
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    with open(args.index, 'rb') as f:
+        bm25 = pickle.load(f)
+    queries = load_query_log(args.queries)
+
+    print("building trie...")
+    weighted = suggestion_weights([item.get('original_text', item['text']) for item in data], bm25.idf, queries)
+    trie = SuggestionTrie.build(weighted)
+    trie.save(args.output)
+    size = os.path.getsize(args.output)
+    print(f"{len(trie)} completions, {len(trie.labels)} nodes, {size / 1024:.0f} KB -> {args.output}")
+
+    # lookup latency over every one and two character prefix
+    prefixes = sorted({w[:n] for w in weighted for n in (1, 2)})
+    t = time.perf_counter()
+    for p in prefixes:
+        suggest(trie, p)
+    print(f"{(time.perf_counter() - t) * 1e6 / max(1, len(prefixes)):.1f} us per lookup")
+
+    for p in ('വാ', 'സിനി'):
+        print(f"{p}: {suggest(trie, p)}")
+
+if __name__ == '__main__':
+    main()
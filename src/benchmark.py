@@ -0,0 +1,271 @@
+# Retrieval benchmark on synthetic corpora
+# words are drawn from the real corpus with their real (zipfian) frequencies
+
+import os
+import sys
+import json
+import time
+import pickle
+import platform
+import argparse
+import subprocess
+import numpy as np
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from preprocess import tokenize_malayalam
+from retrieval import BM25, search
+from evaluate import TEST_QUERIES
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+CONCURRENCY = [1, 2, 4, 8]
+
+def build_bm25(processed_docs, original_docs):
+    bm25 = BM25(processed_docs)
+    return bm25, lambda q, k: search(q, bm25, original_docs, top_k=k)
+
+def build_impact(processed_docs, original_docs):
+    from impact_index import ImpactIndex
+    bm25 = BM25(processed_docs)
+    bm25.use_impact(ImpactIndex.build(bm25))
+    return bm25, lambda q, k: search(q, bm25, original_docs, top_k=k)
+
+def build_vector(processed_docs, original_docs):
+    from vector_search import build_vectors, VectorIndex
+    index = VectorIndex(*build_vectors(processed_docs))
+    return index, lambda q, k: search(q, None, original_docs, top_k=k, mode='vector', vectors=index)
+
+def build_ann(processed_docs, original_docs):
+    from ann_index import IVFPQIndex
+    index, _ = build_vector(processed_docs, original_docs)
+    index.use_ann(IVFPQIndex.build(index.matrix))
+    return index, lambda q, k: search(q, None, original_docs, top_k=k, mode='vector', vectors=index)
+
+def build_hybrid(processed_docs, original_docs):
+    bm25 = BM25(processed_docs)
+    vectors, _ = build_vector(processed_docs, original_docs)
+    return (bm25, vectors), lambda q, k: search(q, bm25, original_docs, top_k=k, mode='hybrid', vectors=vectors)
+
+# name -> builder(processed_docs, original_docs) returning (index, search_fn)
+ENGINES = {
+    'bm25': build_bm25,
+    'impact': build_impact,
+    'vector': build_vector,
+    'ann': build_ann,
+    'hybrid': build_hybrid,
+}
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # not available on windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+def load_word_stats(corpus_file):
+    with open(corpus_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    counts = Counter()
+    lengths = []
+    for item in data:
+        words = item['original_text'].split()
+        counts.update(words)
+        lengths.append(len(words))
+
+    words, freqs = zip(*counts.most_common())
+    probs = np.array(freqs, dtype=np.float64)
+    return list(words), probs / probs.sum(), np.array(lengths)
+
+def synthetic_corpus(num_docs, words, probs, lengths, seed=0, max_len=400):
+    rng = np.random.default_rng(seed)
+    # document lengths follow the real corpus, capped so 1M docs fit in memory
+    doc_lens = np.clip(rng.choice(lengths, size=num_docs), 5, max_len)
+    vocab = np.array(words, dtype=object)
+
+    docs = []
+    # generate in chunks to keep the id arrays small
+    chunk = 10_000
+    for start in range(0, num_docs, chunk):
+        lens = doc_lens[start:start + chunk]
+        ids = rng.choice(len(words), size=int(lens.sum()), p=probs)
+        bounds = np.concatenate([[0], np.cumsum(lens)])
+        for i in range(len(lens)):
+            docs.append(' '.join(vocab[ids[bounds[i]:bounds[i + 1]]]))
+    return docs
+
+def load_query_log(words, probs, num_queries=500, seed=1, filename='data/query_log.txt'):
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+        if queries:
+            return queries[:num_queries]
+
+    # no log yet: test queries plus 1-3 word queries from mid frequency words
+    rng = np.random.default_rng(seed)
+    mid = np.arange(50, min(len(words), 5000))
+    queries = [text for _, text in TEST_QUERIES]
+    while len(queries) < num_queries:
+        n = rng.integers(1, 4)
+        queries.append(' '.join(words[i] for i in rng.choice(mid, size=n)))
+    return queries
+
+def percentiles(latencies):
+    ms = np.array(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+    }
+
+def measure_qps(search_fn, queries, workers, top_k):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda q: search_fn(q, top_k), queries))
+    elapsed = time.perf_counter() - start
+    return len(queries) / elapsed if elapsed > 0 else 0.0
+
+def run_case(engine, num_docs, corpus_file, num_queries, top_k, seed):
+    # runs in its own process so peak rss belongs to this case only
+    words, probs, lengths = load_word_stats(corpus_file)
+
+    t = time.perf_counter()
+    original_docs = synthetic_corpus(num_docs, words, probs, lengths, seed=seed)
+    generate_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    processed_docs = [' '.join(tokenize_malayalam(d)) for d in original_docs]
+    preprocess_s = time.perf_counter() - t
+
+    t = time.perf_counter()
+    index, search_fn = ENGINES[engine](processed_docs, original_docs)
+    build_s = time.perf_counter() - t
+
+    index_bytes = len(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL))
+    queries = load_query_log(words, probs, num_queries)
+
+    # warm up, then replay the log one query at a time
+    for q in queries[:5]:
+        search_fn(q, top_k)
+    latencies = []
+    for q in queries:
+        t = time.perf_counter()
+        search_fn(q, top_k)
+        latencies.append(time.perf_counter() - t)
+
+    result = {
+        'engine': engine,
+        'num_docs': num_docs,
+        'num_queries': len(queries),
+        'generate_s': generate_s,
+        'preprocess_s': preprocess_s,
+        'build_s': build_s,
+        'index_bytes': index_bytes,
+        'latency': percentiles(latencies),
+        'qps': {str(w): measure_qps(search_fn, queries, w, top_k) for w in CONCURRENCY},
+    }
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def _case_worker(args, conn):
+    try:
+        conn.send(run_case(*args))
+    except Exception as e:
+        conn.send({'engine': args[0], 'num_docs': args[1], 'error': repr(e)})
+    conn.close()
+
+def run_isolated(*args):
+    ctx = mp.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_case_worker, args=(args, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except (EOFError, OSError) as e:
+        # the child died without sending (out of memory, killed, crashed in c
+        # code); record it and go on with the next case
+        result = {'engine': args[0], 'num_docs': args[1], 'error': f"worker died: {e!r}"}
+    proc.join()
+    if 'error' in result and proc.exitcode:
+        result['error'] += f" (exit code {proc.exitcode})"
+    return result
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(old_file, new_results, threshold=0.2):
+    # flag cases whose p95 latency or qps got worse by more than threshold
+    with open(old_file, 'r', encoding='utf-8') as f:
+        old = {(r['engine'], r['num_docs']): r for r in json.load(f)['results'] if 'error' not in r}
+
+    regressions = []
+    for r in new_results:
+        prev = old.get((r['engine'], r['num_docs']))
+        if prev is None or 'error' in r:
+            continue
+        # a previous p95 of 0 (timer resolution) gives no ratio, compare nothing there
+        p95 = r['latency']['p95_ms'] / prev['latency']['p95_ms'] - 1 if prev['latency']['p95_ms'] else 0
+        qps = 1 - r['qps']['1'] / prev['qps']['1'] if prev['qps']['1'] else 0
+        print(f"{r['engine']} @ {r['num_docs']}: p95 {p95:+.1%}, qps(1) {-qps:+.1%}")
+        if p95 > threshold or qps > threshold:
+            regressions.append((r['engine'], r['num_docs']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="retrieval latency and throughput benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES))
+    parser.add_argument('--corpus', default='data/processed_corpus.json')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help="previous results json to check for regressions")
+    args = parser.parse_args()
+
+    results = []
+    for engine in args.engines:
+        for size in args.sizes:
+            print(f"benchmarking {engine} on {size} docs...")
+            r = run_isolated(engine, size, args.corpus, args.queries, args.top_k, args.seed)
+            if 'error' in r:
+                print(f"  failed: {r['error']}")
+            else:
+                lat = r['latency']
+                print(f"  build {r['build_s']:.2f}s, index {r['index_bytes'] / 1e6:.1f} MB, "
+                      f"p50 {lat['p50_ms']:.2f} ms, p95 {lat['p95_ms']:.2f} ms, p99 {lat['p99_ms']:.2f} ms, "
+                      f"peak rss {r['peak_rss_mb']} MB")
+                print("  qps: " + ', '.join(f"{w} threads {q:.0f}" for w, q in r['qps'].items()))
+            results.append(r)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+    output = args.output or f"results/benchmarks/bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results saved to {output}")
+
+    if args.compare:
+        regressions = compare(args.compare, results)
+        if regressions:
+            print(f"regressions: {regressions}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import json
+from passages import split_passages
 
 with open('data/processed_corpus.json', 'r', encoding='utf-8') as f:
     data = json.load(f)
@@ -13,3 +14,7 @@ long_docs = [i for i, l in enumerate(lengths) if l > 100000]
 print(f"Docs > 100k chars: {len(long_docs)}")
 if long_docs:
     print(f"Example long doc ID: {long_docs[0]}")
+
+# what the passage index (passages.py) turns them into
+num_passages = [len(split_passages(d.get('original_text', d['text']))) for d in data]
+print(f"Passages: {sum(num_passages)}, most in one doc: {max(num_passages)}")
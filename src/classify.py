@@ -7,6 +7,7 @@ from sklearn.svm import SVC
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import precision_score, recall_score, f1_score, classification_report
 import pickle
+from keywords import label_documents
 
 def load_data(filename):
     # Load processed data
@@ -16,30 +17,8 @@ def load_data(filename):
     texts = [item['text'] for item in data]
     
     # Create labels for politics
-    # Check for political keywords
-    political_keywords = [
-        "രാഷ്ട്രീയം", "രാഷ്ട്രീയ", # Politics
-        "തിരഞ്ഞെടുപ്പ്", # Election
-        "സിപിഎം", "സി.പി.എം", # CPM
-        "കോൺഗ്രസ്", # Congress
-        "ബിജെപി", "ബി.ജെ.പി", # BJP
-        "എൽഡിഎഫ്", "എൽ.ഡി.എഫ്", # LDF
-        "യുഡിഎഫ്", "യു.ഡി.എഫ്", # UDF
-        "സർക്കാർ", # Government
-        "മന്ത്രി", # Minister
-        "പാർട്ടി", # Party
-        "നേതാവ്", # Leader
-        "സ്ഥാനാർഥി", # Candidate
-        "വോട്ട്" # Vote
-    ]
-    
-    labels = []
-    for item in data:
-        text = item.get('original_text', item['text'])
-        if any(k in text for k in political_keywords):
-            labels.append(1)
-        else:
-            labels.append(0)
+    # Check for political keywords, all of them in one pass per document
+    labels = label_documents(item.get('original_text', item['text']) for item in data)
     
     print(f"Positive samples (Politics): {sum(labels)}")
     print(f"Negative samples: {len(labels) - sum(labels)}")
@@ -7,6 +7,8 @@ import random
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import precision_score, recall_score, f1_score
 from transformers import DistilBertTokenizer, DistilBertForSequenceClassification, Trainer, TrainingArguments
+from keywords import label_documents
+from passages import passage_texts, CLASSIFY_WORDS, CLASSIFY_STRIDE
 
 class MalayalamDataset(torch.utils.data.Dataset):
     def __init__(self, encodings, labels):
@@ -27,30 +29,13 @@ def load_data(filename):
     # Use original text
     texts = [item.get('original_text', item['text']) for item in data]
     
-    # Create labels for politics
-    political_keywords = [
-        "രാഷ്ട്രീയം", "രാഷ്ട്രീയ", # Politics
-        "തിരഞ്ഞെടുപ്പ്", # Election
-        "സിപിഎം", "സി.പി.എം", # CPM
-        "കോൺഗ്രസ്", # Congress
-        "ബിജെപി", "ബി.ജെ.പി", # BJP
-        "എൽഡിഎഫ്", "എൽ.ഡി.എഫ്", # LDF
-        "യുഡിഎഫ്", "യു.ഡി.എഫ്", # UDF
-        "സർക്കാർ", # Government
-        "മന്ത്രി", # Minister
-        "പാർട്ടി", # Party
-        "നേതാവ്", # Leader
-        "സ്ഥാനാർഥി", # Candidate
-        "വോട്ട്" # Vote
-    ]
-
-    labels = []
-    for item in data:
-        text = item.get('original_text', item['text'])
-        if any(k in text for k in political_keywords):
-            labels.append(1)
-        else:
-            labels.append(0)
+    # the model only reads 128 tokens, so train on passages that fit and label each
+    # passage by its own keywords rather than a keyword the truncation would cut off
+    texts = [p for text in texts for p in passage_texts(text, CLASSIFY_WORDS, CLASSIFY_STRIDE)]
+    print(f"{len(data)} documents -> {len(texts)} passages")
+    
+    # Create labels for politics, all keywords in one pass per document
+    labels = label_documents(texts)
             
     print(f"Positive samples (Politics): {sum(labels)}")
     
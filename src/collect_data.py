@@ -1,9 +1,12 @@
 # Collect Malayalam text from web
 
+import re
 import requests
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 import json
-import time
+from urllib.parse import urljoin, urlsplit
+from crawler import crawl
 
 # List of websites to scrape
 MALAYALAM_SITES = [
@@ -16,23 +19,110 @@ MALAYALAM_SITES = [
     'https://www.madhyamam.com/',
 ]
 
+# Tags that never hold article text
+BOILERPLATE_TAGS = ['script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside',
+                    'form', 'iframe', 'svg', 'button', 'select', 'template']
+
+# Tags that start a new text block
+BLOCK_TAGS = {'p', 'div', 'article', 'section', 'main', 'li', 'ul', 'ol', 'dl', 'dd', 'dt',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'table', 'tr', 'td', 'th',
+              'figure', 'figcaption', 'body'}
+
+MALAYALAM_CHARS = re.compile(r'[\u0D00-\u0D7F]')
+SPACES = re.compile(r'\s+')
+
+MIN_BLOCK_CHARS = 50
+MIN_MALAYALAM_RATIO = 0.3
+MAX_LINK_DENSITY = 0.5
+
+def malayalam_ratio(text):
+    letters = len(text) - text.count(' ')
+    return len(MALAYALAM_CHARS.findall(text)) / letters if letters else 0
+
+def parse_page(content, url):
+    # Pull Malayalam text blocks and links from a page
+    # one walk over the tree; text goes to its nearest block ancestor only,
+    # so nested divs never repeat their children's text
+    # lxml is given bytes: a str that starts with an xml encoding declaration is
+    # refused with a ValueError. utf-8 when the bytes are utf-8, else whatever
+    # charset the page declares
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    parser = None
+    try:
+        content.decode('utf-8')
+        # one parser per call, lxml parsers are not shared between threads
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+    except UnicodeDecodeError:
+        pass
+    try:
+        root = lxml.html.fromstring(content, parser=parser)
+    except (etree.ParserError, ValueError):
+        return [], []
+    
+    # links first, menus are boilerplate for text but still worth following
+    links = [urljoin(url, href) for href in root.xpath('//a/@href')]
+    etree.strip_elements(root, *BOILERPLATE_TAGS, with_tail=False)
+    
+    blocks = []  # [pieces, link chars]
+    stack = [(root, None, False)]
+    while stack:
+        item = stack.pop()
+        if item[0] == 'tail':
+            # text after a closing tag belongs to the enclosing block
+            _, text, owner, in_link = item
+            if owner is not None:
+                blocks[owner][0].append(text)
+                if in_link:
+                    blocks[owner][1] += len(text)
+            continue
+        
+        elem, owner, in_link = item
+        tag = elem.tag if isinstance(elem.tag, str) else None
+        if tag is None:
+            # comments and processing instructions
+            continue
+        
+        if tag in BLOCK_TAGS:
+            blocks.append([[], 0])
+            inner = len(blocks) - 1
+        else:
+            inner = owner
+        
+        in_link_inner = in_link or tag == 'a'
+        
+        if elem.text and inner is not None:
+            blocks[inner][0].append(elem.text)
+            if in_link_inner:
+                blocks[inner][1] += len(elem.text)
+        
+        # push children in reverse so they pop in document order
+        for child in reversed(elem):
+            if child.tail:
+                stack.append(('tail', child.tail, inner, in_link_inner))
+            stack.append((child, inner, in_link_inner))
+    
+    text_data = []
+    for pieces, link_chars in blocks:
+        text = SPACES.sub(' ', ' '.join(pieces)).strip()
+        if len(text) <= MIN_BLOCK_CHARS:
+            continue
+        # navigation menus are mostly link text
+        if link_chars / len(text) > MAX_LINK_DENSITY:
+            continue
+        # Check for Malayalam content
+        if malayalam_ratio(text) < MIN_MALAYALAM_RATIO:
+            continue
+        text_data.append(text)
+    
+    return text_data, links
+
 def get_malayalam_text(url):
     # Fetch page content
     try:
         response = requests.get(url, timeout=10)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Find text elements
-        paragraphs = soup.find_all(['p', 'div', 'article', 'section'])
-        
-        text_data = []
-        for elem in paragraphs:
-            text = elem.get_text(separator=' ').strip()
-            # Check for Malayalam content
-            if len(text) > 50 and any('\u0D00' <= c <= '\u0D7F' for c in text):
-                text_data.append(text)
-        
+        text_data, _ = parse_page(response.content, url)
         return text_data
     
     except Exception as e:
@@ -48,15 +138,12 @@ def save_collected_data(data, filename='data/malayalam_corpus.json'):
 def main():
     print("starting collection...")
     
-    all_texts = []
-    
-    # Scrape each site
-    for site in MALAYALAM_SITES:
-        print(f"scraping {site}")
-        texts = get_malayalam_text(site)
-        all_texts.extend(texts)
-        time.sleep(2)
+    # Crawl all sites concurrently, staying on their domains
+    domains = [urlsplit(site).netloc for site in MALAYALAM_SITES]
+    crawler = crawl(MALAYALAM_SITES, parse_page, allowed_domains=domains,
+                    max_depth=1, max_pages=500, per_host=2, delay=2.0)
     
+    all_texts = crawler.corpus()
     print(f"total collected: {len(all_texts)}")
     
     # Save collected data
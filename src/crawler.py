@@ -0,0 +1,216 @@
+# Async crawler with per host politeness and incremental state
+# pages seen before are re-requested with If-None-Match / If-Modified-Since,
+# so a rerun only downloads what changed
+
+import os
+import json
+import time
+import asyncio
+import aiohttp
+from urllib.parse import urljoin, urlsplit, urldefrag
+from urllib.robotparser import RobotFileParser
+
+USER_AGENT = 'MalayalamIRBot/1.0 (CS410 course project)'
+
+def normalize_url(url, base=None):
+    if base:
+        url = urljoin(base, url)
+    url, _ = urldefrag(url)
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        return None
+    return url
+
+class Crawler:
+    def __init__(self, parse, state_file='data/crawl_state.json', allowed_domains=None,
+                 max_pages=500, max_depth=1, concurrency=16, per_host=2, delay=1.0,
+                 recrawl_after=0, timeout=10, respect_robots=True):
+        # parse(content_bytes, url) -> (texts, links)
+        self.parse = parse
+        self.state_file = state_file
+        self.allowed_domains = set(allowed_domains or [])
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.recrawl_after = recrawl_after
+        self.timeout = timeout
+        self.respect_robots = respect_robots
+
+        self.pages = {}
+        self.load_state()
+
+        self.host_slots = {}
+        self.host_next = {}
+        self.robots = {}
+        self.stats = {'fetched': 0, 'not_modified': 0, 'skipped': 0, 'errors': 0, 'blocked': 0}
+
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self.pages = json.load(f).get('pages', {})
+
+    def save_state(self):
+        # write then rename so a crash never leaves half a state file
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': time.time(), 'pages': self.pages}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_file)
+
+    def is_allowed(self, url):
+        parts = urlsplit(url)
+        if not self.allowed_domains:
+            return True
+        host = parts.hostname or ''
+        for d in self.allowed_domains:
+            if parts.netloc == d or host == d or host.endswith('.' + d):
+                return True
+        return False
+
+    def corpus(self):
+        # texts of every page in the order pages were first discovered
+        texts = []
+        for page in self.pages.values():
+            texts.extend(page.get('texts', []))
+        return texts
+
+    def enqueue(self, url, depth):
+        if url in self.seen or len(self.seen) >= self.max_pages:
+            return
+        self.seen.add(url)
+        self.queue.put_nowait((url, depth))
+
+    async def wait_turn(self, host):
+        # space out request starts to the same host
+        now = time.monotonic()
+        start = max(now, self.host_next.get(host, now))
+        self.host_next[host] = start + self.delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def allowed_by_robots(self, session, url):
+        if not self.respect_robots:
+            return True
+        parts = urlsplit(url)
+        root = f"{parts.scheme}://{parts.netloc}"
+        if root not in self.robots:
+            # placeholder so other workers wait on the same fetch
+            self.robots[root] = asyncio.get_running_loop().create_future()
+            rp = RobotFileParser()
+            try:
+                async with session.get(root + '/robots.txt') as resp:
+                    if resp.status == 200:
+                        rp.parse((await resp.text(errors='ignore')).splitlines())
+                    else:
+                        rp.allow_all = True
+            except Exception:
+                rp.allow_all = True
+            finally:
+                # resolved even when this worker is cancelled mid fetch, every
+                # other worker for the host is waiting on it
+                if not rp.last_checked:
+                    rp.allow_all = True
+                self.robots[root].set_result(rp)
+        rp = await self.robots[root]
+        return rp.can_fetch(USER_AGENT, url)
+
+    async def fetch(self, session, url, depth):
+        page = self.pages.get(url, {})
+        links = page.get('links', [])
+        now = time.time()
+
+        if self.recrawl_after and now - page.get('fetched_at', 0) < self.recrawl_after:
+            # fetched recently, reuse what we have
+            self.stats['skipped'] += 1
+        elif not await self.allowed_by_robots(session, url):
+            self.stats['blocked'] += 1
+            return
+        else:
+            headers = {}
+            if page.get('etag'):
+                headers['If-None-Match'] = page['etag']
+            if page.get('last_modified'):
+                headers['If-Modified-Since'] = page['last_modified']
+
+            host = urlsplit(url).netloc
+            slot = self.host_slots.setdefault(host, asyncio.Semaphore(self.per_host))
+            async with slot:
+                await self.wait_turn(host)
+                async with session.get(url, headers=headers) as resp:
+                    if resp.status == 304:
+                        self.stats['not_modified'] += 1
+                        page['fetched_at'] = now
+                    elif resp.status == 200:
+                        content = await resp.read()
+                        # parsing is cpu work, keep it off the event loop
+                        texts, links = await asyncio.get_running_loop().run_in_executor(
+                            None, self.parse, content, str(resp.url))
+                        page.update({
+                            'etag': resp.headers.get('ETag'),
+                            'last_modified': resp.headers.get('Last-Modified'),
+                            'fetched_at': now,
+                            'texts': texts,
+                            'links': links,
+                        })
+                        self.stats['fetched'] += 1
+                    else:
+                        print(f"error: {url} returned {resp.status}")
+                        self.stats['errors'] += 1
+                        if url in self.pages:
+                            # gone or broken now, its old texts should not stay in the corpus
+                            page.update({'etag': None, 'last_modified': None, 'texts': [], 'links': []})
+                        return
+
+        page['depth'] = min(depth, page.get('depth', depth))
+        self.pages[url] = page
+
+        if depth < self.max_depth:
+            for link in links:
+                link = normalize_url(link)
+                if link and self.is_allowed(link):
+                    self.enqueue(link, depth + 1)
+
+    async def worker(self, session):
+        while True:
+            url, depth = await self.queue.get()
+            try:
+                await self.fetch(session, url, depth)
+            except Exception as e:
+                print(f"error: {url}: {e}")
+                self.stats['errors'] += 1
+            finally:
+                self.queue.task_done()
+
+    async def run(self, seeds):
+        self.queue = asyncio.Queue()
+        self.seen = set()
+
+        for url in seeds:
+            url = normalize_url(url)
+            if url:
+                self.enqueue(url, 0)
+        # revisit known pages too, conditional requests keep this cheap
+        for url, page in list(self.pages.items()):
+            if page.get('depth', 0) <= self.max_depth:
+                self.enqueue(url, page.get('depth', 0))
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={'User-Agent': USER_AGENT}) as session:
+            workers = [asyncio.create_task(self.worker(session)) for _ in range(self.concurrency)]
+            await self.queue.join()
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        self.save_state()
+        return self.stats
+
+def crawl(seeds, parse, **kwargs):
+    crawler = Crawler(parse, **kwargs)
+    stats = asyncio.run(crawler.run(seeds))
+    print(f"crawl stats: {stats}")
+    return crawler
@@ -0,0 +1,193 @@
+# Near-duplicate removal with MinHash + LSH
+# runs between collect_data.py and preprocess.py
+
+import os
+import json
+import zlib
+import argparse
+import tempfile
+import numpy as np
+from preprocess import clean_malayalam_text
+
+PRIME = (1 << 31) - 1
+NUM_PERM = 128
+BANDS = 16            # 16 bands x 8 rows, candidates from about 0.7 jaccard
+SHINGLE_SIZE = 3
+THRESHOLD = 0.8       # estimated jaccard needed to call two passages duplicates
+SHINGLE_CHUNK = 4096  # bounds the (num_perm x shingles) temp array
+
+def iter_passages(filename):
+    # .jsonl is streamed line by line, plain .json is a list of strings
+    if filename.endswith('.jsonl'):
+        with open(filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(filename, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+class MinHasher:
+    def __init__(self, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)[:, None]
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.word_hashes = {}
+
+    def shingles(self, text):
+        words = clean_malayalam_text(text).split()
+        ids = np.empty(len(words), dtype=np.uint64)
+        for i, w in enumerate(words):
+            h = self.word_hashes.get(w)
+            if h is None:
+                h = self.word_hashes[w] = zlib.crc32(w.encode('utf-8')) % PRIME
+            ids[i] = h
+        k = self.shingle_size
+        if len(ids) < k:
+            # short passage, hash it as one shingle
+            return np.array([ids.sum() % PRIME if len(ids) else 0], dtype=np.uint64)
+        # combine k word hashes positionally, all mod PRIME so products fit in 64 bits
+        h = np.zeros(len(ids) - k + 1, dtype=np.uint64)
+        for j in range(k):
+            h = (h * np.uint64(31) + ids[j:len(ids) - k + 1 + j]) % PRIME
+        return np.unique(h)
+
+    def signature(self, text):
+        sig = np.full(self.num_perm, PRIME, dtype=np.uint64)
+        sh = self.shingles(text)
+        for start in range(0, len(sh), SHINGLE_CHUNK):
+            part = sh[start:start + SHINGLE_CHUNK][None, :]
+            sig = np.minimum(sig, ((self.a * part + self.b) % PRIME).min(axis=1))
+        return sig.astype(np.uint32)
+
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def union(parent, i, j):
+    ri, rj = find(parent, i), find(parent, j)
+    if ri != rj:
+        # lower id stays the representative so the first copy is kept
+        if ri < rj:
+            parent[rj] = ri
+        else:
+            parent[ri] = rj
+
+def cluster(signatures, bands=BANDS, threshold=THRESHOLD):
+    # lsh banding: sort each band's hashes, equal hashes are candidates
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = np.arange(n, dtype=np.int64)
+    weights = np.random.default_rng(7).integers(1, 1 << 61, size=rows, dtype=np.uint64)
+
+    for band in range(bands):
+        keys = np.zeros(n, dtype=np.uint64)
+        # chunked so the memmapped signatures never load at once
+        for start in range(0, n, 100_000):
+            block = np.asarray(signatures[start:start + 100_000, band * rows:(band + 1) * rows], dtype=np.uint64)
+            keys[start:start + len(block)] = (block * weights).sum(axis=1)
+
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        # start of every run of equal keys with more than one member
+        boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [n]])
+        for s, e in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            members = np.sort(order[s:e])
+            head = members[0]
+            head_sig = np.asarray(signatures[head])
+            sims = (np.asarray(signatures[members[1:]]) == head_sig).mean(axis=1)
+            for m in members[1:][sims >= threshold]:
+                union(parent, head, m)
+
+    return np.array([find(parent, i) for i in range(n)], dtype=np.int64)
+
+def dedupe(input_file, output_file, report_file=None, threshold=THRESHOLD, num_perm=NUM_PERM, bands=BANDS):
+    print("computing minhash signatures...")
+    hasher = MinHasher(num_perm)
+
+    # signatures live in a memmap so memory stays flat for millions of passages
+    tmp = tempfile.NamedTemporaryFile(suffix='.npy', delete=False)
+    tmp.close()
+    capacity = 1 << 16
+    signatures = np.lib.format.open_memmap(tmp.name, mode='w+', dtype=np.uint32, shape=(capacity, num_perm))
+    n = 0
+    for text in iter_passages(input_file):
+        if n == capacity:
+            signatures.flush()
+            del signatures
+            capacity *= 2
+            signatures = _grow(tmp.name, capacity, num_perm)
+        signatures[n] = hasher.signature(text)
+        n += 1
+
+    print(f"clustering {n} passages...")
+    roots = cluster(signatures[:n], bands, threshold)
+    keep = roots == np.arange(n)
+    del signatures
+    os.remove(tmp.name)
+
+    # second pass writes the kept passages in their original order
+    kept = 0
+    with open(output_file, 'w', encoding='utf-8') as f:
+        jsonl = output_file.endswith('.jsonl')
+        if not jsonl:
+            f.write('[\n')
+        for i, text in enumerate(iter_passages(input_file)):
+            if not keep[i]:
+                continue
+            line = json.dumps(text, ensure_ascii=False)
+            if jsonl:
+                f.write(line + '\n')
+            else:
+                f.write((',\n' if kept else '') + '  ' + line)
+            kept += 1
+        if not jsonl:
+            f.write('\n]\n')
+
+    sizes = np.bincount(roots, minlength=n)
+    report = {
+        'input': input_file,
+        'passages': n,
+        'kept': kept,
+        'removed': n - kept,
+        'removed_ratio': (n - kept) / n if n else 0.0,
+        'duplicate_clusters': int((sizes > 1).sum()),
+        'largest_clusters': [int(s) for s in np.sort(sizes)[::-1][:10] if s > 1],
+        'threshold': threshold,
+        'num_perm': num_perm,
+        'bands': bands,
+    }
+    print(f"kept {kept} of {n} passages ({report['removed_ratio']:.1%} removed)")
+    if report_file:
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def _grow(filename, capacity, num_perm):
+    # reopen the memmap with room for more rows, keeping what is written
+    old = np.load(filename, mmap_mode='r')
+    tmp = filename + '.grow'
+    grown = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint32, shape=(capacity, num_perm))
+    for start in range(0, len(old), 100_000):
+        block = old[start:start + 100_000]
+        grown[start:start + len(block)] = block
+    grown.flush()
+    del old, grown
+    os.replace(tmp, filename)
+    return np.load(filename, mmap_mode='r+')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="remove near-duplicate passages")
+    parser.add_argument('--input', default='data/malayalam_corpus.json')
+    parser.add_argument('--output', default='data/deduped_corpus.json')
+    parser.add_argument('--report', default='data/dedupe_report.json')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    dedupe(args.input, args.output, args.report, args.threshold)
@@ -0,0 +1,236 @@
+# Compressed document store with random access by doc id
+# original text of BLOCK_SIZE documents per compressed block, blocks back to back in
+# docs.bin. doc i lives in block i // BLOCK_SIZE, so a fetch is two array lookups,
+# one mmap slice and (on a cache miss) one block decompression
+
+import os
+import json
+import mmap
+import zlib
+import argparse
+import itertools
+import threading
+import numpy as np
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOCK_SIZE = 64
+CACHE_BLOCKS = 256
+
+def compressor(codec, level):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress
+    return lambda data: zlib.compress(data, level)
+
+def decompressor(codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("docstore was written with zstd, pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress
+    return zlib.decompress
+
+class DocStore:
+    def __init__(self, directory, cache_blocks=CACHE_BLOCKS):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.block_size = meta['block_size']
+        self.num_docs = meta['num_docs']
+        self.decompress = decompressor(meta['codec'])
+
+        # block i is docs.bin[block_offsets[i]:block_offsets[i + 1]],
+        # doc j is bytes doc_spans[j] of its decompressed block
+        self.block_offsets = np.load(os.path.join(directory, 'block_offsets.npy'))
+        self.doc_spans = np.load(os.path.join(directory, 'doc_spans.npy'), mmap_mode='r')
+        self.file = open(os.path.join(directory, 'docs.bin'), 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.block_offsets[-1] else b''
+
+        self.cache = OrderedDict()
+        self.cache_blocks = cache_blocks
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.num_docs
+
+    def block(self, b):
+        with self.lock:
+            raw = self.cache.get(b)
+            if raw is not None:
+                self.cache.move_to_end(b)
+                self.hits += 1
+                return raw
+        raw = self.decompress(self.data[self.block_offsets[b]:self.block_offsets[b + 1]])
+        with self.lock:
+            self.misses += 1
+            self.cache[b] = raw
+            while len(self.cache) > self.cache_blocks:
+                self.cache.popitem(last=False)
+        return raw
+
+    def __getitem__(self, doc_id):
+        if doc_id < 0:
+            doc_id += self.num_docs
+        if not 0 <= doc_id < self.num_docs:
+            raise IndexError(doc_id)
+        start, end = self.doc_spans[doc_id]
+        return self.block(doc_id // self.block_size)[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(self.num_docs):
+            yield self[i]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+def write_blocks(out, texts, block_size, compress, block_offsets, doc_spans):
+    # compress texts into blocks at the end of out, extending the offset and span lists
+    pending = []
+    pos = 0
+
+    def flush():
+        out.write(compress(b''.join(pending)))
+        block_offsets.append(out.tell())
+        pending.clear()
+
+    for text in texts:
+        encoded = text.encode('utf-8')
+        doc_spans.append((pos, pos + len(encoded)))
+        pending.append(encoded)
+        pos += len(encoded)
+        if len(pending) == block_size:
+            flush()
+            pos = 0
+    if pending:
+        flush()
+
+def save_layout(directory, block_offsets, doc_spans, meta):
+    np.save(os.path.join(directory, 'block_offsets.npy'), np.array(block_offsets, dtype=np.int64))
+    np.save(os.path.join(directory, 'doc_spans.npy'), np.array(doc_spans, dtype=np.uint32).reshape(-1, 2))
+    # meta.json last, it holds the doc count readers trust
+    tmp = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+def build_docstore(texts, directory, block_size=BLOCK_SIZE, codec=None, level=None):
+    # texts: any iterable of strings, written in order so doc ids match the corpus
+    codec = codec or ('zstd' if zstandard is not None else 'zlib')
+    level = level or (19 if codec == 'zstd' else 9)
+    os.makedirs(directory, exist_ok=True)
+
+    block_offsets = [0]
+    doc_spans = []
+    with open(os.path.join(directory, 'docs.bin'), 'wb') as out:
+        write_blocks(out, texts, block_size, compressor(codec, level), block_offsets, doc_spans)
+
+    save_layout(directory, block_offsets, doc_spans,
+                {'num_docs': len(doc_spans), 'block_size': block_size, 'codec': codec, 'level': level})
+    return len(doc_spans)
+
+def append_docstore(texts, directory):
+    # add texts after the last doc; only a partly filled last block is rewritten.
+    # not safe against readers of the same directory, serve a snapshot (snapshots.py)
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return build_docstore(texts, directory)
+    with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    block_size = meta['block_size']
+    block_offsets = np.load(os.path.join(directory, 'block_offsets.npy')).tolist()
+    doc_spans = [tuple(span) for span in np.load(os.path.join(directory, 'doc_spans.npy')).tolist()]
+
+    with open(os.path.join(directory, 'docs.bin'), 'r+b') as out:
+        carry = []
+        tail = meta['num_docs'] % block_size
+        if tail:
+            # reopen the last block and write it again together with the new texts
+            out.seek(block_offsets[-2])
+            raw = decompressor(meta['codec'])(out.read(block_offsets[-1] - block_offsets[-2]))
+            carry = [raw[start:end].decode('utf-8') for start, end in doc_spans[-tail:]]
+            del doc_spans[-tail:]
+            block_offsets.pop()
+        out.seek(block_offsets[-1])
+        out.truncate()
+        write_blocks(out, itertools.chain(carry, texts), block_size,
+                     compressor(meta['codec'], meta['level']), block_offsets, doc_spans)
+
+    added = len(doc_spans) - meta['num_docs']
+    meta['num_docs'] = len(doc_spans)
+    save_layout(directory, block_offsets, doc_spans, meta)
+    return added
+
+def truncate_docstore(directory, num_docs):
+    # drop every doc from num_docs on, e.g. the ones a killed writer added after its
+    # last commit; a block cut in two is written again with the docs that stay
+    with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['num_docs'] <= num_docs:
+        return 0
+    block_size = meta['block_size']
+    block_offsets = np.load(os.path.join(directory, 'block_offsets.npy')).tolist()
+    doc_spans = [tuple(span) for span in np.load(os.path.join(directory, 'doc_spans.npy')).tolist()]
+
+    full = num_docs // block_size
+    with open(os.path.join(directory, 'docs.bin'), 'r+b') as out:
+        carry = []
+        if num_docs % block_size:
+            out.seek(block_offsets[full])
+            raw = decompressor(meta['codec'])(out.read(block_offsets[full + 1] - block_offsets[full]))
+            carry = [raw[start:end].decode('utf-8') for start, end in doc_spans[full * block_size:num_docs]]
+        del block_offsets[full + 1:]
+        del doc_spans[full * block_size:]
+        out.seek(block_offsets[-1])
+        out.truncate()
+        write_blocks(out, carry, block_size, compressor(meta['codec'], meta['level']), block_offsets, doc_spans)
+
+    removed = meta['num_docs'] - len(doc_spans)
+    meta['num_docs'] = len(doc_spans)
+    save_layout(directory, block_offsets, doc_spans, meta)
+    return removed
+
+def open_docstore(directory='data/docstore'):
+    # None when no store was built, callers fall back to the corpus json
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+    return DocStore(directory)
+
+def load_documents(directory='data/docstore', corpus_file='data/processed_corpus.json', num_docs=None):
+    # original text by doc id: the compressed store when built, else the corpus json.
+    # num_docs: documents in the index the ids come from; a store with another
+    # count (not rebuilt, or cut short) is passed over, a corpus too is an error
+    store = open_docstore(directory)
+    if store is not None:
+        if num_docs is None or len(store) == num_docs:
+            return store
+        print(f"{directory} has {len(store)} docs but the index has {num_docs}, reading {corpus_file}")
+        store.close()
+    with open(corpus_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if num_docs is not None and len(data) != num_docs:
+        raise ValueError(f"{corpus_file} has {len(data)} docs but the index has {num_docs}, "
+                         f"rebuild the document store and the index with the pipeline")
+    return [item.get('original_text', item['text']) for item in data]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="build the compressed document store")
+    parser.add_argument('--corpus', default='data/processed_corpus.json')
+    parser.add_argument('--output', default='data/docstore')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+
+    print("loading corpus...")
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    print("writing blocks...")
+    n = build_docstore((item.get('original_text', item['text']) for item in data), args.output, args.block_size)
+
+    raw = sum(len(item.get('original_text', item['text']).encode('utf-8')) for item in data)
+    size = sum(os.path.getsize(os.path.join(args.output, name)) for name in os.listdir(args.output))
+    print(f"{n} documents, {raw / 1024:.0f} KB of text -> {size / 1024:.0f} KB in {args.output}")
@@ -1,129 +1,80 @@
 # Evaluation metrics
 
-import numpy as np
+import os
+import copy
 import pickle
 import json
 from retrieval import BM25, search
+from fuzzy import SymSpell
+from docstore import load_documents
+from metrics import Qrels, per_query_table, summarize, compare_runs, format_table
 
-def precision_at_k(retrieved, relevant, k):
-    # Calculate Precision@K
-    retrieved_at_k = retrieved[:k]
-    relevant_count = sum(1 for doc in retrieved_at_k if doc in relevant)
-    return relevant_count / k if k > 0 else 0
-
-def recall_at_k(retrieved, relevant, k):
-    # Calculate Recall@K
-    if not relevant:
-        return 0
-    retrieved_at_k = retrieved[:k]
-    relevant_count = sum(1 for doc in retrieved_at_k if doc in relevant)
-    return relevant_count / len(relevant)
-
-def average_precision(retrieved, relevant):
-    # Calculate Average Precision
-    if not relevant:
-        return 0
-    
-    precision_sum = 0
-    num_relevant = 0
-    
-    for i, doc in enumerate(retrieved):
-        if doc in relevant:
-            num_relevant += 1
-            precision_sum += num_relevant / (i + 1)
-    
-    return precision_sum / len(relevant)
-
-def mean_average_precision(queries_results, queries_relevant):
-    # Calculate Mean Average Precision
-    aps = []
-    
-    for query in queries_results:
-        retrieved = queries_results[query]
-        relevant = queries_relevant.get(query, [])
-        ap = average_precision(retrieved, relevant)
-        aps.append(ap)
-    
-    return sum(aps) / len(aps) if aps else 0
-
-def dcg_at_k(relevances, k):
-    # Calculate DCG
-    relevances = relevances[:k]
-    dcg = 0
-    
-    for i, rel in enumerate(relevances):
-        dcg += rel / np.log2(i + 2)
-    
-    return dcg
-
-def ndcg_at_k(relevances, k):
-    # Calculate NDCG
-    dcg = dcg_at_k(relevances, k)
-    
-    ideal_relevances = sorted(relevances, reverse=True)
-    idcg = dcg_at_k(ideal_relevances, k)
-    
-    return dcg / idcg if idcg > 0 else 0
+TEST_QUERIES = [
+    ("vaarttha", "വാർത്ത"),
+    ("kaayikam", "കായികം"),
+    ("rashtreeyam", "രാഷ്ട്രീയം"),
+    ("cinema", "സിനിമ"),
+    ("technology", "സാങ്കേതികവിദ്യ ടെക്നോളജി")
+]
 
 def evaluate_system(queries_results, queries_relevant, k=10):
     # Evaluate system performance
     print(f"evaluating top-{k}...")
     
-    precisions = []
-    recalls = []
-    aps = []
-    
-    for query in queries_results:
-        retrieved = queries_results[query]
-        relevant = queries_relevant.get(query, [])
-        
-        p = precision_at_k(retrieved, relevant, k)
-        r = recall_at_k(retrieved, relevant, k)
-        ap = average_precision(retrieved, relevant)
-        
-        precisions.append(p)
-        recalls.append(r)
-        aps.append(ap)
+    qrels = Qrels(queries_relevant)
+    table = per_query_table(queries_results, qrels, list(queries_results), k)
+    scores = summarize(table)
     
     # Calculate average scores
-    avg_precision = sum(precisions) / len(precisions) if precisions else 0
-    avg_recall = sum(recalls) / len(recalls) if recalls else 0
+    avg_precision = scores[f'P@{k}']
+    avg_recall = scores[f'R@{k}']
     avg_f1 = 2 * avg_precision * avg_recall / (avg_precision + avg_recall) if (avg_precision + avg_recall) > 0 else 0
-    map_score = sum(aps) / len(aps) if aps else 0
+    
+    print("\nper query:")
+    print(format_table({q: {name: table[name][i] for name in table if name != 'query'}
+                        for i, q in enumerate(table['query'])}, first_col='query'))
     
     print(f"\nprecision@{k}: {avg_precision:.3f}")
     print(f"recall@{k}: {avg_recall:.3f}")
     print(f"f1@{k}: {avg_f1:.3f}")
-    print(f"MAP: {map_score:.3f}")
+    print(f"MAP: {scores['AP']:.3f}")
+    print(f"NDCG@{k}: {scores[f'NDCG@{k}']:.3f}")
+    print(f"MRR: {scores['RR']:.3f}")
     
     return {
         'precision': avg_precision,
         'recall': avg_recall,
         'f1': avg_f1,
-        'map': map_score
+        'map': scores['AP'],
+        'ndcg': scores[f'NDCG@{k}'],
+        'mrr': scores['RR']
     }
 
+def run_queries(search_fn, queries, top_k=10):
+    # collect {query_id: [doc ids]} for one ranking configuration
+    return {query_id: [r['doc_id'] for r in search_fn(query_text, top_k)]
+            for query_id, query_text in queries}
+
+def compare_systems(search_fns, queries, qrels, k=10, baseline=None):
+    # run several ranking configurations and compare them side by side
+    runs = {name: run_queries(fn, queries, top_k=max(k, 100)) for name, fn in search_fns.items()}
+    comparison, tables = compare_runs(runs, qrels, baseline=baseline, k=k)
+    print(format_table(comparison))
+    return comparison, tables
+
 def load_retrieval_system():
     # load bm25 index
     try:
         with open('models/bm25_index.pkl', 'rb') as f:
             bm25 = pickle.load(f)
-        with open('data/processed_corpus.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        documents = [item['text'] for item in data]
+        documents = load_documents(num_docs=len(bm25.doc_len))
         return bm25, documents
     except:
         return None, None
 
 def save_results_for_labeling(bm25, documents):
     # save search results
-    test_queries = [
-        ("vaarttha", "വാർത്ത"),
-        ("kaayikam", "കായികം"),
-        ("rashtreeyam", "രാഷ്ട്രീയം"),
-        ("cinema", "സിനിമ"),
-        ("technology", "സാങ്കേതികവിദ്യ ടെക്നോളജി")
-    ]
+    test_queries = TEST_QUERIES
     
     results_for_labeling = {}
     
@@ -181,13 +132,7 @@ def run_queries_and_evaluate(bm25, documents):
         save_results_for_labeling(bm25, documents)
         return None
     
-    test_queries = [
-        ("vaarttha", "വാർത്ത"),
-        ("kaayikam", "കായികം"),
-        ("rashtreeyam", "രാഷ്ട്രീയം"),
-        ("cinema", "സിനിമ"),
-        ("technology", "സാങ്കേതികവിദ്യ ടെക്നോളജി")
-    ]
+    test_queries = TEST_QUERIES
     
     queries_results = {}
     queries_relevant = {}
@@ -217,16 +162,90 @@ def run_queries_and_evaluate(bm25, documents):
     
     for query_id in queries_results:
         retrieved = queries_results[query_id]
-        relevant = queries_relevant[query_id]
+        relevant = set(queries_relevant[query_id])
         print(f"\n{query_id}:")
         print(f"  retrieved: {retrieved}")
-        print(f"  relevant: {relevant}")
+        print(f"  relevant: {sorted(relevant)}")
         print(f"  matches: {[d for d in retrieved[:10] if d in relevant]}")
     
     metrics = evaluate_system(queries_results, queries_relevant, k=10)
     
     return metrics
 
+def compare_ranking_modes(bm25, documents, vectors=None, reranker=None, reranker_queries=None):
+    # bm25 baseline against fuzzy, vector, hybrid and re-ranked retrieval on the judged queries
+    try:
+        with open('data/relevance_judgments.json', 'r', encoding='utf-8') as f:
+            qrels = Qrels(json.load(f))
+    except Exception as e:
+        print(f"no judgments file: {e}")
+        return None
+    
+    queries = [(qid, text) for qid, text in TEST_QUERIES if qid in qrels.query_index]
+    search_fns = {'bm25': lambda q, k: search(q, bm25, documents, top_k=k)}
+    speller = SymSpell.from_index(bm25)
+    search_fns['bm25+fuzzy'] = lambda q, k: search(q, bm25, documents, top_k=k, speller=speller)
+    if os.path.exists('models/impact_index.npz'):
+        from impact_index import ImpactIndex
+        impact = ImpactIndex.load('models/impact_index.npz')
+        if impact.matches(bm25):
+            # same index, scored from the 8 bit impacts
+            impact_bm25 = copy.copy(bm25)
+            impact_bm25.use_impact(impact)
+            search_fns['bm25-impact'] = lambda q, k: search(q, impact_bm25, documents, top_k=k)
+    if os.path.exists('models/passage_index.pkl'):
+        from passages import PassageIndex
+        passages = PassageIndex.load('models/passage_index.pkl')
+        if passages.matches(bm25):
+            # documents ranked by their best passage, or their best two added up
+            search_fns['bm25-passages'] = lambda q, k: search(q, bm25, documents, top_k=k, passages=passages)
+            search_fns['bm25-passages-sum'] = lambda q, k: search(q, bm25, documents, top_k=k, passages=passages,
+                                                                  aggregate='sum')
+    if vectors is not None:
+        search_fns['vector'] = lambda q, k: search(q, bm25, documents, top_k=k, mode='vector', vectors=vectors)
+        search_fns['hybrid-rrf'] = lambda q, k: search(q, bm25, documents, top_k=k, mode='hybrid', vectors=vectors)
+        search_fns['hybrid-weighted'] = lambda q, k: search(q, bm25, documents, top_k=k, mode='hybrid', vectors=vectors, fusion='weighted')
+    
+    print("\n--- ranking modes vs bm25 ---")
+    comparison, _ = compare_systems(search_fns, queries, qrels, k=10, baseline='bm25')
+    if reranker is not None:
+        # the reranker is trained on judged queries, score it only on the ones it never saw
+        unseen = [(qid, text) for qid, text in queries if qid in (reranker_queries or ())]
+        if not unseen:
+            print("\nno held out queries for the reranker, retrain it with rerank.py to compare it")
+        else:
+            print(f"\n--- bm25+rerank on {len(unseen)} held out queries ---")
+            rerank_fns = {'bm25': search_fns['bm25'],
+                          'bm25+rerank': lambda q, k: search(q, bm25, documents, top_k=k, reranker=reranker)}
+            compare_systems(rerank_fns, unseen, qrels, k=10, baseline='bm25')
+    return comparison
+
+def load_vectors(num_docs):
+    # vector index only counts if it was built for this corpus
+    try:
+        from vector_search import load_vector_index
+        vectors = load_vector_index()
+    except Exception as e:
+        print(f"no vector index: {e}")
+        return None
+    if len(vectors) != num_docs:
+        print("vector index does not match the corpus, run vector_search.py")
+        return None
+    return vectors
+
+def load_reranker(num_docs=None):
+    # optional second stage, needs torch and a model trained by rerank.py;
+    # (reranker, ids of the queries it was not trained on)
+    if not os.path.exists('models/bert_reranker'):
+        return None, None
+    try:
+        from rerank import CrossEncoderReranker, heldout_queries
+        # generous budget, evaluation is about quality not latency
+        return CrossEncoderReranker(load_documents(num_docs=num_docs), budget_ms=60000), heldout_queries()
+    except Exception as e:
+        print(f"no reranker: {e}")
+        return None, None
+
 if __name__ == '__main__':
     print("loading system...")
     
@@ -236,6 +255,9 @@ if __name__ == '__main__':
         print("system not found")
     else:
         print(f"loaded {len(documents)} docs")
-        run_queries_and_evaluate(bm25, documents)
+        if run_queries_and_evaluate(bm25, documents) is not None:
+            vectors = load_vectors(len(documents))
+            reranker, reranker_queries = load_reranker(len(documents))
+            compare_ranking_modes(bm25, documents, vectors, reranker, reranker_queries)
     
     print("\ndone")
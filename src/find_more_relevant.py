@@ -1,20 +1,22 @@
 # find extra relevant docs
 
 import pickle
-import json
-from retrieval import search
+from retrieval import BM25
+from docstore import load_documents
+from paging import search_page
 
 # load system
 with open('models/bm25_index.pkl', 'rb') as f:
     bm25 = pickle.load(f)
-with open('data/processed_corpus.json', 'r', encoding='utf-8') as f:
-    data = json.load(f)
 
-documents = [item['text'] for item in data]
+documents = load_documents(num_docs=len(bm25.doc_len))
 
-# check ranks 11-30
+# check ranks 11-30, the second request continues where the first page stopped
 print("checking ranks 11-30...")
-results = search('വാർത്ത', bm25, documents, top_k=30)
-for r in results[10:30]:
+_, cursor = search_page('വാർത്ത', bm25, documents, page_size=10)
+results = []
+if cursor:
+    results, _ = search_page('വാർത്ത', bm25, documents, page_size=20, cursor=cursor)
+for r in results:
     print(f"\nDoc {r['doc_id']} (score: {r['score']:.3f}):")
     print(f"  {r['text'][:150]}")
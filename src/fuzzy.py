@@ -0,0 +1,153 @@
+# Fuzzy term expansion with a symmetric delete (SymSpell style) index
+# edits are counted in Malayalam grapheme clusters, so a missing vowel sign or a
+# wrong conjunct is one edit instead of two or three code points.
+# every vocabulary term is stored under all its deletes up to MAX_DISTANCE, and a
+# query term only needs its own deletes looked up, no scan over the vocabulary
+
+import re
+import time
+
+MAX_DISTANCE = 2
+PREFIX_LENGTH = 7     # only the first clusters are indexed, keeps the delete table small
+MAX_EXPANSIONS = 3
+# share of a real match's bm25 score an expansion gets, by edit distance
+EXPANSION_WEIGHTS = {0: 1.0, 1: 0.5, 2: 0.25}
+
+CONSONANT = '[\u0D15-\u0D3A]'
+SIGN = '[\u0D00-\u0D03\u0D3E-\u0D4C\u0D57\u0D62\u0D63]'
+VIRAMA = '\u0D4D\u200D?'
+# consonant + (virama + consonant)* conjunct, vowel signs, optional trailing virama (chillu);
+# anything else is one character plus its signs
+GRAPHEME = re.compile(f'{CONSONANT}(?:{VIRAMA}{CONSONANT})*{SIGN}*(?:{VIRAMA})?|.{SIGN}*', re.S)
+
+def graphemes(word):
+    return GRAPHEME.findall(word)
+
+def deletes(clusters, max_distance):
+    # every sequence reachable by removing up to max_distance clusters
+    start = tuple(clusters)
+    found = {start}
+    frontier = [start]
+    for _ in range(max_distance):
+        nxt = []
+        for c in frontier:
+            if len(c) <= 1:
+                continue
+            for i in range(len(c)):
+                d = c[:i] + c[i + 1:]
+                if d not in found:
+                    found.add(d)
+                    nxt.append(d)
+        frontier = nxt
+    return found
+
+def edit_distance(a, b, max_distance):
+    # damerau-levenshtein (adjacent swaps count once), gives up past max_distance
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # shared prefix and suffix never cost anything
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    a, b = a[start:], b[start:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if not a or not b:
+        return len(a) + len(b)
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class SymSpell:
+    def __init__(self, vocab, max_distance=MAX_DISTANCE, prefix_length=PREFIX_LENGTH):
+        # vocab: {term: document frequency}
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.terms = list(vocab)
+        self.df = [vocab[t] for t in self.terms]
+        self.clusters = [tuple(graphemes(t)) for t in self.terms]
+        self.index = {}
+        for tid, clusters in enumerate(self.clusters):
+            for d in deletes(clusters[:prefix_length], max_distance):
+                key = ''.join(d)
+                ids = self.index.get(key)
+                # most keys belong to one term, store a bare id until a second one shows up
+                if ids is None:
+                    self.index[key] = tid
+                elif isinstance(ids, int):
+                    self.index[key] = [ids, tid]
+                else:
+                    ids.append(tid)
+
+    @classmethod
+    def from_index(cls, bm25, **kwargs):
+        if not getattr(bm25, 'postings', None):
+            bm25.build_index()
+        return cls({term: len(ids) for term, (ids, _) in bm25.postings.items()}, **kwargs)
+
+    def lookup(self, term, max_distance=None):
+        # [(term, distance, df)] nearest first, then most frequent
+        clusters = tuple(graphemes(term))
+        if max_distance is None:
+            # two edits turn most short words into some other word
+            max_distance = min(self.max_distance, max(1, (len(clusters) - 1) // 2))
+        candidates = set()
+        for d in deletes(clusters[:self.prefix_length], max_distance):
+            ids = self.index.get(''.join(d))
+            if ids is None:
+                continue
+            if isinstance(ids, int):
+                candidates.add(ids)
+            else:
+                candidates.update(ids)
+
+        # the delete table only proves a prefix match, check the whole word
+        results = []
+        for tid in candidates:
+            dist = edit_distance(clusters, self.clusters[tid], max_distance)
+            if dist <= max_distance:
+                results.append((self.terms[tid], dist, self.df[tid]))
+        results.sort(key=lambda r: (r[1], -r[2], r[0]))
+        return results
+
+    def expand(self, terms, known, max_expansions=MAX_EXPANSIONS):
+        # {term: weight} for query terms missing from the index
+        expansions = {}
+        for q in terms:
+            if q in known:
+                continue
+            for term, dist, _ in self.lookup(q)[:max_expansions]:
+                w = EXPANSION_WEIGHTS.get(dist, 0.0)
+                if w > expansions.get(term, 0.0):
+                    expansions[term] = w
+        return expansions
+
+if __name__ == '__main__':
+    import pickle
+    from retrieval import BM25  # needed to unpickle the index
+
+    with open('models/bm25_index.pkl', 'rb') as f:
+        bm25 = pickle.load(f)
+
+    t = time.perf_counter()
+    speller = SymSpell.from_index(bm25)
+    print(f"{len(speller.terms)} terms, {len(speller.index)} delete keys, built in {time.perf_counter() - t:.2f}s")
+
+    # misspell known terms by dropping one cluster and time the lookups
+    words = [w for w in speller.terms if len(graphemes(w)) >= 4][:500]
+    typos = [''.join(graphemes(w)[:2] + graphemes(w)[3:]) for w in words]
+    t = time.perf_counter()
+    found = sum(w in [r[0] for r in speller.lookup(q)] for w, q in zip(words, typos))
+    print(f"recovered {found}/{len(words)} misspellings, {(time.perf_counter() - t) * 1e6 / len(words):.0f} us per lookup")
+    for q in ('വാർത', 'സനിമ'):
+        print(f"{q}: {speller.lookup(q)[:MAX_EXPANSIONS]}")
@@ -0,0 +1,236 @@
+# Impact ordered index: score-at-a-time BM25 with 8 bit precomputed scores
+# every posting stores its whole BM25 contribution quantized to 1..255, and each
+# term's postings are grouped into segments of equal impact, highest first.
+# a query adds whole segments into an integer accumulator in decreasing impact
+# order and stops once the remaining segments cannot change the top k
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from collections import Counter
+from retrieval import BM25, top_k_indices
+
+LEVELS = 255
+FIRST_CHECK = 4096  # postings before the first stopping check, doubles after each
+# below this many documents exact scoring is as fast or faster (see
+# results/impact_agreement.json and benchmark.py), and the 8 bit impacts can
+# reorder the top k. MIR_IMPACT=1 / 0 turns it on or off regardless of size
+MIN_DOCS = 1_000_000
+
+def enabled(bm25):
+    # whether search should route through an impact index for this bm25 index
+    flag = os.environ.get('MIR_IMPACT', '')
+    if flag:
+        return flag not in ('0', 'false', 'no')
+    return len(bm25.doc_len) >= MIN_DOCS
+
+class ImpactIndex:
+    def __init__(self, terms, term_offsets, seg_impacts, seg_offsets, doc_ids, scale, num_docs, k1, b, digest=None):
+        # term i owns segments term_offsets[i]:term_offsets[i + 1];
+        # segment s scores seg_impacts[s] for docs doc_ids[seg_offsets[s]:seg_offsets[s + 1]]
+        self.terms = terms
+        self.term_index = {t: i for i, t in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.seg_impacts = seg_impacts
+        self.seg_offsets = seg_offsets
+        self.doc_ids = doc_ids
+        self.scale = scale  # bm25 score of one impact unit
+        self.num_docs = num_docs
+        self.k1 = k1
+        self.b = b
+        # digest of the bm25 postings the impacts were computed from
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, bm25, levels=LEVELS):
+        if not getattr(bm25, 'postings', None):
+            bm25.build_index()
+        norm = bm25.length_norm()
+
+        def contributions(word):
+            ids, f = bm25.postings[word]
+            return ids, bm25.idf[word] * (f * (bm25.k1 + 1) / (f + norm[ids]))
+
+        # one global scale so impacts of different terms add up like the real scores
+        top = max((contributions(w)[1].max() for w in bm25.postings), default=1.0)
+        scale = top / levels
+
+        terms = sorted(bm25.postings)
+        term_offsets = [0]
+        seg_impacts, seg_offsets, doc_ids = [], [np.zeros(1, dtype=np.int64)], []
+        n = 0
+        for word in terms:
+            ids, c = contributions(word)
+            q = np.clip(np.rint(c / scale), 1, levels).astype(np.uint8)
+            # highest impact first, doc order inside a segment
+            order = np.lexsort((ids, -q.astype(np.int16)))
+            ids, q = ids[order], q[order]
+            starts = np.flatnonzero(np.concatenate([[True], q[1:] != q[:-1]]))
+            seg_impacts.append(q[starts])
+            seg_offsets.append(n + np.concatenate([starts[1:], [len(ids)]]))
+            doc_ids.append(ids)
+            n += len(ids)
+            term_offsets.append(term_offsets[-1] + len(starts))
+
+        return cls(terms, np.array(term_offsets, dtype=np.int64),
+                   np.concatenate(seg_impacts) if seg_impacts else np.zeros(0, dtype=np.uint8),
+                   np.concatenate(seg_offsets).astype(np.int64),
+                   np.concatenate(doc_ids).astype(np.int32) if doc_ids else np.zeros(0, dtype=np.int32),
+                   float(scale), len(bm25.doc_len), bm25.k1, bm25.b, bm25.digest())
+
+    def matches(self, bm25):
+        # impacts bake in k1, b and the postings, so they only stand in for this exact
+        # index; a rebuild from different documents of the same count does not match
+        if (self.k1, self.b, self.num_docs) != (bm25.k1, bm25.b, len(bm25.doc_len)):
+            return False
+        return self.digest is not None and self.digest == bm25.digest()
+
+    def top_k(self, query, k=10, max_postings=None):
+        # query: processed string. max_postings caps the work for an anytime answer,
+        # otherwise the result is the same top k as scoring every posting
+        counts = Counter(t for t in query.split() if t in self.term_index)
+        if not counts or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # every segment of every query term, with the impact of the same term's next segment
+        impacts, nexts, starts, ends = [], [], [], []
+        for t, c in counts.items():
+            i = self.term_index[t]
+            s, e = self.term_offsets[i], self.term_offsets[i + 1]
+            imp = self.seg_impacts[s:e].astype(np.int64) * c
+            impacts.append(imp)
+            nexts.append(np.concatenate([imp[1:], [0]]))
+            starts.append(self.seg_offsets[s:e])
+            ends.append(self.seg_offsets[s + 1:e + 1])
+        # upper bound on what any doc can still gain after each segment: the sum over
+        # terms of their next unprocessed impact, which starts at each term's highest
+        bound = sum(int(imp[0]) for imp in impacts)
+        impacts = np.concatenate(impacts)
+        order = np.argsort(-impacts, kind='stable')
+        remaining = bound - np.cumsum(impacts[order] - np.concatenate(nexts)[order])
+        impacts = impacts[order]
+        starts = np.concatenate(starts)[order]
+        ends = np.concatenate(ends)[order]
+        processed = np.cumsum(ends - starts)
+
+        # segments go in batches between stopping checks, checks get rarer as we go
+        last = len(impacts) if max_postings is None else min(len(impacts), int(np.searchsorted(processed, max_postings)) + 1)
+        acc = np.zeros(self.num_docs, dtype=np.int32)
+        touched = []
+        check_at = FIRST_CHECK
+        j = 0
+        while j < last:
+            end = min(last, int(np.searchsorted(processed, check_at)) + 1)
+            touched.append(self.accumulate(acc, impacts[j:end], starts[j:end], ends[j:end]))
+            j = end
+            check_at = max(check_at * 2, processed[j - 1])
+            if j < last and self.settled(acc, k, remaining[j - 1], touched):
+                break
+
+        cand = self.candidates(acc, touched)
+        top = cand[top_k_indices(acc[cand], k)]
+        return top, acc[top] * self.scale
+
+    def accumulate(self, acc, impacts, starts, ends):
+        # all postings of a run of segments at once; a doc can sit in several
+        # terms' segments, so the adds go through add.at
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        positions = offsets + np.arange(int(lengths.sum()))
+        ids = self.doc_ids[positions]
+        np.add.at(acc, ids, np.repeat(impacts, lengths).astype(np.int32))
+        return ids
+
+    def candidates(self, acc, touched):
+        # docs with a nonzero score; short queries touch far fewer than the whole corpus
+        total = sum(len(t) for t in touched)
+        if total * 32 < self.num_docs:
+            return np.unique(np.concatenate(touched)) if touched else np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(acc)
+
+    def settled(self, acc, k, remaining, touched):
+        # the top k and their order are final when no doc can close any gap:
+        # docs outside can gain at most `remaining`, and so can each doc inside
+        cand = self.candidates(acc, touched)
+        if len(cand) <= k:
+            return False
+        s = np.sort(acc[cand[top_k_indices(acc[cand], k + 1)]].astype(np.int64))[::-1]
+        return bool(np.all(s[:-1] - s[1:] > remaining))
+
+    def save(self, filename):
+        np.savez(filename, terms=np.frombuffer('\n'.join(self.terms).encode('utf-8'), dtype=np.uint8),
+                 term_offsets=self.term_offsets, seg_impacts=self.seg_impacts, seg_offsets=self.seg_offsets,
+                 doc_ids=self.doc_ids, meta=np.array([self.scale, self.num_docs, self.k1, self.b]),
+                 digest=np.frombuffer((self.digest or '').encode('ascii'), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            blob = f['terms'].tobytes().decode('utf-8')
+            scale, num_docs, k1, b = f['meta']
+            # indexes from before the digest never match, rebuild them
+            digest = f['digest'].tobytes().decode('ascii') if 'digest' in f.files else None
+            return cls(blob.split('\n') if blob else [], f['term_offsets'], f['seg_impacts'], f['seg_offsets'],
+                       f['doc_ids'], float(scale), int(num_docs), float(k1), float(b), digest or None)
+
+def agreement_report(bm25, index, queries, k=10, budgets=(None, 100_000, 10_000, 1_000)):
+    # overlap with exact bm25 top k and latency, per postings budget.
+    # a doc tied with the exact k-th score counts as a hit, ties can go either way
+    index.top_k(queries[0], k)  # warm up
+    exact = []
+    t = time.perf_counter()
+    for q in queries:
+        scores = bm25.score(q)
+        top = top_k_indices(scores, k)
+        exact.append((scores, len(top[scores[top] > 0]), scores[top].min()))
+    exact_ms = (time.perf_counter() - t) * 1000 / len(queries)
+
+    rows = []
+    for budget in budgets:
+        t = time.perf_counter()
+        found = [index.top_k(q, k, budget)[0] for q in queries]
+        ms = (time.perf_counter() - t) * 1000 / len(queries)
+        overlap = np.mean([min(n, int(np.sum(scores[f] >= kth - 1e-9 * max(1.0, kth)))) / n
+                           for (scores, n, kth), f in zip(exact, found) if n])
+        rows.append({'max_postings': budget, f'overlap@{k}': float(overlap), 'ms_per_query': ms})
+        print(f"max_postings={str(budget):<8} overlap@{k}={overlap:.3f}  {ms:.3f} ms/query")
+    print(f"exact bm25: {exact_ms:.3f} ms/query")
+    return {'k': k, 'num_queries': len(queries), 'postings': len(index),
+            'exact_ms_per_query': exact_ms, 'results': rows}
+
+def main():
+    import pickle
+    from preprocess import clean_malayalam_text, tokenize_malayalam
+    from evaluate import TEST_QUERIES
+    from autocomplete import load_query_log
+
+    parser = argparse.ArgumentParser(description="build the impact ordered index from the bm25 index")
+    parser.add_argument('--index', default='models/bm25_index.pkl')
+    parser.add_argument('--output', default='models/impact_index.npz')
+    parser.add_argument('--report', default='results/impact_agreement.json')
+    args = parser.parse_args()
+
+    with open(args.index, 'rb') as f:
+        bm25 = pickle.load(f)
+
+    print("building impact index...")
+    index = ImpactIndex.build(bm25)
+    index.save(args.output)
+    print(f"{len(index)} postings in {len(index.seg_impacts)} segments -> {args.output}")
+
+    queries = [text for _, text in TEST_QUERIES] + load_query_log()
+    queries = [' '.join(tokenize_malayalam(clean_malayalam_text(q))) for q in queries]
+    report = agreement_report(bm25, index, [q for q in queries if q])
+
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"report saved to {args.report}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Disk backed cache of classifier outputs
+# the same article texts get classified over and over: repeated pastes in the app,
+# every crawl re-labeling what it ingests. each output (logits, probabilities when
+# the model has them) is stored in one sqlite file under a hash of the model
+# version and the whitespace normalised input text, and looked up before any
+# tokenization or forward pass, so a hit costs one indexed select.
+# a new model gets a new version, old entries simply stop being asked for and
+# age out: past max_entries the least recently used rows are deleted, down to
+# EVICT_TO of it so a full cache does not evict on every insert
+#
+#   python src/inference_cache.py stats    entries per model version, file size
+#   python src/inference_cache.py clear
+
+import os
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import numpy as np
+from instrument import count
+
+CACHE_FILE = 'data/inference_cache.sqlite'
+MAX_ENTRIES = 200000
+EVICT_TO = 0.9
+
+def normalize(text):
+    return ' '.join(text.split())
+
+def model_version(*paths):
+    # first file's name plus a hash of the names, sizes and mtimes of the model files; hashing a few hundred MB of bert
+    # weights on every load would cost more than most lookups save. snapshots keep
+    # mtimes (snapshots.py), so a published copy has the same version
+    digest = hashlib.sha256()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for f in files:
+            st = os.stat(f)
+            digest.update(f"{os.path.relpath(f, path)}:{st.st_size}:{st.st_mtime_ns}\n".encode('utf-8'))
+    return f"{os.path.basename(paths[0].rstrip('/'))}-{digest.hexdigest()[:16]}"
+
+class InferenceCache:
+    def __init__(self, filename=CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.filename = filename
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        # one connection per cache, shared by the app's threads under a lock;
+        # other processes (ingest workers) open their own
+        self.db = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS outputs (
+                key BLOB PRIMARY KEY, model TEXT NOT NULL, logits BLOB NOT NULL,
+                probs BLOB, used REAL NOT NULL)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS outputs_used ON outputs (used)")
+            # counted once, then kept up to date by our own inserts; other
+            # processes' rows are seen at the next eviction, which counts again
+            self.rows = self.db.execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, model, text):
+        return hashlib.sha256(f"{model}\0{normalize(text)}".encode('utf-8')).digest()
+
+    def get_many(self, model, texts):
+        # [(logits, probs) or None] per text; hits count as a use for eviction
+        keys = [self.key(model, t) for t in texts]
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.db.execute(f"SELECT key, logits, probs FROM outputs WHERE key IN "
+                                       f"({','.join('?' * len(chunk))})", chunk).fetchall()
+                found.update((k, (l, p)) for k, l, p in rows)
+            if found:
+                with self.db:
+                    self.db.executemany("UPDATE outputs SET used = ? WHERE key = ?",
+                                        [(time.time(), k) for k in found])
+        out = []
+        for k in keys:
+            if k in found:
+                logits, probs = found[k]
+                out.append((np.frombuffer(logits, dtype=np.float32),
+                            np.frombuffer(probs, dtype=np.float32) if probs is not None else None))
+            else:
+                out.append(None)
+        hits = sum(o is not None for o in out)
+        self.hits += hits
+        self.misses += len(out) - hits
+        count('inference_cache_hits', hits)
+        count('inference_cache_misses', len(out) - hits)
+        return out
+
+    def put_many(self, model, texts, logits, probs=None):
+        now = time.time()
+        rows = [(self.key(model, t), model, np.asarray(l, dtype=np.float32).tobytes(),
+                 np.asarray(probs[i], dtype=np.float32).tobytes() if probs is not None else None, now)
+                for i, (t, l) in enumerate(zip(texts, logits))]
+        with self.lock, self.db:
+            # a key already there holds the same output (same model, same text),
+            # so only new rows are written and counted
+            self.rows += self.db.executemany("INSERT OR IGNORE INTO outputs VALUES (?, ?, ?, ?, ?)", rows).rowcount
+            if self.rows > self.max_entries:
+                self.evict()
+
+    def evict(self):
+        # least recently used rows, down to EVICT_TO of max_entries; called with the lock held
+        self.rows = self.db.execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
+        excess = self.rows - int(self.max_entries * EVICT_TO)
+        if self.rows > self.max_entries and excess > 0:
+            self.rows -= self.db.execute("DELETE FROM outputs WHERE key IN "
+                                         "(SELECT key FROM outputs ORDER BY used LIMIT ?)", (excess,)).rowcount
+
+    def cached(self, model, texts, compute):
+        # (logits, probs) arrays for all texts; compute(missed texts) -> (logits, probs
+        # or None) only runs for the texts that are not cached
+        texts = list(texts)
+        found = self.get_many(model, texts)
+        missing = [i for i, f in enumerate(found) if f is None]
+        if missing:
+            logits, probs = compute([texts[i] for i in missing])
+            logits = np.asarray(logits, dtype=np.float32).reshape(len(missing), -1)
+            if probs is not None:
+                probs = np.asarray(probs, dtype=np.float32).reshape(len(missing), -1)
+            self.put_many(model, [texts[i] for i in missing], logits, probs)
+            for j, i in enumerate(missing):
+                found[i] = (logits[j], probs[j] if probs is not None else None)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32), None
+        logits = np.stack([f[0] for f in found])
+        probs = np.stack([f[1] for f in found]) if all(f[1] is not None for f in found) else None
+        return logits, probs
+
+    def stats(self):
+        with self.lock:
+            rows = self.db.execute("SELECT model, COUNT(*) FROM outputs GROUP BY model").fetchall()
+        return {'models': dict(rows), 'hits': self.hits, 'misses': self.misses,
+                'bytes': os.path.getsize(self.filename) if os.path.exists(self.filename) else 0}
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM outputs")
+            self.rows = 0
+        with self.lock:
+            self.db.execute("VACUUM")
+
+    def close(self):
+        self.db.close()
+
+def svm_labels(svm, logits):
+    # the svm has no probabilities (no probability=True), its decision values are the
+    # logits: one margin for two classes, one column per class otherwise
+    if logits.shape[1] == 1:
+        return svm.classes_[(logits[:, 0] > 0).astype(int)]
+    return svm.classes_[logits.argmax(axis=1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="inspect or clear the classifier output cache")
+    parser.add_argument('command', nargs='?', default='stats', choices=['stats', 'clear'])
+    parser.add_argument('--file', default=CACHE_FILE)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"no cache at {args.file}")
+        return
+    cache = InferenceCache(args.file)
+    if args.command == 'clear':
+        cache.clear()
+        print("cleared")
+    stats = cache.stats()
+    for model, n in stats['models'].items():
+        print(f"{model}: {n} entries")
+    print(f"{sum(stats['models'].values())} entries, {stats['bytes'] / 1024:.0f} KB in {args.file}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+# Streaming ingestion: crawl -> clean -> dedupe -> classify -> index
+# documents flow one at a time through stage workers joined by bounded queues.
+# fetching and writing are i/o and run on threads; cleaning, minhash signatures
+# and classification are cpu work and run in worker processes. a full queue
+# blocks whoever feeds it, so a slow stage holds back the ones before it and
+# memory stays flat however many documents come through.
+# the index stage appends to the bm25 index, the document store and the corpus
+# files in small batches (commits). the indexes are pickled whole, so they are
+# only written out, and a snapshot published for a running app to swap in (see
+# snapshots.py), every few seconds (checkpoints). a commit record remembers how
+# far the files got, and a writer killed between checkpoints cuts them back to
+# it on the next start and indexes the committed documents again
+#
+#   python src/ingest.py                      crawl the news sites once
+#   python src/ingest.py --follow 300         keep crawling, a new round every 5 minutes
+#   python src/ingest.py --input new.jsonl    stream passages from files instead
+
+import os
+import json
+import time
+import queue
+import pickle
+import signal
+import argparse
+import threading
+import multiprocessing as mp
+import numpy as np
+from preprocess import process_text
+from dedupe import MinHasher, iter_passages, NUM_PERM, BANDS, THRESHOLD
+from retrieval import BM25
+from docstore import append_docstore, open_docstore, truncate_docstore
+from snapshots import publish
+from passages import PassageIndex
+from inference_cache import InferenceCache, model_version, svm_labels
+
+QUEUE_SIZE = 256       # documents waiting between two stages
+CLASSIFY_BATCH = 32    # a worker classifies whatever is queued, up to this many at once
+COMMIT_DOCS = 256      # index batch size ...
+COMMIT_SECONDS = 2.0   # ... or age of its oldest document, whichever comes first
+PUBLISH_SECONDS = 10.0 # indexes written and published at most this often
+MODEL_FILES = ('models/classifier.pkl', 'models/vectorizer.pkl')
+DONE = None            # end of stream marker, one per consumer
+
+class Stopped(Exception):
+    pass
+
+def put(q, item, stop):
+    # blocking put that gives up once the run is being stopped
+    while True:
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            if stop.is_set():
+                raise Stopped()
+
+def finish(q, consumers, alive):
+    # one end marker per consumer, unless they are gone and nobody would read it
+    for _ in range(consumers):
+        while True:
+            try:
+                q.put(DONE, timeout=0.5)
+                break
+            except queue.Full:
+                if not alive():
+                    return
+
+def append_json_list(filename, items):
+    # add items to a json list file in place, only the closing bracket is rewritten
+    if not items:
+        return
+    if not os.path.exists(filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False, indent=2)
+        return
+    with open(filename, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b''
+        while pos > 0 and b']' not in tail:
+            step = min(pos, 4096)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+        if b']' not in tail:
+            raise ValueError(f"{filename} is not a json list")
+        close = pos + tail.rindex(b']')
+        empty = tail[:tail.rindex(b']')].rstrip().endswith(b'[')
+        f.seek(close)
+        f.truncate()
+        body = ',\n'.join('  ' + json.dumps(item, ensure_ascii=False) for item in items)
+        f.write(((b'\n' if empty else b',\n') + body.encode('utf-8') + b'\n]'))
+
+def restore_json_list(filename, size):
+    # cut a json list that append_json_list was writing to when it was killed back
+    # to its size before that append; a complete file there ends in its bracket
+    if os.path.getsize(filename) <= size:
+        return False
+    with open(filename, 'r+b') as f:
+        f.seek(size - 1)
+        f.truncate()
+        f.write(b']')
+    return True
+
+def file_stat(filename):
+    if not os.path.exists(filename):
+        return None
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime_ns]
+
+def prepare_worker(inbox, outbox, model_files):
+    # process stage: clean + tokenize, minhash signature, weak topic label
+    # ctrl-c is for the parent, which drains the workers through the queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    hasher = MinHasher()
+    svm = vectorizer = None
+    if all(os.path.exists(f) for f in model_files):
+        with open(model_files[0], 'rb') as f:
+            svm = pickle.load(f)
+        with open(model_files[1], 'rb') as f:
+            vectorizer = pickle.load(f)
+        # a recrawl brings back pages already labeled by this model
+        cache = InferenceCache()
+        version = model_version(*model_files)
+
+    while True:
+        batch = [inbox.get()]
+        # take whatever else is already waiting, the classifier likes batches
+        while batch[-1] is not DONE and len(batch) < CLASSIFY_BATCH:
+            try:
+                batch.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        items = []
+        for raw, fetched_at in (b for b in batch if b is not DONE):
+            record = process_text(raw)
+            if record is not None:
+                items.append((raw, record, hasher.signature(raw), fetched_at))
+        if items and svm is not None:
+            processed = {raw: record['text'] for raw, record, _, _ in items}
+
+            def svm_outputs(raws):
+                # decision values for the texts the cache did not have
+                return svm.decision_function(vectorizer.transform([processed[r] for r in raws])), None
+
+            try:
+                logits, _ = cache.cached(version, [raw for raw, _, _, _ in items], svm_outputs)
+                labels = svm_labels(svm, logits)
+            except Exception as e:
+                # a stale model only costs the labels, not the documents
+                print(f"classifier failed, ingesting without labels: {e}")
+                svm = None
+            else:
+                for (_, record, _, _), label in zip(items, labels):
+                    record['label'] = int(label)
+        for item in items:
+            outbox.put(item)
+        if batch[-1] is DONE:
+            outbox.put(DONE)
+            return
+
+class StreamingDeduper:
+    # the banding of dedupe.cluster, kept as hash tables so every new document is
+    # checked against everything indexed so far as it arrives
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=THRESHOLD):
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.weights = np.random.default_rng(7).integers(1, 1 << 61, size=self.rows, dtype=np.uint64)
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = np.zeros((1024, num_perm), dtype=np.uint32)
+        self.n = 0
+
+    def keys(self, sig):
+        return (sig.astype(np.uint64).reshape(self.bands, self.rows) * self.weights).sum(axis=1).tolist()
+
+    def is_duplicate(self, sig):
+        for band, key in enumerate(self.keys(sig)):
+            for other in self.buckets[band].get(key, ()):
+                if (self.signatures[other] == sig).mean() >= self.threshold:
+                    return True
+        return False
+
+    def add(self, sig):
+        if self.n == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+        self.signatures[self.n] = sig
+        for band, key in enumerate(self.keys(sig)):
+            self.buckets[band].setdefault(key, []).append(self.n)
+        self.n += 1
+
+class IndexWriter:
+    def __init__(self, index_file='models/bm25_index.pkl', docstore_dir='data/docstore',
+                 corpus_file='data/processed_corpus.json', raw_file='data/malayalam_corpus.json',
+                 passage_file='models/passage_index.pkl', state_file='data/ingest_state.json',
+                 publish_snapshots=True):
+        self.index_file = index_file
+        self.passage_file = passage_file
+        self.docstore_dir = docstore_dir
+        self.corpus_file = corpus_file
+        self.raw_file = raw_file
+        self.state_file = state_file
+        self.publish_snapshots = publish_snapshots
+        self.pending = 0  # committed docs not in the index files yet
+        self.bm25 = None
+        if os.path.exists(index_file):
+            with open(index_file, 'rb') as f:
+                self.bm25 = pickle.load(f)
+        # the passage index is optional
+        self.passages = None
+        ahead = False
+        if os.path.exists(passage_file):
+            self.passages = PassageIndex.load(passage_file)
+            # a checkpoint killed between the two files leaves the passages ahead,
+            # they are compared once recover() has brought the index up to them
+            ahead = self.passages.num_docs > len(self)
+            if not ahead and (self.bm25 is None or not self.passages.matches(self.bm25)):
+                print(f"{passage_file} does not match the index, it will not be updated")
+                self.passages = None
+        self.recover()
+        # doc ids are positions, every file has to agree before anything is appended
+        # the store is appended to, so it has to exist once there is an index
+        store = open_docstore(docstore_dir)
+        stored = len(store) if store is not None else 0
+        indexed = len(self)
+        if indexed != stored:
+            raise RuntimeError(f"{index_file} has {indexed} docs but the corpus has {stored}, "
+                               f"rebuild with the pipeline before ingesting")
+        # one that is behind stays behind until rebuilt
+        if self.passages is not None and (self.passages.num_docs != indexed or
+                                          ahead and not self.passages.matches(self.bm25)):
+            print(f"{passage_file} does not match the index, it will not be updated")
+            self.passages = None
+
+    def __len__(self):
+        return len(self.bm25.doc_len) if self.bm25 is not None else 0
+
+    def recover(self):
+        # the commit record is only ours while the index file is the one this
+        # writer last wrote; after a pipeline rebuild it describes other files
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('index') != file_stat(self.index_file):
+            return
+        committed = state['num_docs']
+        for filename, size in state['files'].items():
+            if os.path.exists(filename) and restore_json_list(filename, size):
+                print(f"{filename}: dropped a commit that did not finish")
+        if os.path.exists(os.path.join(self.docstore_dir, 'meta.json')):
+            dropped = truncate_docstore(self.docstore_dir, committed)
+            if dropped:
+                print(f"{self.docstore_dir}: dropped {dropped} docs of a commit that did not finish")
+
+        # committed after the last checkpoint: in the files, not in the index files
+        behind = [len(self)] + ([self.passages.num_docs] if self.passages is not None else [])
+        if min(behind) >= committed:
+            return
+        with open(self.corpus_file, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        if len(records) != committed:
+            return  # the count check in __init__ reports it
+        print(f"indexing {committed - min(behind)} committed docs again...")
+        if len(self) < committed:
+            texts = [record['text'] for record in records[len(self):]]
+            if self.bm25 is None:
+                self.bm25 = BM25(texts)
+            else:
+                self.bm25.add_documents(texts)
+        if self.passages is not None and self.passages.num_docs < committed:
+            self.passages.add_documents([record.get('original_text', record['text'])
+                                         for record in records[self.passages.num_docs:]])
+        self.pending = committed - min(behind)
+
+    def save_state(self):
+        # written after every commit: the doc count and the sizes of the json
+        # lists it left, which recover() cuts them back to
+        state = {'num_docs': len(self), 'index': file_stat(self.index_file),
+                 'files': {f: os.path.getsize(f) for f in (self.corpus_file, self.raw_file) if os.path.exists(f)}}
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    def commit(self, items):
+        # cheap: in memory indexes plus appends, nothing is rewritten whole
+        records = [record for _, record, _ in items]
+        texts = [record['text'] for record in records]
+        if self.bm25 is None:
+            self.bm25 = BM25(texts)
+        else:
+            self.bm25.add_documents(texts)
+        if self.passages is not None:
+            self.passages.add_documents([record['original_text'] for record in records])
+        append_docstore([record['original_text'] for record in records], self.docstore_dir)
+        append_json_list(self.corpus_file, records)
+        append_json_list(self.raw_file, [raw for raw, _, _ in items])
+        self.save_state()
+        self.pending += len(records)
+
+    def checkpoint(self):
+        # write the indexes out and publish them; costs the size of the whole index
+        if self.bm25 is None:
+            return
+        if self.passages is not None:
+            self.passages.doc_digest = self.bm25.digest()
+            tmp = self.passage_file + '.tmp'
+            self.passages.save(tmp)
+            os.replace(tmp, self.passage_file)
+        # the index last, a reader of the files never sees ids it cannot resolve
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.bm25, f)
+        os.replace(tmp, self.index_file)
+        self.save_state()
+        self.pending = 0
+        if self.publish_snapshots:
+            publish()
+
+def fetch_files(paths, emit):
+    for path in paths:
+        for text in iter_passages(path):
+            emit(text)
+
+def fetch_crawl(emit, follow, stop):
+    from urllib.parse import urlsplit
+    from collect_data import MALAYALAM_SITES, parse_page
+    from crawler import crawl
+
+    def parse(content, url):
+        # runs on the crawler's executor threads; a full queue stalls them and
+        # with them the crawl
+        texts, links = parse_page(content, url)
+        for text in texts:
+            emit(text)
+        return texts, links
+
+    domains = [urlsplit(site).netloc for site in MALAYALAM_SITES]
+    while not stop.is_set():
+        # conditional requests: only new or changed pages produce passages
+        crawl(MALAYALAM_SITES, parse, allowed_domains=domains,
+              max_depth=1, max_pages=500, per_host=2, delay=2.0)
+        if not follow or stop.wait(follow):
+            break
+
+def run_ingest(inputs=None, follow=0, workers=None, commit_docs=COMMIT_DOCS,
+               commit_seconds=COMMIT_SECONDS, publish_snapshots=True, publish_seconds=PUBLISH_SECONDS):
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    writer = IndexWriter(publish_snapshots=publish_snapshots)
+    print(f"{len(writer)} documents indexed, seeding duplicate detection...")
+    deduper = StreamingDeduper()
+    hasher = MinHasher()
+    if len(writer):
+        for text in open_docstore(writer.docstore_dir):
+            deduper.add(hasher.signature(text))
+
+    raw_queue = mp.Queue(QUEUE_SIZE)
+    prepared_queue = mp.Queue(QUEUE_SIZE)
+    unique_queue = queue.Queue(QUEUE_SIZE)
+    stop = threading.Event()
+    stats = {'fetched': 0, 'prepared': 0, 'duplicates': 0, 'indexed': 0, 'commits': 0, 'checkpoints': 0,
+             'max_lag_s': 0.0}
+    errors = []
+
+    procs = [mp.Process(target=prepare_worker, args=(raw_queue, prepared_queue, MODEL_FILES), daemon=True)
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+
+    def fetch():
+        def emit(text):
+            if stop.is_set():
+                raise Stopped()
+            put(raw_queue, (text, time.time()), stop)
+            stats['fetched'] += 1
+        try:
+            if inputs:
+                fetch_files(inputs, emit)
+            else:
+                fetch_crawl(emit, follow, stop)
+        finally:
+            finish(raw_queue, len(procs), lambda: any(p.is_alive() for p in procs))
+
+    def dedupe():
+        finished = 0
+        try:
+            while finished < len(procs):
+                try:
+                    item = prepared_queue.get(timeout=1.0)
+                except queue.Empty:
+                    if not any(p.is_alive() for p in procs):
+                        raise RuntimeError("prepare workers exited early")
+                    continue
+                if item is DONE:
+                    finished += 1
+                    continue
+                raw, record, sig, fetched_at = item
+                stats['prepared'] += 1
+                if deduper.is_duplicate(sig):
+                    stats['duplicates'] += 1
+                    continue
+                deduper.add(sig)
+                put(unique_queue, (raw, record, fetched_at), stop)
+        finally:
+            finish(unique_queue, 1, lambda: threads[-1].is_alive())
+
+    def index():
+        batch = []
+        oldest = None
+        checkpointed = time.monotonic()
+        unpublished = None  # fetch time of the oldest doc since the last checkpoint
+        if writer.pending:
+            # recovered at startup, searchable with the first checkpoint
+            unpublished = time.time()
+        while True:
+            deadlines = []
+            if batch:
+                deadlines.append(oldest + commit_seconds)
+            if writer.pending:
+                deadlines.append(checkpointed + publish_seconds)
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                item = unique_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()  # the batch is old enough, or a checkpoint is due
+            if item:
+                if not batch:
+                    oldest = time.monotonic()
+                batch.append(item)
+            # commit when full, old enough, or at the end of the stream
+            if batch and (not item or len(batch) >= commit_docs):
+                start = time.perf_counter()
+                writer.commit(batch)
+                first = min(fetched_at for _, _, fetched_at in batch)
+                unpublished = first if unpublished is None else min(unpublished, first)
+                stats['indexed'] += len(batch)
+                stats['commits'] += 1
+                print(f"committed {len(batch)} docs ({len(writer)} total) in {time.perf_counter() - start:.2f}s, "
+                      f"{unique_queue.qsize()} waiting")
+                batch = []
+            # checkpoint when due, and at the end of the stream
+            if writer.pending and (item is DONE or time.monotonic() - checkpointed >= publish_seconds):
+                start = time.perf_counter()
+                pending = writer.pending
+                writer.checkpoint()
+                checkpointed = time.monotonic()
+                lag = time.time() - unpublished
+                unpublished = None
+                stats['checkpoints'] += 1
+                stats['max_lag_s'] = max(stats['max_lag_s'], lag)
+                print(f"wrote and published {pending} docs in {time.perf_counter() - start:.2f}s, "
+                      f"searchable {lag:.1f}s after fetch")
+            if item is DONE:
+                return
+
+    def guarded(stage):
+        def run():
+            try:
+                stage()
+            except Stopped:
+                pass
+            except Exception as e:
+                errors.append(f"{stage.__name__}: {e}")
+                stop.set()
+        return run
+
+    threads = [threading.Thread(target=guarded(s), name=s.__name__) for s in (fetch, dedupe, index)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            threads[-1].join(0.5)
+            if errors:
+                # a stage died, the workers may be blocked on a queue nobody reads
+                for p in procs:
+                    p.terminate()
+    except KeyboardInterrupt:
+        print("stopping, indexing what is already fetched...")
+        stop.set()
+        for t in threads:
+            t.join()
+    for p in procs:
+        p.join(timeout=5)
+        if p.is_alive():
+            p.terminate()
+    if errors or stop.is_set():
+        # items nobody will read would otherwise hold up interpreter exit
+        raw_queue.cancel_join_thread()
+        prepared_queue.cancel_join_thread()
+
+    for e in errors:
+        print(f"error in {e}")
+    stats['seconds'] = time.perf_counter() - start
+    print(f"ingest stats: {stats}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="stream new documents into the index")
+    parser.add_argument('--input', nargs='+', help="passage files (.json list or .jsonl) instead of crawling")
+    parser.add_argument('--follow', type=float, default=0, help="seconds between crawl rounds, 0 crawls once")
+    parser.add_argument('--workers', type=int, default=None, help="processes for cleaning and classifying")
+    parser.add_argument('--commit-docs', type=int, default=COMMIT_DOCS)
+    parser.add_argument('--commit-seconds', type=float, default=COMMIT_SECONDS)
+    parser.add_argument('--publish-seconds', type=float, default=PUBLISH_SECONDS,
+                        help="how often the indexes are written out and published")
+    parser.add_argument('--no-publish', action='store_true', help="update models/ and data/ without a snapshot")
+    args = parser.parse_args()
+
+    run_ingest(args.input, args.follow, args.workers, args.commit_docs, args.commit_seconds,
+               not args.no_publish, args.publish_seconds)
+
+if __name__ == '__main__':
+    main()
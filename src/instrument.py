@@ -0,0 +1,232 @@
+# Opt-in timers and counters for the hot paths
+# set MIR_INSTRUMENT=1 before starting; when it is off, timed() returns the
+# function untouched and stage() hands back a shared no-op context
+
+import os
+import sys
+import json
+import time
+import bisect
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.environ.get('MIR_INSTRUMENT', '') not in ('', '0')
+
+# latency buckets in seconds (prometheus style upper bounds)
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL = nullcontext()
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target and c:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return 0.0
+
+_histograms = {}
+_counters = Counter()
+_registry_lock = threading.Lock()
+
+def _histogram(name):
+    h = _histograms.get(name)
+    if h is None:
+        with _registry_lock:
+            h = _histograms.setdefault(name, Histogram())
+    return h
+
+def observe(name, seconds):
+    if ENABLED:
+        _histogram(name).observe(seconds)
+
+def count(name, n=1):
+    if ENABLED:
+        with _registry_lock:
+            _counters[name] += n
+
+def timed(name):
+    # decorator, free when instrumentation is off
+    def wrap(fn):
+        if not ENABLED:
+            return fn
+        hist = _histogram(name)
+        def timed_fn(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - start)
+        timed_fn.__name__ = fn.__name__
+        timed_fn.__qualname__ = fn.__qualname__
+        timed_fn.__wrapped__ = fn
+        return timed_fn
+    return wrap
+
+@contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _histogram(name).observe(time.perf_counter() - start)
+
+def stage(name):
+    # with stage('topk'): ...
+    return _timer(name) if ENABLED else _NULL
+
+def reset():
+    with _registry_lock:
+        _histograms.clear()
+        _counters.clear()
+
+def snapshot():
+    stages = {}
+    for name, h in sorted(_histograms.items()):
+        stages[name] = {
+            'count': h.count,
+            'sum_s': h.total,
+            'mean_ms': h.total / h.count * 1000 if h.count else 0.0,
+            'p50_ms': h.quantile(0.5) * 1000,
+            'p95_ms': h.quantile(0.95) * 1000,
+            'p99_ms': h.quantile(0.99) * 1000,
+            'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts)),
+        }
+    return {'stages': stages, 'counters': dict(_counters)}
+
+def dump_json(filename):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, indent=2)
+
+def prometheus_text(prefix='mir'):
+    lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+    for name, h in sorted(_histograms.items()):
+        seen = 0
+        for bound, c in zip(list(BUCKETS) + ['+Inf'], h.counts):
+            seen += c
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {seen}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {h.total}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {h.count}')
+    lines.append(f"# TYPE {prefix}_events_total counter")
+    for name, n in sorted(_counters.items()):
+        lines.append(f'{prefix}_events_total{{name="{name}"}} {n}')
+    return '\n'.join(lines) + '\n'
+
+def report():
+    stats = snapshot()
+    print(f"{'stage':<20}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in stats['stages'].items():
+        print(f"{name:<20}{s['count']:>8}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}")
+    for name, n in stats['counters'].items():
+        print(f"{name:<20}{n:>8}")
+
+@contextmanager
+def cprofile(filename):
+    # deterministic profile, open with pstats or snakeviz
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield prof
+    finally:
+        prof.disable()
+        prof.dump_stats(filename)
+
+class Sampler:
+    # samples every thread's stack and writes collapsed stacks
+    # ("a;b;c 12" per line, the same format py-spy --format raw and flamegraph.pl use)
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, filename=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if filename:
+            with open(filename, 'w', encoding='utf-8') as f:
+                for stack, n in self.stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+        return self.stacks
+
+@contextmanager
+def sampling(filename, interval=0.005):
+    sampler = Sampler(interval).start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop(filename)
+
+def main():
+    # python src/instrument.py [--cprofile out.prof | --sample out.txt] script.py [args...]
+    import runpy
+    import argparse
+    parser = argparse.ArgumentParser(description="run a script with profiling")
+    parser.add_argument('--cprofile', default=None)
+    parser.add_argument('--sample', default=None)
+    parser.add_argument('--interval', type=float, default=0.005)
+    parser.add_argument('--metrics', default=None, help="write stage timings json here on exit")
+    parser.add_argument('script')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    if args.cprofile:
+        ctx = cprofile(args.cprofile)
+    elif args.sample:
+        ctx = sampling(args.sample, args.interval)
+    else:
+        ctx = _NULL
+    try:
+        with ctx:
+            runpy.run_path(args.script, run_name='__main__')
+    finally:
+        if args.metrics:
+            dump_json(args.metrics)
+        if ENABLED:
+            report()
+
+if __name__ == '__main__':
+    # go through the importable module so the script and we share one registry
+    import instrument
+    instrument.main()
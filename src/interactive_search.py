@@ -1,8 +1,8 @@
 # interactive search tool
 
 import pickle
-import json
 from retrieval import BM25, search
+from docstore import load_documents
 from preprocess import clean_malayalam_text, tokenize_malayalam
 
 def load_system():
@@ -10,9 +10,8 @@ def load_system():
     try:
         with open('models/bm25_index.pkl', 'rb') as f:
             bm25 = pickle.load(f)
-        with open('data/processed_corpus.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        documents = [item['text'] for item in data]
+        # only the shown results are read from the store
+        documents = load_documents(num_docs=len(bm25.doc_len))
         return bm25, documents
     except Exception as e:
         print(f"error loading system: {e}")
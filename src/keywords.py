@@ -0,0 +1,140 @@
+# Keyword lists and one Aho-Corasick matcher for all of them
+# weak labels (classify.py, classify_bert.py) and keyword relevance judgments
+# (update_judgments.py) come from keyword lists. every keyword of every list goes
+# into one automaton, so a single pass over a text finds all of them, however
+# many keywords and topics there are
+
+import os
+from collections import deque
+from multiprocessing import Pool
+
+POLITICAL_KEYWORDS = [
+    "രാഷ്ട്രീയം", "രാഷ്ട്രീയ", # Politics
+    "തിരഞ്ഞെടുപ്പ്", # Election
+    "സിപിഎം", "സി.പി.എം", # CPM
+    "കോൺഗ്രസ്", # Congress
+    "ബിജെപി", "ബി.ജെ.പി", # BJP
+    "എൽഡിഎഫ്", "എൽ.ഡി.എഫ്", # LDF
+    "യുഡിഎഫ്", "യു.ഡി.എഫ്", # UDF
+    "സർക്കാർ", # Government
+    "മന്ത്രി", # Minister
+    "പാർട്ടി", # Party
+    "നേതാവ്", # Leader
+    "സ്ഥാനാർഥി", # Candidate
+    "വോട്ട്" # Vote
+]
+
+CHUNK_SIZE = 256  # documents per task when labeling in parallel
+
+class KeywordMatcher:
+    def __init__(self, groups, whole_words=False):
+        # groups: {label: [keywords]}. with whole_words a keyword only counts as a
+        # whitespace separated token, the same as checking text.split()
+        self.labels = list(groups)
+        self.whole_words = whole_words
+
+        # keyword trie, one dict of children per state
+        goto = [{}]
+        # per state: (keyword length, label bit) of every keyword ending there
+        out = [[]]
+        for bit, label in enumerate(self.labels):
+            for kw in groups[label]:
+                state = 0
+                for ch in kw:
+                    nxt = goto[state].get(ch)
+                    if nxt is None:
+                        nxt = goto[state][ch] = len(goto)
+                        goto.append({})
+                        out.append([])
+                    state = nxt
+                if kw:
+                    out[state].append((len(kw), 1 << bit))
+
+        # breadth first: failure links, then each state's full transition table, so a
+        # scan is one dict lookup per character and never follows failure links
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # the failure state is shallower, its table is already complete
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            out[state] = out[state] + out[fail[state]]
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0)
+                queue.append(child)
+
+        self.delta = delta
+        self.out = [tuple(o) for o in out]
+        # label bits ending at each state, for plain substring matching
+        self.masks = [sum({bit for _, bit in o}) for o in out]
+        self.full = (1 << len(self.labels)) - 1
+
+    def match(self, text):
+        # bitmask of labels with at least one keyword in text
+        delta, masks, full = self.delta, self.masks, self.full
+        state = 0
+        found = 0
+        if not self.whole_words:
+            for ch in text:
+                state = delta[state].get(ch, 0)
+                if masks[state]:
+                    found |= masks[state]
+                    if found == full:
+                        break
+            return found
+
+        out = self.out
+        n = len(text)
+        for i, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if masks[state] and (i + 1 == n or text[i + 1].isspace()):
+                for length, bit in out[state]:
+                    start = i + 1 - length
+                    if start == 0 or text[start - 1].isspace():
+                        found |= bit
+                if found == full:
+                    break
+        return found
+
+    def match_labels(self, text):
+        found = self.match(text)
+        return [label for bit, label in enumerate(self.labels) if found >> bit & 1]
+
+# filled in each worker by init_worker
+_matcher = None
+
+def init_worker(matcher):
+    global _matcher
+    _matcher = matcher
+
+def match_chunk(texts):
+    return [_matcher.match(t) for t in texts]
+
+def match_all(matcher, texts, workers=None, chunk_size=CHUNK_SIZE):
+    # one bitmask per text, chunks of the corpus matched in parallel
+    texts = list(texts)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(texts) <= chunk_size:
+        return [matcher.match(t) for t in texts]
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    with Pool(workers, initializer=init_worker, initargs=(matcher,)) as pool:
+        return [m for masks in pool.map(match_chunk, chunks) for m in masks]
+
+def label_documents(texts, keywords=POLITICAL_KEYWORDS, workers=None):
+    # weak 0/1 labels: 1 when any keyword occurs anywhere in the text
+    matcher = KeywordMatcher({'positive': keywords})
+    return match_all(matcher, texts, workers)
+
+def documents_by_label(groups, texts, offset=0, whole_words=False, workers=None):
+    # {label: [doc ids]} for every label in one pass per document
+    matcher = KeywordMatcher(groups, whole_words)
+    found = {label: [] for label in matcher.labels}
+    for i, mask in enumerate(match_all(matcher, texts, workers)):
+        while mask:
+            bit = mask & -mask
+            found[matcher.labels[bit.bit_length() - 1]].append(offset + i)
+            mask ^= bit
+    return found
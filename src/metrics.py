@@ -0,0 +1,181 @@
+# Vectorized IR metrics
+# runs are matrices of doc ids (one row per query, padded with -1)
+
+import json
+import numpy as np
+
+class Qrels:
+    def __init__(self, judgments):
+        # keep only real query entries (skip '_instructions' etc)
+        self.queries = [q for q, ids in judgments.items() if not q.startswith('_') and isinstance(ids, list)]
+        self.query_index = {q: i for i, q in enumerate(self.queries)}
+
+        # encode (query, doc) pairs as sorted int64 keys for fast lookup
+        rows = []
+        docs = []
+        for i, q in enumerate(self.queries):
+            ids = np.unique(np.asarray(judgments[q], dtype=np.int64))
+            rows.append(np.full(len(ids), i, dtype=np.int64))
+            docs.append(ids)
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        docs = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+
+        self.num_docs = int(docs.max()) + 1 if len(docs) else 0
+        self.stride = self.num_docs + 1
+        self.keys = np.sort(rows * self.stride + docs)
+        self.num_relevant = np.bincount(rows, minlength=len(self.queries))
+
+    def relevant(self, query):
+        i = self.query_index[query]
+        lo, hi = np.searchsorted(self.keys, [i * self.stride, (i + 1) * self.stride])
+        return set((self.keys[lo:hi] - i * self.stride).tolist())
+
+    def judge(self, run, queries):
+        # boolean matrix: run[i, r] is relevant for queries[i]
+        rows = np.array([self.query_index.get(q, -1) for q in queries], dtype=np.int64)
+        run = np.asarray(run, dtype=np.int64)
+        if not len(self.keys):
+            return np.zeros(run.shape, dtype=bool)
+
+        # unjudged queries, padding and unseen doc ids never match
+        valid = (run >= 0) & (run < self.num_docs) & (rows[:, None] >= 0)
+        keys = rows[:, None] * self.stride + np.where(valid, run, 0)
+
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return valid & (self.keys[pos] == keys)
+
+    def counts(self, queries):
+        return np.array([self.num_relevant[self.query_index[q]] if q in self.query_index else 0
+                         for q in queries], dtype=np.int64)
+
+def load_qrels(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return Qrels(json.load(f))
+
+def run_matrix(run, queries, depth):
+    # turn {query: [doc ids]} into a padded matrix
+    mat = np.full((len(queries), depth), -1, dtype=np.int64)
+    for i, q in enumerate(queries):
+        ids = run.get(q, [])[:depth]
+        mat[i, :len(ids)] = ids
+    return mat
+
+def _safe_div(num, den):
+    den = np.asarray(den, dtype=np.float64)
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den > 0)
+
+def precision_at(rel, k):
+    return rel[:, :k].sum(axis=1) / k if k > 0 else np.zeros(len(rel))
+
+def recall_at(rel, num_rel, k):
+    return _safe_div(rel[:, :k].sum(axis=1), num_rel)
+
+def recall_curve(rel, num_rel, cutoffs):
+    # recall at each cutoff, one column per cutoff
+    hits = np.cumsum(rel, axis=1)
+    cols = np.minimum(np.asarray(cutoffs), rel.shape[1]) - 1
+    return _safe_div(hits[:, cols], num_rel[:, None])
+
+def average_precision(rel, num_rel):
+    ranks = np.arange(1, rel.shape[1] + 1)
+    prec = np.cumsum(rel, axis=1) / ranks
+    return _safe_div((prec * rel).sum(axis=1), num_rel)
+
+def ndcg_at(rel, num_rel, k):
+    # binary gains, ideal ranking taken from the judgments
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = (rel[:, :k] * discounts[:rel[:, :k].shape[1]]).sum(axis=1)
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])
+    idcg = ideal[np.minimum(num_rel, k)]
+    return _safe_div(dcg, idcg)
+
+def reciprocal_rank(rel):
+    first = rel.argmax(axis=1)
+    return np.where(rel.any(axis=1), 1.0 / (first + 1), 0.0)
+
+def per_query_table(run, qrels, queries=None, k=10):
+    # per query metrics for one run
+    if queries is None:
+        queries = [q for q in qrels.queries if q in run]
+    if isinstance(run, dict):
+        depth = max([len(run.get(q, [])) for q in queries] + [k])
+        run = run_matrix(run, queries, depth)
+
+    rel = qrels.judge(run, queries)
+    num_rel = qrels.counts(queries)
+
+    return {
+        'query': list(queries),
+        f'P@{k}': precision_at(rel, k),
+        f'R@{k}': recall_at(rel, num_rel, k),
+        'AP': average_precision(rel, num_rel),
+        f'NDCG@{k}': ndcg_at(rel, num_rel, k),
+        'RR': reciprocal_rank(rel),
+    }
+
+def summarize(table):
+    return {name: float(np.mean(vals)) if len(vals) else 0.0
+            for name, vals in table.items() if name != 'query'}
+
+def paired_randomization_test(a, b, trials=10000, seed=42):
+    # two sided sign-flip test on per query differences
+    diff = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    if not len(diff) or not diff.any():
+        return 1.0
+    observed = abs(diff.mean())
+
+    rng = np.random.default_rng(seed)
+    extreme = 0
+    done = 0
+    # chunk so memory stays small with many queries
+    chunk = max(1, min(trials, 2_000_000 // len(diff)))
+    while done < trials:
+        n = min(chunk, trials - done)
+        signs = rng.integers(0, 2, size=(n, len(diff)), dtype=np.int8) * 2 - 1
+        means = np.abs((signs * diff).mean(axis=1))
+        extreme += int((means >= observed - 1e-12).sum())
+        done += n
+    return (extreme + 1) / (trials + 1)
+
+def paired_t_statistic(a, b):
+    diff = np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)
+    if len(diff) < 2:
+        return 0.0
+    sd = diff.std(ddof=1)
+    return float(diff.mean() / (sd / np.sqrt(len(diff)))) if sd > 0 else 0.0
+
+def compare_runs(runs, qrels, baseline=None, k=10, trials=10000):
+    # evaluate many runs on the same queries, test each against the baseline
+    names = list(runs)
+    baseline = baseline or names[0]
+    queries = [q for q in qrels.queries if q in runs[baseline]]
+
+    tables = {name: per_query_table(runs[name], qrels, queries, k) for name in names}
+    base = tables[baseline]
+
+    comparison = {}
+    for name in names:
+        row = summarize(tables[name])
+        if name != baseline:
+            for metric in ('AP', f'NDCG@{k}', f'P@{k}'):
+                row[f'p({metric})'] = paired_randomization_test(tables[name][metric], base[metric], trials)
+            row['t(AP)'] = paired_t_statistic(tables[name]['AP'], base['AP'])
+        comparison[name] = row
+    return comparison, tables
+
+def format_table(rows, first_col='run'):
+    # rows: {name: {col: value}}
+    cols = []
+    for row in rows.values():
+        for c in row:
+            if c not in cols:
+                cols.append(c)
+    width = max([len(first_col)] + [len(str(n)) for n in rows]) + 2
+    col_width = {c: max(10, len(c) + 2) for c in cols}
+
+    lines = [first_col.ljust(width) + ''.join(c.rjust(col_width[c]) for c in cols)]
+    for name, row in rows.items():
+        vals = ''.join((f"{row[c]:.4f}" if c in row else '-').rjust(col_width[c]) for c in cols)
+        lines.append(str(name).ljust(width) + vals)
+    return '\n'.join(lines)
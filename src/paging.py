@@ -0,0 +1,197 @@
+# Search-after paging: later pages continue the selection of the first one
+# search() only takes top_k, so page n re-scores the corpus and selects the top
+# n * page_size again. search_page() returns one page plus an opaque cursor. the
+# query's candidates (every document with a nonzero score) stay in a small cache
+# with a time to live, and only as much of them is sorted as has been asked for:
+# a page inside the sorted part is a slice, the first page past it sorts one more
+# block of the rest. ranking order is (-score, doc_id) and the cursor carries the
+# last (score, doc_id) it returned, so when the cache entry is gone the query is
+# scored again and the ranking picks up strictly after that document
+#
+#   results, cursor = search_page(query, bm25, documents)
+#   more, cursor = search_page(query, bm25, documents, cursor=cursor)   # None on the last page
+
+import time
+import json
+import base64
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from preprocess import clean_malayalam_text, tokenize_malayalam
+from retrieval import make_result
+from instrument import stage, count
+
+PAGE_SIZE = 10
+BLOCK_PAGES = 5               # pages sorted at a time once past the sorted part
+TTL_SECONDS = 300.0
+CACHE_BYTES = 64 * 1024 * 1024
+
+class Ranking:
+    def __init__(self, ids, scores, winners=None):
+        # candidates not in order yet (winning passage per doc when ranked by passages)
+        self.rest = (ids, scores, winners)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0, dtype=np.float64)
+        self.winners = None if winners is None else np.zeros(0, dtype=np.int64)
+        # rank of the first candidate, nonzero when resumed from a cursor
+        self.base = 0
+        # sessions paging the same query share this ranking; extend() swaps
+        # ids and rest one after the other, so it and page() run under the lock
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        arrays = [self.ids, self.scores, self.winners] + list(self.rest)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.ids) + len(self.rest[0])
+
+    def extend(self, n):
+        # put the best n of the rest in order, ties by doc id; called with the lock held
+        ids, scores, winners = self.rest
+        n = min(n, len(ids))
+        if not n:
+            return
+        if n < len(ids):
+            # everything at or above the nth best score, so ties at the cut are
+            # settled by doc id and not by where the partition left them
+            cut = np.partition(scores, len(scores) - n)[len(scores) - n]
+            pick = np.flatnonzero(scores >= cut)
+        else:
+            pick = np.arange(len(ids))
+        pick = pick[np.lexsort((ids[pick], -scores[pick]))][:n]
+        self.ids = np.concatenate([self.ids, ids[pick]])
+        self.scores = np.concatenate([self.scores, scores[pick]])
+        keep = np.ones(len(ids), dtype=bool)
+        keep[pick] = False
+        if winners is not None:
+            self.winners = np.concatenate([self.winners, winners[pick]])
+            winners = winners[keep]
+        self.rest = (ids[keep], scores[keep], winners)
+
+    def page(self, offset, size, block):
+        with self.lock:
+            if offset + size > len(self.ids):
+                with stage('page_select'):
+                    self.extend(max(offset + size - len(self.ids), block))
+            end = min(offset + size, len(self.ids))
+            winners = self.winners[offset:end] if self.winners is not None else None
+            # slices stay valid after a later extend(), which builds new arrays
+            return self.ids[offset:end], self.scores[offset:end], winners
+
+class PageCache:
+    # rankings by query key, least recently used dropped past max_bytes
+    def __init__(self, max_bytes=CACHE_BYTES, ttl=TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            self.entries[key] = (time.monotonic(), entry[1])
+            return entry[1]
+
+    def put(self, key, ranking):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), ranking)
+            self.entries.move_to_end(key)
+            now = time.monotonic()
+            for k in [k for k, (t, _) in self.entries.items() if now - t > self.ttl]:
+                del self.entries[k]
+            # rankings grow as they get sorted, so measure at insert time
+            while len(self.entries) > 1 and sum(r.nbytes for _, r in self.entries.values()) > self.max_bytes:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+_cache = PageCache()
+
+def encode_cursor(key, offset, score, doc_id):
+    state = json.dumps([key, offset, score, doc_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(state).decode('ascii')
+
+def decode_cursor(cursor):
+    try:
+        key, offset, score, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return key, int(offset), float(score), int(doc_id)
+    except Exception:
+        raise ValueError("not a search cursor")
+
+def query_key(processed_query, bm25, passages, aggregate, expansions):
+    # the same query on the same index ranks the same way. no object ids: a cursor
+    # should still work after a restart, or in another server process
+    index = (len(bm25.doc_len), float(bm25.avg_len), bm25.k1, bm25.b,
+             (len(passages), aggregate) if passages is not None else None)
+    text = json.dumps([processed_query, sorted((expansions or {}).items()), repr(index)], ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def rank(processed_query, bm25, passages, aggregate, expansions, after=None):
+    # every candidate and its score; after=(score, doc_id) drops that doc and all
+    # before it in (-score, doc_id) order
+    if passages is not None:
+        ids, scores, winners = passages.doc_scores(processed_query, aggregate, expansions)
+    else:
+        all_scores = bm25.score(processed_query, expansions)
+        ids = np.flatnonzero(all_scores > 0)
+        scores, winners = all_scores[ids], None
+    if after is not None:
+        score, doc_id = after
+        keep = (scores < score) | ((scores == score) & (ids > doc_id))
+        ids, scores = ids[keep], scores[keep]
+        winners = winners[keep] if winners is not None else None
+    return Ranking(ids, scores, winners)
+
+def search_page(query, bm25, documents, page_size=PAGE_SIZE, cursor=None, speller=None,
+                passages=None, aggregate='max', cache=None):
+    # (results, cursor for the next page or None); bm25 ranking, by documents or
+    # by their passages. page_size may change from one page to the next
+    cache = _cache if cache is None else cache
+    cleaned = clean_malayalam_text(query)
+    tokens = tokenize_malayalam(cleaned)
+    processed_query = ' '.join(tokens)
+    expansions = None
+    if speller is not None:
+        with stage('fuzzy'):
+            expansions = speller.expand(tokens, bm25.postings)
+    key = query_key(processed_query, bm25, passages, aggregate, expansions)
+
+    offset = 0
+    after = None
+    if cursor is not None:
+        cursor_key, offset, score, doc_id = decode_cursor(cursor)
+        if cursor_key != key:
+            raise ValueError("cursor belongs to another query or index")
+        after = (score, doc_id)
+
+    ranking = cache.get(key)
+    if ranking is None or offset < ranking.base:
+        # first page, or the entry expired: rank (again), right after the cursor's document
+        if cursor is not None:
+            count('page_cache_misses')
+        with stage('page_rank'):
+            ranking = rank(processed_query, bm25, passages, aggregate, expansions, after)
+        ranking.base = offset
+        cache.put(key, ranking)
+    elif cursor is not None:
+        count('page_cache_hits')
+
+    ids, scores, winners = ranking.page(offset - ranking.base, page_size, page_size * BLOCK_PAGES)
+    results = [make_result(documents, d, s, passages, int(winners[i]) if winners is not None else -1)
+               for i, (d, s) in enumerate(zip(ids, scores))]
+    end = offset + len(ids)
+    more = end - ranking.base < len(ranking)
+    next_cursor = encode_cursor(key, end, float(scores[-1]), int(ids[-1])) if more and len(ids) else None
+    return results, next_cursor
@@ -0,0 +1,214 @@
+# Passage level index: documents split into overlapping word windows
+# some crawled pages are enormous. as one bm25 unit such a page pulls avg_len up
+# for everyone, wins on raw term counts, and leaves the app highlighting the whole
+# text. here every document is cut into windows of PASSAGE_WORDS words, each
+# overlapping the next by PASSAGE_WORDS - STRIDE, and each window is a bm25
+# document of its own. a document scores by its best passage (or the sum of its
+# best few) and its snippet is that passage, so the work per hit is bounded by
+# the passage size, not the document size
+
+import os
+import re
+import json
+import time
+import pickle
+import argparse
+import numpy as np
+from preprocess import clean_malayalam_text, tokenize_malayalam
+from retrieval import BM25, top_k_indices
+from instrument import stage
+
+PASSAGE_WORDS = 100
+STRIDE = 75
+SUM_PASSAGES = 2       # passages added up per document with aggregate='sum'
+CLASSIFY_WORDS = 40    # about what fits in the classifier's 128 subword tokens
+CLASSIFY_STRIDE = 30
+MAX_CLASSIFY_PASSAGES = 16
+
+def split_passages(text, size=PASSAGE_WORDS, stride=STRIDE):
+    # (start, end) character spans of overlapping word windows; the last window
+    # ends at the last word, so there is no short leftover passage
+    words = [m.span() for m in re.finditer(r'\S+', text)]
+    spans = []
+    start = 0
+    while start < len(words):
+        end = min(start + size, len(words))
+        spans.append((words[start][0], words[end - 1][1]))
+        if end == len(words):
+            break
+        start += stride
+    return spans
+
+def passage_texts(text, size=PASSAGE_WORDS, stride=STRIDE, limit=None):
+    # the passages themselves, for models that only read a fixed number of tokens
+    spans = split_passages(text, size, stride)
+    return [text[start:end] for start, end in spans[:limit]]
+
+def index_text(passage):
+    # same terms as the document level index
+    return ' '.join(tokenize_malayalam(clean_malayalam_text(passage)))
+
+class PassageIndex:
+    def __init__(self, bm25, passage_doc, spans, num_docs, size=PASSAGE_WORDS, stride=STRIDE, doc_digest=None):
+        # passage i belongs to doc passage_doc[i] (ascending) and is characters
+        # spans[i] of its original text
+        self.bm25 = bm25
+        self.passage_doc = passage_doc
+        self.spans = spans
+        self.num_docs = num_docs
+        self.size = size
+        self.stride = stride
+        # digest of the document level bm25 index over the same num_docs docs
+        self.doc_digest = doc_digest
+        self.set_offsets()
+
+    def set_offsets(self):
+        # passages of doc d are doc_offsets[d]:doc_offsets[d + 1]
+        self.doc_offsets = np.searchsorted(self.passage_doc, np.arange(self.num_docs + 1)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.passage_doc)
+
+    @classmethod
+    def build(cls, texts, size=PASSAGE_WORDS, stride=STRIDE, doc_digest=None):
+        docs, spans, passages = [], [], []
+        num_docs = 0
+        for doc_id, text in enumerate(texts):
+            for start, end in split_passages(text, size, stride):
+                docs.append(doc_id)
+                spans.append((start, end))
+                passages.append(index_text(text[start:end]))
+            num_docs += 1
+        return cls(BM25(passages), np.array(docs, dtype=np.int32),
+                   np.array(spans, dtype=np.int64).reshape(-1, 2), num_docs, size, stride, doc_digest)
+
+    def add_documents(self, texts):
+        # new documents after the last one, for streaming ingestion (see ingest.py).
+        # the document index grows too, its new digest is set before saving
+        docs, spans, passages = [], [], []
+        for doc_id, text in enumerate(texts, self.num_docs):
+            for start, end in split_passages(text, self.size, self.stride):
+                docs.append(doc_id)
+                spans.append((start, end))
+                passages.append(index_text(text[start:end]))
+            self.num_docs = doc_id + 1
+        if passages:
+            self.bm25.add_documents(passages)
+            self.passage_doc = np.concatenate([self.passage_doc, np.array(docs, dtype=np.int32)])
+            self.spans = np.concatenate([self.spans, np.array(spans, dtype=np.int64)])
+        self.doc_digest = None
+        self.set_offsets()
+
+    def matches(self, bm25):
+        # built for the same corpus as the document level index; the count alone
+        # misses a corpus rebuilt to the same size
+        return (self.doc_digest is not None and self.num_docs == len(bm25.doc_len)
+                and self.doc_digest == bm25.digest())
+
+    def doc_scores(self, processed_query, aggregate='max', expansions=None):
+        # (doc ids, doc scores, winning passage ids) of every document with a hit
+        scores = self.bm25.score(processed_query, expansions)
+        with stage('passage_aggregate'):
+            hit = np.flatnonzero(scores > 0)
+            docs = self.passage_doc[hit]
+            # group by document, best passage first inside each group
+            order = np.lexsort((-scores[hit], docs))
+            hit, docs = hit[order], docs[order]
+            first = np.ones(len(docs), dtype=bool)
+            first[1:] = docs[1:] != docs[:-1]
+            starts = np.flatnonzero(first)
+            if aggregate == 'sum':
+                group = np.cumsum(first) - 1
+                rank = np.arange(len(docs)) - starts[group]
+                keep = rank < SUM_PASSAGES
+                totals = np.bincount(group[keep], weights=scores[hit[keep]], minlength=len(starts))
+            else:
+                totals = scores[hit[starts]]
+        return docs[starts].astype(np.int64), totals, hit[starts]
+
+    def top_k(self, processed_query, k, aggregate='max', expansions=None):
+        # (doc ids, doc scores, winning passage ids), best document first
+        docs, totals, winners = self.doc_scores(processed_query, aggregate, expansions)
+        top = top_k_indices(totals, k)
+        return docs[top], totals[top], winners[top]
+
+    def best_passages(self, processed_query, doc_ids, expansions=None):
+        # highest scoring passage of each given doc, for results ranked another way
+        scores = self.bm25.score(processed_query, expansions)
+        best = []
+        for doc_id in doc_ids:
+            lo, hi = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+            best.append(lo + int(np.argmax(scores[lo:hi])) if hi > lo else -1)
+        return best
+
+    def snippet(self, documents, doc_id, passage):
+        start, end = self.spans[passage]
+        return documents[doc_id][start:end]
+
+    def save(self, filename):
+        # plain fields rather than the object, so loading does not depend on the
+        # module the index was built from
+        state = {'bm25': self.bm25, 'passage_doc': self.passage_doc, 'spans': self.spans,
+                 'num_docs': self.num_docs, 'size': self.size, 'stride': self.stride,
+                 'doc_digest': self.doc_digest}
+        with open(filename, 'wb') as f:
+            pickle.dump(state, f)
+
+    @classmethod
+    def load(cls, filename):
+        # indexes from before doc_digest never match, rebuild them
+        with open(filename, 'rb') as f:
+            return cls(**pickle.load(f))
+
+def main():
+    from retrieval import search
+    from docstore import load_documents
+
+    parser = argparse.ArgumentParser(description="build the passage level bm25 index")
+    parser.add_argument('--corpus', default='data/processed_corpus.json')
+    parser.add_argument('--index', default='models/bm25_index.pkl')
+    parser.add_argument('--output', default='models/passage_index.pkl')
+    parser.add_argument('--words', type=int, default=PASSAGE_WORDS)
+    parser.add_argument('--stride', type=int, default=STRIDE)
+    args = parser.parse_args()
+
+    print("loading corpus...")
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    texts = [item.get('original_text', item['text']) for item in data]
+
+    # the app only serves the passages next to the document index they were built with
+    bm25 = None
+    digest = None
+    if os.path.exists(args.index):
+        with open(args.index, 'rb') as f:
+            bm25 = pickle.load(f)
+        if len(bm25.doc_len) == len(texts):
+            digest = bm25.digest()
+        else:
+            print(f"{args.index} has {len(bm25.doc_len)} docs, not {len(texts)}; the app will not use this index")
+    else:
+        print(f"no {args.index}, build it first or the app will not use this index")
+
+    t = time.perf_counter()
+    index = PassageIndex.build(texts, args.words, args.stride, digest)
+    index.save(args.output)
+    per_doc = np.diff(index.doc_offsets)
+    doc_lens = [len(item['text'].split()) for item in data]
+    print(f"{len(texts)} documents -> {len(index)} passages in {time.perf_counter() - t:.1f}s -> {args.output}")
+    print(f"passages per document: max {per_doc.max()}, {int((per_doc > 1).sum())} documents split")
+    print(f"avg length: {index.bm25.avg_len:.1f} terms per passage, "
+          f"{sum(doc_lens) / max(1, len(doc_lens)):.1f} per document (longest {max(doc_lens, default=0)})")
+
+    query = "വാർത്ത" # news
+    documents = load_documents(corpus_file=args.corpus, num_docs=index.num_docs)
+    if bm25 is None or not index.matches(bm25):
+        print("bm25 index is for another corpus, skipping the test search")
+        return
+    print(f"\nsearch results for query: {query}\n")
+    for i, res in enumerate(search(query, bm25, documents, passages=index)):
+        print(f"{i+1}. doc {res['doc_id']} score: {res['score']:.3f}")
+        print(f"   passage: {res['text']}...\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+# Incremental pipeline runner (replaces the body of run_all.bat)
+# every step lists the files it reads and writes; a step depends on whichever steps
+# write its inputs. a step is skipped when the hash of its inputs, code and arguments
+# matches the last successful run and its outputs are untouched since then.
+# steps whose dependencies are done run in parallel.
+#
+#   python src/pipeline.py                  every default step that is out of date
+#   python src/pipeline.py evaluate         evaluate and whatever it needs
+#   python src/pipeline.py all collect      crawl again, then everything after it
+#   python src/pipeline.py --force bm25     rerun bm25 and everything after it
+#   python src/pipeline.py --dry-run        show what would run
+
+import os
+import sys
+import ast
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SRC_DIR = 'src'
+STATE_FILE = 'results/pipeline_state.json'
+LOG_DIR = 'logs/pipeline'
+
+# default=False steps only run when asked for by name; they are never pulled in
+# as a dependency, so the crawl and the reranker training stay opt in
+STEPS = {
+    'collect': {'script': 'src/collect_data.py', 'default': False, 'inputs': [],
+                'outputs': ['data/malayalam_corpus.json']},
+    'dedupe': {'script': 'src/dedupe.py', 'inputs': ['data/malayalam_corpus.json'],
+               'outputs': ['data/deduped_corpus.json', 'data/dedupe_report.json']},
+    'preprocess': {'script': 'src/preprocess.py', 'args': ['data/deduped_corpus.json'],
+                   'inputs': ['data/deduped_corpus.json'], 'outputs': ['data/processed_corpus.json']},
+    'docstore': {'script': 'src/docstore.py', 'inputs': ['data/processed_corpus.json'],
+                 'outputs': ['data/docstore']},
+    'svm': {'script': 'src/classify.py', 'inputs': ['data/processed_corpus.json'],
+            'outputs': ['models/classifier.pkl', 'models/vectorizer.pkl']},
+    'bert': {'script': 'src/classify_bert.py', 'inputs': ['data/processed_corpus.json'],
+             'outputs': ['models/bert_classifier']},
+    'bm25': {'script': 'src/retrieval.py', 'inputs': ['data/processed_corpus.json'],
+             'outputs': ['models/bm25_index.pkl']},
+    'impact': {'script': 'src/impact_index.py', 'inputs': ['models/bm25_index.pkl'],
+               'outputs': ['models/impact_index.npz', 'results/impact_agreement.json']},
+    'substring': {'script': 'src/substring_index.py', 'inputs': ['data/processed_corpus.json', 'models/bm25_index.pkl'],
+                  'outputs': ['models/substring_index.npz']},
+    'passages': {'script': 'src/passages.py', 'inputs': ['data/processed_corpus.json', 'models/bm25_index.pkl'],
+                 'outputs': ['models/passage_index.pkl']},
+    'vectors': {'script': 'src/vector_search.py', 'inputs': ['data/processed_corpus.json'],
+                'outputs': ['models/vectorizer_ir.pkl', 'models/doc_vectors.pkl']},
+    'ann': {'script': 'src/ann_index.py', 'inputs': ['models/vectorizer_ir.pkl', 'models/doc_vectors.pkl'],
+            'outputs': ['models/ann_index', 'results/ann_recall.json']},
+    'autocomplete': {'script': 'src/autocomplete.py',
+                     'inputs': ['data/processed_corpus.json', 'models/bm25_index.pkl', 'data/query_log.txt'],
+                     'outputs': ['models/autocomplete.npz']},
+    'judgments': {'script': 'src/update_judgments.py', 'inputs': ['data/processed_corpus.json'],
+                  'outputs': ['data/relevance_judgments.json', 'data/relevance_judgments.state.json']},
+    'reranker': {'script': 'src/rerank.py', 'default': False,
+                 'inputs': ['data/processed_corpus.json', 'models/bm25_index.pkl', 'data/relevance_judgments.json'],
+                 'outputs': ['models/bert_reranker']},
+    'evaluate': {'script': 'src/evaluate.py',
+                 'inputs': ['models/bm25_index.pkl', 'models/impact_index.npz', 'models/passage_index.pkl',
+                            'data/docstore', 'data/relevance_judgments.json',
+                            'models/vectorizer_ir.pkl', 'models/doc_vectors.pkl', 'models/ann_index',
+                            'models/bert_reranker'],
+                 'outputs': ['data/results_to_label.json']},
+    'publish': {'script': 'src/snapshots.py', 'args': ['publish'],
+                'inputs': ['models/bm25_index.pkl', 'models/impact_index.npz', 'models/substring_index.npz',
+                           'models/passage_index.pkl', 'models/autocomplete.npz', 'models/vectorizer_ir.pkl', 'models/doc_vectors.pkl',
+                           'models/ann_index', 'models/classifier.pkl', 'models/vectorizer.pkl',
+                           'models/bert_classifier', 'models/bert_reranker', 'data/docstore'],
+                'outputs': ['models/snapshots/CURRENT.json']},
+}
+
+def code_deps(script):
+    # the script plus every module from src it imports, directly or through other modules
+    seen = set()
+    stack = [script]
+    while stack:
+        path = stack.pop()
+        if path in seen or not os.path.exists(path):
+            continue
+        seen.add(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = f"{SRC_DIR}/{name.split('.')[0]}.py"
+                if os.path.exists(module):
+                    stack.append(module)
+    return sorted(seen)
+
+class Hasher:
+    # content hashes, remembered by (mtime, size) so unchanged files are not read again
+    def __init__(self, cache):
+        self.cache = cache
+
+    def file(self, path):
+        st = os.stat(path)
+        cached = self.cache.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.cache[path] = [st.st_mtime_ns, st.st_size, digest]
+        return digest
+
+    def path(self, path):
+        if os.path.isfile(path):
+            return self.file(path)
+        if os.path.isdir(path):
+            h = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name).replace(os.sep, '/')
+                    h.update(full.encode('utf-8') + b'\0' + self.file(full).encode('ascii'))
+            return h.hexdigest()
+        return 'missing'
+
+def fingerprint(name, hasher):
+    step = STEPS[name]
+    parts = {
+        'args': step.get('args', []),
+        'inputs': {p: hasher.path(p) for p in step['inputs']},
+        'code': {p: hasher.path(p) for p in code_deps(step['script'])},
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'steps': {}, 'hashes': {}}
+
+def save_state(state):
+    # write then rename, a crash mid run keeps the previous state
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp = STATE_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_FILE)
+
+def up_to_date(name, fp, state, hasher):
+    last = state['steps'].get(name)
+    if not last or last.get('status') != 'ok' or last.get('fingerprint') != fp:
+        return False
+    # outputs edited or deleted by hand count as stale
+    return all(hasher.path(p) == last['outputs'].get(p) for p in STEPS[name]['outputs'])
+
+def select(targets):
+    # the targets ('all' = every default step) plus the default steps writing their inputs
+    targets = set(targets or ['all'])
+    wanted = {s for s in STEPS if s in targets or ('all' in targets and STEPS[s].get('default', True))}
+    stack = list(wanted)
+    while stack:
+        name = stack.pop()
+        for other, step in STEPS.items():
+            if other not in wanted and step.get('default', True) and set(step['outputs']) & set(STEPS[name]['inputs']):
+                wanted.add(other)
+                stack.append(other)
+    return [s for s in STEPS if s in wanted]
+
+def dependencies(selected):
+    return {s: {p for p in selected if p != s and set(STEPS[p]['outputs']) & set(STEPS[s]['inputs'])}
+            for s in selected}
+
+def run_step(name):
+    step = STEPS[name]
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_file = f"{LOG_DIR}/{name}.log"
+    # malayalam output breaks the default console encoding on windows
+    env = dict(os.environ, PYTHONIOENCODING='utf-8')
+    start = time.perf_counter()
+    peak = None
+    with open(log_file, 'w', encoding='utf-8') as log:
+        proc = subprocess.Popen([sys.executable, step['script'], *step.get('args', [])],
+                                stdout=log, stderr=subprocess.STDOUT, env=env)
+        if hasattr(os, 'wait4'):
+            # rusage of the finished child gives its peak memory
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # kilobytes on linux, bytes on mac
+            peak = usage.ru_maxrss / 1024 / 1024 if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+        else:
+            proc.wait()
+    return {'returncode': proc.returncode, 'wall_s': time.perf_counter() - start,
+            'peak_rss_mb': peak, 'log': log_file}
+
+def run_pipeline(targets=None, force=(), jobs=2, dry_run=False):
+    selected = select(targets)
+    deps = dependencies(selected)
+    # forcing a step makes everything downstream of it run too
+    # (STEPS is listed in dependency order, so one pass is enough)
+    forced = set(force)
+    for s in selected:
+        if deps[s] & forced:
+            forced.add(s)
+
+    state = load_state()
+    hasher = Hasher(state['hashes'])
+    status = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while len(status) < len(selected):
+            for s in selected:
+                if s in status or s in running.values():
+                    continue
+                if any(status.get(d) in ('failed', 'blocked') for d in deps[s]):
+                    status[s] = 'blocked'
+                    print(f"[blocked] {s}")
+                    continue
+                if not all(d in status for d in deps[s]):
+                    continue
+
+                # inputs are hashed only now, after the steps that write them have run
+                fp = fingerprint(s, hasher)
+                if s not in forced and up_to_date(s, fp, state, hasher) \
+                        and not any(status[d] == 'would run' for d in deps[s]):
+                    status[s] = 'skipped'
+                    print(f"[skip] {s} (up to date)")
+                elif dry_run:
+                    status[s] = 'would run'
+                    print(f"[would run] {s}")
+                else:
+                    print(f"[run] {s}: {STEPS[s]['script']}")
+                    running[pool.submit(run_step, s)] = s
+                    state['steps'].setdefault(s, {})['pending_fingerprint'] = fp
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                s = running.pop(future)
+                result = future.result()
+                record = state['steps'].setdefault(s, {})
+                fp = record.pop('pending_fingerprint')
+                record.update({'wall_s': round(result['wall_s'], 2), 'peak_rss_mb': result['peak_rss_mb'],
+                               'finished_at': time.time(), 'log': result['log']})
+                if result['returncode'] == 0:
+                    record.update({'status': 'ok', 'fingerprint': fp,
+                                   'outputs': {p: hasher.path(p) for p in STEPS[s]['outputs']}})
+                    status[s] = 'ok'
+                    print(f"[done] {s} in {result['wall_s']:.1f}s")
+                else:
+                    record['status'] = 'failed'
+                    status[s] = 'failed'
+                    print(f"[failed] {s} with code {result['returncode']}, see {result['log']}")
+                save_state(state)
+
+    save_state(state)
+    print_summary(selected, status, state)
+    return status
+
+def print_summary(selected, status, state):
+    print(f"\n{'step':<14}{'status':<12}{'wall s':>10}{'peak MB':>10}")
+    for s in selected:
+        record = state['steps'].get(s, {})
+        ran = status[s] in ('ok', 'failed')
+        wall = f"{record['wall_s']:.1f}" if ran else '-'
+        peak = f"{record['peak_rss_mb']:.0f}" if ran and record.get('peak_rss_mb') is not None else '-'
+        print(f"{s:<14}{status[s]:<12}{wall:>10}{peak:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="run the pipeline steps that are out of date")
+    parser.add_argument('targets', nargs='*', metavar='step',
+                        help=f"steps to bring up to date, 'all' for every step but "
+                             f"{', '.join(s for s in STEPS if not STEPS[s].get('default', True))} (default: all)")
+    parser.add_argument('--force', nargs='+', default=[], metavar='step',
+                        help="rerun these steps even if up to date")
+    parser.add_argument('--jobs', type=int, default=2, help="steps run at the same time")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    unknown = (set(args.targets) - {'all'} | set(args.force)) - set(STEPS)
+    if unknown:
+        parser.error(f"unknown steps: {', '.join(sorted(unknown))} (choose from {', '.join(STEPS)})")
+
+    status = run_pipeline(args.targets, args.force, args.jobs, args.dry_run)
+    if any(v in ('failed', 'blocked') for v in status.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
 # Clean and prepare text
 
+import os
 import re
 import json
+import argparse
+from instrument import timed
 
+@timed('clean')
 def clean_malayalam_text(text):
     # Remove extra spaces
     text = re.sub(r'\s+', ' ', text)
@@ -40,18 +44,38 @@ def simple_stem(word):
             return word[:-len(s)]
     return word
 
-def tokenize_malayalam(text):
+@timed('tokenize')
+def tokenize_malayalam(text, stem=True, remove_stopwords=True):
     # Split and clean words
     tokens = text.split()
-    stopwords = get_stopwords()
+    stopwords = get_stopwords() if remove_stopwords else set()
     
     processed = []
     for t in tokens:
         if t not in stopwords:
-            processed.append(simple_stem(t))
+            processed.append(simple_stem(t) if stem else t)
             
     return processed
 
+def process_text(text):
+    # one corpus record, or None for very short texts
+    # Clean the text
+    cleaned = clean_malayalam_text(text)
+    
+    # Skip very short texts
+    if len(cleaned) < 20:
+        return None
+    
+    # Break into words
+    tokens = tokenize_malayalam(cleaned)
+    
+    return {
+        'text': ' '.join(tokens),
+        'original_text': cleaned,
+        'tokens': tokens,
+        'num_tokens': len(tokens)
+    }
+
 def preprocess_corpus(input_file, output_file):
     print("loading data...")
     
@@ -63,22 +87,9 @@ def preprocess_corpus(input_file, output_file):
     processed_data = []
     
     for text in texts:
-        # Clean the text
-        cleaned = clean_malayalam_text(text)
-        
-        # Skip very short texts
-        if len(cleaned) < 20:
-            continue
-        
-        # Break into words
-        tokens = tokenize_malayalam(cleaned)
-        
-        processed_data.append({
-            'text': ' '.join(tokens),
-            'original_text': cleaned,
-            'tokens': tokens,
-            'num_tokens': len(tokens)
-        })
+        record = process_text(text)
+        if record is not None:
+            processed_data.append(record)
     
     # Save processed data
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -88,4 +99,19 @@ def preprocess_corpus(input_file, output_file):
     print("done")
 
 if __name__ == '__main__':
-    preprocess_corpus('data/malayalam_corpus.json', 'data/processed_corpus.json')
+    parser = argparse.ArgumentParser(description="clean and tokenize the corpus")
+    parser.add_argument('input', nargs='?', default=None,
+                        help="corpus json; by default the dedupe output when it is newer than the crawl")
+    parser.add_argument('--output', default='data/processed_corpus.json')
+    args = parser.parse_args()
+
+    source = args.input
+    if source is None:
+        # a dedupe output older than the crawl belongs to an earlier crawl
+        source = 'data/malayalam_corpus.json'
+        deduped = 'data/deduped_corpus.json'
+        if os.path.exists(deduped) and (not os.path.exists(source) or
+                                        os.path.getmtime(deduped) >= os.path.getmtime(source)):
+            source = deduped
+    print(f"reading {source}")
+    preprocess_corpus(source, args.output)
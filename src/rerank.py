@@ -0,0 +1,212 @@
+# Second stage ranking: BM25 candidates re-scored by a DistilBERT cross-encoder
+# same multilingual DistilBERT stack as classify_bert.py, trained on (query, passage) pairs
+
+import os
+import json
+import time
+import random
+import torch
+from collections import OrderedDict
+from transformers import DistilBertTokenizer, DistilBertForSequenceClassification, Trainer, TrainingArguments
+from instrument import stage, count
+from retrieval import BM25  # needed to unpickle the index
+
+BASE_MODEL = 'distilbert-base-multilingual-cased'
+RERANKER_PATH = 'models/bert_reranker'
+HELDOUT_FILE = 'heldout_queries.json'  # next to the model: judged queries it never saw
+HELDOUT_FRACTION = 0.4
+
+class CrossEncoderReranker:
+    def __init__(self, passages, model_path=RERANKER_PATH, candidates=100, top_n=20, budget_ms=500,
+                 max_length=256, cache_size=20000):
+        # passages: original text per doc id, what the model reads
+        # candidates: first stage depth, top_n: how many of those the model scores
+        self.passages = passages
+        self.candidates = candidates
+        self.tokenizer = DistilBertTokenizer.from_pretrained(model_path)
+        self.model = DistilBertForSequenceClassification.from_pretrained(model_path)
+        self.model.eval()
+        self.top_n = top_n
+        self.budget_ms = budget_ms
+        self.max_length = max_length
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        # running estimate of forward cost, used to decide up front what fits the budget
+        self.ms_per_pair = None
+        self.fallbacks = 0
+
+    def cache_get(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        return None
+
+    def cache_put(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def score_pairs(self, query, doc_ids):
+        # one padded batch for all pairs
+        with stage('rerank_tokenize'):
+            inputs = self.tokenizer([query] * len(doc_ids), [self.passages[i] for i in doc_ids],
+                                    return_tensors='pt', truncation='only_second',
+                                    padding=True, max_length=self.max_length)
+        with stage('rerank_forward'), torch.no_grad():
+            logits = self.model(**inputs).logits
+        # relevance = log odds of the "relevant" label
+        if logits.shape[1] > 1:
+            return (logits[:, 1] - logits[:, 0]).tolist()
+        return logits[:, 0].tolist()
+
+    def rerank(self, query, doc_ids, first_stage_scores, budget_ms=None):
+        # returns (doc_ids, scores, reranked); reranked is False when we kept bm25 order
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        start = time.perf_counter()
+        head = [int(d) for d in doc_ids[:self.top_n]]
+        key = ' '.join(query.split())
+
+        scores = {}
+        misses = []
+        for d in head:
+            cached = self.cache_get((key, d))
+            if cached is None:
+                misses.append(d)
+            else:
+                scores[d] = cached
+        count('rerank_cache_hits', len(head) - len(misses))
+
+        if misses:
+            # only as many pairs as the estimate says fit the budget, in first stage
+            # order; at least one, so a slow cold start does not keep the
+            # estimate (and with it the model) stuck forever
+            if self.ms_per_pair is not None:
+                misses = misses[:max(1, int(budget_ms / self.ms_per_pair))]
+
+            t = time.perf_counter()
+            for d, s in zip(misses, self.score_pairs(query, misses)):
+                scores[d] = s
+                self.cache_put((key, d), s)
+            per_pair = (time.perf_counter() - t) * 1000 / len(misses)
+            self.ms_per_pair = per_pair if self.ms_per_pair is None else 0.8 * self.ms_per_pair + 0.2 * per_pair
+
+            if (time.perf_counter() - start) * 1000 > budget_ms:
+                # over budget this time: answer with bm25 order, the scores stay cached
+                self.fallbacks += 1
+                count('rerank_fallbacks')
+                return list(doc_ids), list(first_stage_scores), False
+
+        # the model orders the longest scored prefix of the head, everything after
+        # it keeps its bm25 order below
+        scored = next((i for i, d in enumerate(head) if d not in scores), len(head))
+        if scored < 2:
+            self.fallbacks += 1
+            count('rerank_fallbacks')
+            return list(doc_ids), list(first_stage_scores), False
+        ordered = sorted(head[:scored], key=lambda d: scores[d], reverse=True)
+        tail = [int(d) for d in doc_ids[scored:]]
+        tail_scores = list(first_stage_scores[scored:])
+        return ordered + tail, [scores[d] for d in ordered] + tail_scores, True
+
+def load_reranker(passages, model_path=RERANKER_PATH, **kwargs):
+    if not os.path.exists(model_path):
+        print(f"no reranker at {model_path}, run rerank.py to train one")
+        return None
+    return CrossEncoderReranker(passages, model_path, **kwargs)
+
+def training_pairs(queries, judgments, bm25, documents, original_docs, negatives_per_query=60, seed=42):
+    # positives: judged docs, negatives: high scoring bm25 docs that are not judged + random docs
+    from retrieval import search
+    rng = random.Random(seed)
+    pairs = []
+    for query_id, query_text in queries:
+        relevant = set(judgments.get(query_id, []))
+        if not relevant:
+            continue
+        for d in relevant:
+            pairs.append((query_text, original_docs[d], 1))
+        hard = [r['doc_id'] for r in search(query_text, bm25, documents, top_k=200) if r['doc_id'] not in relevant]
+        easy = [d for d in rng.sample(range(len(documents)), min(len(documents), negatives_per_query))
+                if d not in relevant]
+        for d in hard[:negatives_per_query // 2] + easy[:negatives_per_query // 2]:
+            pairs.append((query_text, original_docs[d], 0))
+    rng.shuffle(pairs)
+    return pairs
+
+def split_queries(queries, judgments, heldout_fraction=HELDOUT_FRACTION, seed=42):
+    # by query, not by pair: pairs of one query share its text and its hard
+    # negatives, so a pair split would test on queries the model trained on
+    judged = [q for q in queries if judgments.get(q[0])]
+    random.Random(seed).shuffle(judged)
+    n = min(len(judged) - 1, max(1, round(len(judged) * heldout_fraction)))
+    if n < 1:
+        raise ValueError("need at least two judged queries to hold one out")
+    return judged[n:], judged[:n]
+
+def heldout_queries(model_path=RERANKER_PATH):
+    # ids of the judged queries a trained model was not trained on, None when unknown
+    try:
+        with open(os.path.join(model_path, HELDOUT_FILE), 'r', encoding='utf-8') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+def train_reranker(output_path=RERANKER_PATH):
+    import pickle
+    from evaluate import TEST_QUERIES
+    from classify_bert import MalayalamDataset, compute_metrics
+
+    print("loading data...")
+    with open('models/bm25_index.pkl', 'rb') as f:
+        bm25 = pickle.load(f)
+    with open('data/processed_corpus.json', 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    with open('data/relevance_judgments.json', 'r', encoding='utf-8') as f:
+        judgments = json.load(f)
+    documents = [item['text'] for item in data]
+    original_docs = [item.get('original_text', item['text']) for item in data]
+
+    train_queries, test_queries = split_queries(TEST_QUERIES, judgments)
+    print(f"training on {[q for q, _ in train_queries]}, held out {[q for q, _ in test_queries]}")
+    train_pairs = training_pairs(train_queries, judgments, bm25, documents, original_docs)
+    test_pairs = training_pairs(test_queries, judgments, bm25, documents, original_docs)
+    print(f"{len(train_pairs)} training pairs ({sum(p[2] for p in train_pairs)} positive), "
+          f"{len(test_pairs)} held out ({sum(p[2] for p in test_pairs)} positive)")
+
+    print("loading model...")
+    tokenizer = DistilBertTokenizer.from_pretrained(BASE_MODEL)
+    model = DistilBertForSequenceClassification.from_pretrained(BASE_MODEL, num_labels=2)
+
+    def encode(ps):
+        enc = tokenizer([p[0] for p in ps], [p[1] for p in ps], truncation='only_second', padding=True, max_length=256)
+        return MalayalamDataset(enc, [p[2] for p in ps])
+
+    training_args = TrainingArguments(
+        output_dir='./results/reranker',
+        num_train_epochs=1,
+        per_device_train_batch_size=8,
+        per_device_eval_batch_size=16,
+        logging_dir='./logs',
+        logging_steps=10,
+        eval_strategy="epoch",
+        use_cpu=True
+    )
+    trainer = Trainer(model=model, args=training_args, train_dataset=encode(train_pairs),
+                      eval_dataset=encode(test_pairs), compute_metrics=compute_metrics)
+
+    print("training reranker (this may take a while)...")
+    trainer.train()
+    results = trainer.evaluate()
+    print(f"f1 on held out queries: {results['eval_f1']:.3f}")
+
+    print("saving model...")
+    model.save_pretrained(output_path)
+    tokenizer.save_pretrained(output_path)
+    # evaluate.py scores the model on these only
+    with open(os.path.join(output_path, HELDOUT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(sorted(q for q, _ in test_queries), f)
+    print("done")
+
+if __name__ == '__main__':
+    train_reranker()
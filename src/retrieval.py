@@ -3,56 +3,142 @@
 import json
 import pickle
 import math
+import hashlib
 import numpy as np
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from preprocess import clean_malayalam_text, tokenize_malayalam
+from metrics import Qrels, per_query_table
+from instrument import timed, stage
+
+# candidates each retriever hands to hybrid fusion
+HYBRID_CANDIDATES = 100
+RRF_K = 60
+
+_pool = None
 
 class BM25:
     def __init__(self, documents, k1=1.5, b=0.75):
         self.documents = documents
         self.k1 = k1
         self.b = b
-        self.doc_len = [len(d.split()) for d in documents]
-        self.avg_len = sum(self.doc_len) / len(documents)
+        self.doc_len = np.array([len(d.split()) for d in documents], dtype=np.float64)
+        self.avg_len = float(self.doc_len.sum()) / len(documents)
         self.doc_freqs = []
         self.idf = {}
+        self.postings = {}
         self.build_index()
 
     def build_index(self):
         print("building bm25 index...")
-        df = Counter()
-        for doc in self.documents:
-            words = set(doc.split())
-            df.update(words)
+        # inverted index: word -> (doc ids, term freqs)
+        doc_ids = {}
+        tfs = {}
+        for i, doc in enumerate(self.documents):
+            for word, f in Counter(doc.split()).items():
+                doc_ids.setdefault(word, []).append(i)
+                tfs.setdefault(word, []).append(f)
         
+        self.doc_len = np.asarray(self.doc_len, dtype=np.float64)
+        self.postings = {}
         N = len(self.documents)
-        for word, freq in df.items():
+        for word, ids in doc_ids.items():
+            self.postings[word] = (np.array(ids, dtype=np.int32), np.array(tfs[word], dtype=np.float32))
+            freq = len(ids)
             idf = math.log((N - freq + 0.5) / (freq + 0.5) + 1)
             self.idf[word] = idf
 
-    def score(self, query):
-        scores = np.zeros(len(self.documents))
-        q_words = query.split()
+    def add_documents(self, documents):
+        # append documents without a rebuild; each term in the batch costs one
+        # concatenate, so adding in batches keeps it cheap
+        if not getattr(self, 'postings', None):
+            self.build_index()
+        start = len(self.doc_len)
+        doc_ids = {}
+        tfs = {}
+        for i, doc in enumerate(documents, start):
+            for word, f in Counter(doc.split()).items():
+                doc_ids.setdefault(word, []).append(i)
+                tfs.setdefault(word, []).append(f)
+        for word, ids in doc_ids.items():
+            ids = np.array(ids, dtype=np.int32)
+            f = np.array(tfs[word], dtype=np.float32)
+            old = self.postings.get(word)
+            self.postings[word] = (ids, f) if old is None else (np.concatenate([old[0], ids]), np.concatenate([old[1], f]))
+
+        self.doc_len = np.concatenate([self.doc_len, [len(d.split()) for d in documents]])
+        self.avg_len = float(self.doc_len.sum()) / len(self.doc_len)
+        # N changed, so every idf does
+        N = len(self.doc_len)
+        self.idf = {word: math.log((N - len(ids) + 0.5) / (len(ids) + 0.5) + 1) for word, (ids, _) in self.postings.items()}
+        if getattr(self, 'documents', None) is not None:
+            self.documents.extend(documents)
+        # cached norms, digest and precomputed impacts describe the old corpus
+        self.__dict__.pop('_norm', None)
+        self.__dict__.pop('_digest', None)
+        self.impact = None
+
+    def length_norm(self):
+        # k1 * (1 - b + b * len / avg_len), cached per parameter setting
+        key = (self.k1, self.b)
+        cached = getattr(self, '_norm', None)
+        if cached is None or cached[0] != key:
+            norm = self.k1 * (1 - self.b + self.b * (self.doc_len / self.avg_len))
+            self._norm = (key, norm)
+        return self._norm[1]
+
+    @timed('bm25_score')
+    def score(self, query, expansions=None):
+        # expansions: {term: weight} extra terms scored at a fraction of a real match
+        # older pickles only have idf, build postings on first use
+        if not getattr(self, 'postings', None):
+            self.build_index()
         
-        for i, doc in enumerate(self.documents):
-            score = 0
-            doc_words = doc.split()
-            doc_counts = Counter(doc_words)
-            
-            for q in q_words:
-                if q not in doc_counts:
-                    continue
-                
-                f = doc_counts[q]
-                idf = self.idf.get(q, 0)
-                
-                num = f * (self.k1 + 1)
-                den = f + self.k1 * (1 - self.b + self.b * (self.doc_len[i] / self.avg_len))
-                
-                score += idf * (num / den)
-            scores[i] = score
+        scores = np.zeros(len(self.doc_len))
+        norm = self.length_norm()
+        
+        terms = [(q, 1.0) for q in query.split()]
+        if expansions:
+            terms.extend(expansions.items())
+        for q, weight in terms:
+            if q not in self.postings:
+                continue
+            ids, f = self.postings[q]
+            idf = self.idf.get(q, 0)
+            scores[ids] += weight * idf * (f * (self.k1 + 1) / (f + norm[ids]))
         return scores
 
+    def digest(self):
+        # hash of the postings, lets derived indexes check they were built from this one
+        if getattr(self, '_digest', None) is None:
+            if not getattr(self, 'postings', None):
+                self.build_index()
+            h = hashlib.sha256()
+            for word in sorted(self.postings):
+                ids, f = self.postings[word]
+                h.update(word.encode('utf-8'))
+                h.update(ids.tobytes())
+                h.update(f.tobytes())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def use_impact(self, index, max_postings=None):
+        # route bm25_top_k through an impact ordered index (see impact_index.py);
+        # max_postings caps the postings a query may touch
+        self.impact = index
+        self.max_postings = max_postings
+
+    def __getstate__(self):
+        # cached norms are cheap to rebuild, and once postings exist the
+        # texts are not needed for scoring (display text comes from docstore.py)
+        state = self.__dict__.copy()
+        state.pop('_norm', None)
+        state.pop('_digest', None)
+        state.pop('impact', None)
+        if state.get('postings'):
+            state.pop('documents', None)
+        return state
+
 def load_corpus(filename):
     # Load text documents
     with open(filename, 'r', encoding='utf-8') as f:
@@ -62,64 +148,150 @@ def load_corpus(filename):
     documents = [item['text'] for item in data]
     return documents
 
-def search(query, bm25, documents, top_k=5):
+def top_k_indices(scores, k):
+    # best k positions, highest score first, without sorting everything
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < scores.shape[-1]:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind='stable')
+    return np.take_along_axis(part, order, axis=-1)
+
+def bm25_top_k(bm25, processed_query, k, expansions=None):
+    # precomputed impacts only hold for the k1, b they were built with
+    impact = getattr(bm25, 'impact', None)
+    if impact is not None and not expansions and impact.matches(bm25):
+        with stage('impact_top_k'):
+            return impact.top_k(processed_query, k, bm25.max_postings)
+
+    scores = bm25.score(processed_query, expansions)
+    with stage('topk'):
+        top_indices = top_k_indices(scores, k)
+    top_indices = top_indices[scores[top_indices] > 0]
+    return top_indices, scores[top_indices]
+
+def fuse_rrf(ranked_lists, k=RRF_K):
+    # reciprocal rank fusion: sum of 1 / (k + rank) over the lists
+    fused = {}
+    for ids, _ in ranked_lists:
+        for rank, doc_id in enumerate(ids):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + 1.0 / (k + rank + 1)
+    return fused
+
+def fuse_weighted(ranked_lists, weights):
+    # min-max normalise each list's scores, then blend them
+    fused = {}
+    for (ids, scores), w in zip(ranked_lists, weights):
+        if not len(ids):
+            continue
+        lo, hi = float(np.min(scores)), float(np.max(scores))
+        norm = (np.asarray(scores) - lo) / (hi - lo) if hi > lo else np.ones(len(ids))
+        for doc_id, s in zip(ids, norm):
+            fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + w * float(s)
+    return fused
+
+def hybrid_top_k(bm25, vectors, processed_query, k, fusion='rrf', alpha=0.5, candidates=HYBRID_CANDIDATES,
+                 expansions=None):
+    # both retrievers run at the same time; numpy releases the gil for the heavy parts
+    n = max(candidates, k)
+    with stage('hybrid_candidates'):
+        lexical = _executor().submit(bm25_top_k, bm25, processed_query, n, expansions)
+        dense = _executor().submit(vectors.top_k, processed_query, n)
+        ranked_lists = [lexical.result(), dense.result()]
+    
+    with stage('fusion'):
+        if fusion == 'weighted':
+            fused = fuse_weighted(ranked_lists, [alpha, 1 - alpha])
+        else:
+            fused = fuse_rrf(ranked_lists)
+        ids = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+        scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+        top = top_k_indices(scores, k)
+    return ids[top], scores[top]
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='retrieval')
+    return _pool
+
+def search(query, bm25, documents, top_k=5, mode='bm25', vectors=None, fusion='rrf', reranker=None, speller=None,
+           passages=None, aggregate='max'):
     # Clean and prepare query
     cleaned = clean_malayalam_text(query)
     tokens = tokenize_malayalam(cleaned)
     processed_query = ' '.join(tokens)
 
-    # Calculate document scores
-    scores = bm25.score(processed_query)
-    
-    # Get top results
-    top_indices = np.argsort(scores)[::-1][:top_k]
+    # terms missing from the index are swapped for close known ones (see fuzzy.py)
+    expansions = None
+    if speller is not None and mode != 'vector':
+        with stage('fuzzy'):
+            expansions = speller.expand(tokens, bm25.postings)
+
+    # a reranker needs a bigger first stage candidate set
+    fetch = max(top_k, reranker.candidates) if reranker is not None else top_k
+
+    # Calculate document scores and get top results
+    best = {}
+    if mode == 'vector':
+        top_indices, top_scores = vectors.top_k(processed_query, fetch)
+    elif mode == 'hybrid':
+        top_indices, top_scores = hybrid_top_k(bm25, vectors, processed_query, fetch, fusion, expansions=expansions)
+    elif passages is not None:
+        # documents ranked by their passages (see passages.py), aggregate 'max' or 'sum'
+        with stage('passage_top_k'):
+            top_indices, top_scores, winners = passages.top_k(processed_query, fetch, aggregate, expansions)
+        best = dict(zip(top_indices.tolist(), winners.tolist()))
+    else:
+        top_indices, top_scores = bm25_top_k(bm25, processed_query, fetch, expansions)
+
+    reranked = False
+    if reranker is not None and len(top_indices):
+        # model reads the raw query, first stage order is the fallback
+        with stage('rerank'):
+            top_indices, top_scores, reranked = reranker.rerank(query, top_indices, top_scores)
+    top_indices, top_scores = top_indices[:top_k], top_scores[:top_k]
+
+    # snippets come from the best passage, never from the whole document
+    if passages is not None:
+        missing = [int(i) for i in top_indices if int(i) not in best and int(i) < passages.num_docs]
+        if missing:
+            with stage('passage_snippets'):
+                best.update(zip(missing, passages.best_passages(processed_query, missing, expansions)))
     
     results = []
-    for idx in top_indices:
-        if scores[idx] > 0:
-            results.append({
-                'doc_id': int(idx),
-                'score': float(scores[idx]),
-                'text': documents[idx][:200]
-            })
+    for idx, score in zip(top_indices, top_scores):
+        # cross-encoder scores are logits and can be negative
+        if score > 0 or reranked:
+            results.append(make_result(documents, idx, score, passages, best.get(int(idx), -1)))
     
     return results
 
-def calculate_map(queries, relevance_judgments, bm25, documents):
-    # Calculate MAP score
-    average_precisions = []
-    
-    for query in queries:
-        # Get search results
-        results = search(query, bm25, documents, top_k=10)
-        result_ids = [r['doc_id'] for r in results]
-        
-        # Get relevant documents
-        relevant_docs = relevance_judgments.get(query, [])
-        
-        if not relevant_docs:
-            continue
-        
-        # calc avg precision
-        num_relevant = 0
-        precision_sum = 0.0
-        
-        for i, doc_id in enumerate(result_ids):
-            if doc_id in relevant_docs:
-                num_relevant += 1
-                precision_at_k = num_relevant / (i + 1)
-                precision_sum += precision_at_k
-        
-        if num_relevant > 0:
-            avg_precision = precision_sum / len(relevant_docs)
-            average_precisions.append(avg_precision)
-    
-    # return map
-    if average_precisions:
-        map_score = sum(average_precisions) / len(average_precisions)
-        return map_score
+def make_result(documents, doc_id, score, passages=None, passage=-1):
+    result = {
+        'doc_id': int(doc_id),
+        'score': float(score),
+    }
+    if passage >= 0:
+        result['snippet'] = passages.snippet(documents, int(doc_id), passage)
+        result['text'] = result['snippet'][:200]
     else:
+        result['text'] = documents[doc_id][:200]
+    return result
+
+def calculate_map(queries, relevance_judgments, bm25, documents):
+    # Calculate MAP score over queries that have judgments
+    queries = [q for q in queries if relevance_judgments.get(q)]
+    if not queries:
         return 0.0
+    
+    run = {q: [r['doc_id'] for r in search(q, bm25, documents, top_k=10)] for q in queries}
+    qrels = Qrels({q: relevance_judgments[q] for q in queries})
+    table = per_query_table(run, qrels, queries, k=10)
+    return float(table['AP'].mean())
 
 def main():
     # load corpus
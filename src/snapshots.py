@@ -0,0 +1,292 @@
+# Versioned snapshots of the built indexes and models
+# publish copies the current artifacts into models/snapshots/<version>/ under a
+# temporary name and renames the finished directory into place. only then is
+# CURRENT.json rewritten (temp file + os.replace), so a reader sees either the old
+# version or the complete new one, never a half written index.
+# long running processes poll the manifest with a SnapshotWatcher, load a new
+# version in the background and swap it in with a single assignment; requests
+# that already hold the old resources finish on them, and the old version is
+# freed once the last of them lets go. artifacts with the same digest in both
+# versions are handed to the loader as unchanged, so it can keep those objects
+#
+#   python src/snapshots.py publish           snapshot the current build
+#   python src/snapshots.py list              versions on disk, * marks the live one
+#   python src/snapshots.py rollback VERSION  point the manifest back at VERSION
+
+import os
+import gc
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+
+SNAPSHOT_ROOT = 'models/snapshots'
+MANIFEST = 'CURRENT.json'
+KEEP = 3  # versions left on disk after a publish
+POLL_SECONDS = 5.0
+
+# everything a search process loads; a snapshot holds each under its base name
+ARTIFACTS = [
+    'models/bm25_index.pkl',
+    'models/impact_index.npz',
+    'models/substring_index.npz',
+    'models/passage_index.pkl',
+    'models/autocomplete.npz',
+    'models/vectorizer_ir.pkl',
+    'models/doc_vectors.pkl',
+    'models/ann_index',
+    'models/classifier.pkl',
+    'models/vectorizer.pkl',
+    'models/bert_classifier',
+    'models/bert_reranker',
+    'data/docstore',
+]
+
+def artifact_paths(snapshot_dir=None):
+    # {name: path}, inside a snapshot or where the build scripts write them
+    if snapshot_dir is None:
+        return {os.path.basename(p): p for p in ARTIFACTS}
+    return {os.path.basename(p): os.path.join(snapshot_dir, os.path.basename(p)) for p in ARTIFACTS}
+
+def copy_hashed(src, dst, digest):
+    # copy a file or a whole directory, feeding names and bytes into digest
+    if os.path.isdir(src):
+        os.makedirs(dst)
+        for name in sorted(os.listdir(src)):
+            digest.update(name.encode('utf-8'))
+            copy_hashed(os.path.join(src, name), os.path.join(dst, name), digest)
+        return
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            chunk = fin.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+            fout.write(chunk)
+    shutil.copystat(src, dst)
+
+def hash_tree(src, digest):
+    # the digest copy_hashed would produce, without writing anything
+    if os.path.isdir(src):
+        for name in sorted(os.listdir(src)):
+            digest.update(name.encode('utf-8'))
+            hash_tree(os.path.join(src, name), digest)
+        return
+    with open(src, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+
+def stat_tree(src):
+    # names, sizes and mtimes of a file or directory; equal to the manifest's entry
+    # means the artifact was not written since it was hashed
+    digest = hashlib.sha256()
+    files = [src]
+    if os.path.isdir(src):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(src) for name in names)
+    for f in files:
+        st = os.stat(f)
+        digest.update(f"{os.path.relpath(f, src)}:{st.st_size}:{st.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def link_tree(src, dst):
+    # published snapshots are never written again, so a new one can share their files
+    if os.path.isdir(src):
+        os.makedirs(dst)
+        for name in os.listdir(src):
+            link_tree(os.path.join(src, name), os.path.join(dst, name))
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def read_manifest(root=SNAPSHOT_ROOT):
+    try:
+        with open(os.path.join(root, MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(root, manifest):
+    # readers open CURRENT.json by name, os.replace swaps it in one step
+    tmp = os.path.join(root, MANIFEST + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, MANIFEST))
+
+def list_versions(root=SNAPSHOT_ROOT):
+    # oldest first, version names start with their creation time
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if not name.startswith('.') and os.path.isdir(os.path.join(root, name)))
+
+def publish(root=SNAPSHOT_ROOT, artifacts=ARTIFACTS, keep=KEEP):
+    present = [p for p in artifacts if os.path.exists(p)]
+    if not present:
+        print("nothing to publish, build the indexes first")
+        return None
+    os.makedirs(root, exist_ok=True)
+
+    # copy under a temporary name, nothing points at it until it is complete
+    tmp = os.path.join(root, f".tmp-{os.getpid()}-{time.time_ns()}")
+    total = hashlib.sha256()
+    files = {}
+    stats = {}
+    try:
+        os.makedirs(tmp)
+        current = read_manifest(root)
+        live = current.get('files', {}) if current else {}
+        live_stats = current.get('stats', {}) if current else {}
+        for src in present:
+            name = os.path.basename(src)
+            previous = os.path.join(root, current['version'], name) if current else None
+            stats[name] = stat_tree(src)
+            if name in live and live_stats.get(name) == stats[name] and os.path.exists(previous):
+                # not written since the live version hashed it: no need to read
+                # the bert weights again on every ingest publish
+                files[name] = live[name]
+                link_tree(previous, os.path.join(tmp, name))
+            else:
+                digest = hashlib.sha256()
+                hash_tree(src, digest)
+                if live.get(name) == digest.hexdigest() and os.path.exists(previous):
+                    # rewritten with the same bytes
+                    link_tree(previous, os.path.join(tmp, name))
+                else:
+                    digest = hashlib.sha256()
+                    copy_hashed(src, os.path.join(tmp, name), digest)
+                files[name] = digest.hexdigest()
+            total.update(f"{name}:{files[name]}".encode('utf-8'))
+        digest = total.hexdigest()
+
+        if current and current.get('digest') == digest:
+            print(f"version {current['version']} already holds this build")
+            shutil.rmtree(tmp)
+            if current.get('stats') != stats:
+                # same bytes, new mtimes: remember them so the next publish skips the hashing
+                current['stats'] = stats
+                write_manifest(root, current)
+            return current['version']
+
+        # milliseconds too, streaming ingestion publishes several times a second
+        now = time.time()
+        version = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f"{int(now * 1000) % 1000:03d}-{digest[:8]}"
+        os.rename(tmp, os.path.join(root, version))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    write_manifest(root, {'version': version, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                          'digest': digest, 'files': files, 'stats': stats})
+    print(f"published {version} ({len(files)} artifacts)")
+    prune(root, keep)
+    return version
+
+def prune(root=SNAPSHOT_ROOT, keep=KEEP):
+    # processes still on an old version keep their open files (mmap) alive on
+    # posix; on windows the delete fails and is retried after the next publish
+    current = (read_manifest(root) or {}).get('version')
+    old = [v for v in list_versions(root) if v != current]
+    for version in old[:max(0, len(old) - (keep - 1))]:
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+def rollback(version, root=SNAPSHOT_ROOT):
+    if version not in list_versions(root):
+        raise ValueError(f"no snapshot {version} in {root}")
+    manifest = read_manifest(root) or {}
+    write_manifest(root, {'version': version, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                          'digest': None, 'files': {}, 'rollback_from': manifest.get('version')})
+    print(f"live version is now {version}")
+
+class SnapshotWatcher:
+    def __init__(self, load, root=SNAPSHOT_ROOT, interval=POLL_SECONDS):
+        # load(paths, previous, unchanged) builds the resources of one version from
+        # artifact_paths(); previous are the resources being replaced and unchanged
+        # the artifact names whose digest is the same in both versions, so a reload
+        # can keep what did not change. without a published snapshot the plain
+        # build outputs are served
+        self.load = load
+        self.root = root
+        self.interval = interval
+        self.failed = None
+        manifest = read_manifest(root)
+        version = manifest['version'] if manifest else None
+        self.files = manifest.get('files', {}) if manifest else {}
+        self.current = (version, load(self.paths(version), None, set()))
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='snapshot-watcher', daemon=True)
+        self.thread.start()
+
+    def paths(self, version):
+        return artifact_paths(os.path.join(self.root, version) if version else None)
+
+    def get(self):
+        # (version, resources); a request should take this once and use it throughout
+        return self.current
+
+    def check(self):
+        manifest = read_manifest(self.root)
+        version = manifest['version'] if manifest else None
+        if version is None or version == self.current[0] or version == self.failed:
+            return False
+        files = manifest.get('files', {})
+        # a rollback's manifest lists no digests, then nothing counts as unchanged
+        unchanged = set()
+        if self.files and files:
+            unchanged = {name for name in artifact_paths() if self.files.get(name) == files.get(name)}
+        print(f"loading snapshot {version} ({len(unchanged)} artifacts unchanged)...")
+        start = time.perf_counter()
+        try:
+            resources = self.load(self.paths(version), self.current[1], unchanged)
+        except Exception as e:
+            # keep serving the old version, try again when the manifest moves on
+            print(f"snapshot {version} failed to load: {e}")
+            self.failed = version
+            return False
+        old = self.current
+        self.current = (version, resources)
+        self.files = files
+        print(f"now serving {version} (loaded in {time.perf_counter() - start:.1f}s, was {old[0]})")
+        # in-flight requests may still hold the old resources, this only drops our reference
+        del old, resources
+        gc.collect()
+        return True
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="publish and manage index snapshots")
+    parser.add_argument('command', nargs='?', default='publish', choices=['publish', 'list', 'rollback'])
+    parser.add_argument('version', nargs='?')
+    parser.add_argument('--root', default=SNAPSHOT_ROOT)
+    parser.add_argument('--keep', type=int, default=KEEP)
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        publish(args.root, keep=args.keep)
+    elif args.command == 'list':
+        current = (read_manifest(args.root) or {}).get('version')
+        for version in list_versions(args.root):
+            print(f"{'*' if version == current else ' '} {version}")
+    else:
+        if not args.version:
+            parser.error("rollback needs a version, see 'list'")
+        rollback(args.version, args.root)
+
+if __name__ == '__main__':
+    main()
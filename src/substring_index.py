@@ -0,0 +1,197 @@
+# Character n-gram index for substring search inside words
+# malayalam glues suffixes and other words onto a root, so a root the stemmer does
+# not strip never shows up as an index term. every character trigram of each
+# document points to the documents containing it; a query word is looked up by
+# intersecting the postings of its own trigrams, and only those candidates get
+# their text checked for the real substring
+
+import os
+import re
+import json
+import time
+import pickle
+import argparse
+import numpy as np
+from bisect import bisect_left
+from collections import defaultdict
+from preprocess import clean_malayalam_text
+from retrieval import BM25  # needed to unpickle the index
+from instrument import stage
+
+N = 3
+
+def normalize(text):
+    # same cleaning as the index terms; trailing pad so short words at the end still
+    # start an n-gram
+    return clean_malayalam_text(text) + ' ' * (N - 1)
+
+def ngrams(text):
+    return {text[i:i + N] for i in range(len(text) - N + 1)}
+
+class SubstringIndex:
+    def __init__(self, grams, offsets, doc_ids, num_docs, digest=None):
+        # grams sorted; gram i is in docs doc_ids[offsets[i]:offsets[i + 1]], sorted
+        self.grams = grams
+        self.gram_index = {g: i for i, g in enumerate(grams)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.num_docs = num_docs
+        # digest of the bm25 index built from the same corpus, see matches
+        self.digest = digest
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, texts, digest=None):
+        postings = defaultdict(list)
+        num_docs = 0
+        for doc_id, text in enumerate(texts):
+            for g in ngrams(normalize(text)):
+                postings[g].append(doc_id)
+            num_docs += 1
+        grams = sorted(postings)
+        offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[g]) for g in grams])
+        doc_ids = np.array([d for g in grams for d in postings[g]], dtype=np.int32)
+        return cls(grams, offsets, doc_ids, num_docs, digest)
+
+    def matches(self, bm25):
+        # built for the same corpus as the bm25 index (and the document store); the
+        # count alone misses a corpus rebuilt or deduped to the same size
+        return (self.digest is not None and self.num_docs == len(bm25.doc_len)
+                and self.digest == bm25.digest())
+
+    def postings(self, i):
+        return self.doc_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def candidates(self, word):
+        # docs that contain every n-gram of word, a superset of the docs containing word
+        if len(word) < N:
+            # too short for a whole n-gram: every n-gram starting with it
+            lo = bisect_left(self.grams, word)
+            hi = bisect_left(self.grams, word + '\uffff')
+            if lo == hi:
+                return np.zeros(0, dtype=np.int32)
+            return np.unique(self.doc_ids[self.offsets[lo]:self.offsets[hi]])
+
+        ids = [self.gram_index.get(g) for g in ngrams(word)]
+        if any(i is None for i in ids):
+            return np.zeros(0, dtype=np.int32)
+        # shortest list first, then each step costs the current candidates times a
+        # binary search, never a walk over a long list
+        ids.sort(key=lambda i: self.offsets[i + 1] - self.offsets[i])
+        cand = self.postings(ids[0])
+        for i in ids[1:]:
+            if not len(cand):
+                break
+            post = self.postings(i)
+            pos = np.minimum(np.searchsorted(post, cand), len(post) - 1)
+            cand = cand[post[pos] == cand]
+        return cand
+
+    def search(self, query, documents, top_k=10):
+        # docs containing every query word as a substring, most occurrences first
+        words = clean_malayalam_text(query).split()
+        if not words:
+            return []
+        with stage('substring_candidates'):
+            cand = None
+            # longest (usually rarest) word first, the candidates only shrink from there
+            for w in sorted(set(words), key=len, reverse=True):
+                found = self.candidates(w)
+                cand = found if cand is None else np.intersect1d(cand, found, assume_unique=True)
+                if not len(cand):
+                    return []
+
+        # n-grams can all occur without being next to each other, check the text
+        with stage('substring_verify'):
+            matches = []
+            for doc_id in cand:
+                # words have no spaces and cleaning never joins malayalam letters
+                # that were apart, so a hit in the raw text is a hit; only misses
+                # need the cleaned text (removed digits or latin can join pieces)
+                text = documents[doc_id]
+                counts = [text.count(w) for w in words]
+                if not all(counts):
+                    text = normalize(text)
+                    counts = [text.count(w) for w in words]
+                if all(counts):
+                    matches.append((sum(counts), int(doc_id)))
+        matches.sort(key=lambda m: (-m[0], m[1]))
+        return [{'doc_id': doc_id, 'score': float(count), 'text': documents[doc_id][:200]}
+                for count, doc_id in matches[:top_k]]
+
+    def save(self, filename):
+        np.savez(filename, grams=np.frombuffer('\n'.join(self.grams).encode('utf-8'), dtype=np.uint8),
+                 offsets=self.offsets, doc_ids=self.doc_ids, meta=np.array([self.num_docs, N]),
+                 digest=np.frombuffer((self.digest or '').encode('ascii'), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            blob = f['grams'].tobytes().decode('utf-8')
+            num_docs, n = f['meta']
+            if n != N:
+                raise ValueError(f"{filename} holds {n}-grams, rebuild it for N={N}")
+            # indexes from before the digest never match, rebuild them
+            digest = f['digest'].tobytes().decode('ascii') if 'digest' in f.files else None
+            return cls(blob.split('\n') if blob else [], f['offsets'], f['doc_ids'], int(num_docs), digest or None)
+
+def scan_search(query, documents):
+    # what the index replaces: a regex over every document
+    words = clean_malayalam_text(query).split()
+    patterns = [re.compile(re.escape(w)) for w in words]
+    return [i for i, text in enumerate(documents)
+            if words and all(p.search(clean_malayalam_text(text)) for p in patterns)]
+
+def main():
+    from docstore import load_documents
+
+    parser = argparse.ArgumentParser(description="build the character n-gram substring index")
+    parser.add_argument('--corpus', default='data/processed_corpus.json')
+    parser.add_argument('--index', default='models/bm25_index.pkl')
+    parser.add_argument('--output', default='models/substring_index.npz')
+    args = parser.parse_args()
+
+    print("loading corpus...")
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    texts = [item.get('original_text', item['text']) for item in data]
+
+    # the app only serves the index next to the bm25 index it was built with
+    digest = None
+    if os.path.exists(args.index):
+        with open(args.index, 'rb') as f:
+            bm25 = pickle.load(f)
+        if len(bm25.doc_len) == len(texts):
+            digest = bm25.digest()
+        else:
+            print(f"{args.index} has {len(bm25.doc_len)} docs, not {len(texts)}; the app will not use this index")
+    else:
+        print(f"no {args.index}, build it first or the app will not use this index")
+
+    print("building n-gram index...")
+    t = time.perf_counter()
+    index = SubstringIndex.build(texts, digest)
+    index.save(args.output)
+    size = os.path.getsize(args.output)
+    print(f"{len(index.grams)} {N}-grams, {len(index)} postings, {size / 1024:.0f} KB "
+          f"in {time.perf_counter() - t:.1f}s -> {args.output}")
+
+    # word middles the stemmer never isolates, against a full scan
+    documents = load_documents(corpus_file=args.corpus, num_docs=index.num_docs)
+    words = sorted({w for text in texts[:200] for w in clean_malayalam_text(text).split() if len(w) >= 8})
+    queries = [w[2:6] for w in words[::max(1, len(words) // 50)]]
+    t = time.perf_counter()
+    found = [{r['doc_id'] for r in index.search(q, documents, top_k=len(texts))} for q in queries]
+    index_ms = (time.perf_counter() - t) * 1000 / max(1, len(queries))
+    t = time.perf_counter()
+    scanned = [set(scan_search(q, texts)) for q in queries]
+    scan_ms = (time.perf_counter() - t) * 1000 / max(1, len(queries))
+    agree = sum(f == s for f, s in zip(found, scanned))
+    print(f"{len(queries)} substring queries: index {index_ms:.2f} ms, scan {scan_ms:.2f} ms, "
+          f"same documents for {agree}/{len(queries)}")
+
+if __name__ == '__main__':
+    main()
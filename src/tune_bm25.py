@@ -0,0 +1,112 @@
+# Tune BM25 parameters against the relevance judgments
+# term statistics are built once per tokenization variant,
+# every (k1, b) setting after that is just a scoring pass
+
+import os
+import json
+import time
+import argparse
+import itertools
+import numpy as np
+from multiprocessing import Pool
+from preprocess import clean_malayalam_text, tokenize_malayalam
+from retrieval import BM25
+from metrics import Qrels, per_query_table, summarize, format_table
+from evaluate import TEST_QUERIES
+
+K1_VALUES = [0.6, 0.9, 1.2, 1.5, 1.8, 2.1]
+B_VALUES = [0.3, 0.45, 0.6, 0.75, 0.9, 1.0]
+
+# (name, stem, remove_stopwords)
+VARIANTS = [
+    ('stem+stop', True, True),
+    ('stem', True, False),
+    ('stop', False, True),
+    ('raw', False, False),
+]
+
+# filled in each worker by init_worker
+_indexes = None
+_qrels = None
+
+def build_variant_indexes(original_texts, variants):
+    indexes = {}
+    for name, stem, stop in variants:
+        print(f"building term statistics for '{name}'...")
+        docs = [' '.join(tokenize_malayalam(t, stem=stem, remove_stopwords=stop)) for t in original_texts]
+        indexes[name] = BM25(docs)
+    return indexes
+
+def init_worker(indexes, qrels):
+    global _indexes, _qrels
+    _indexes = indexes
+    _qrels = qrels
+
+def evaluate_config(config, k=10, depth=100):
+    name, stem, stop, k1, b = config
+    bm25 = _indexes[name]
+    bm25.k1 = k1
+    bm25.b = b
+
+    queries = [qid for qid, _ in TEST_QUERIES if qid in _qrels.query_index]
+    run = np.full((len(queries), depth), -1, dtype=np.int64)
+    query_text = dict(TEST_QUERIES)
+
+    for i, qid in enumerate(queries):
+        tokens = tokenize_malayalam(clean_malayalam_text(query_text[qid]), stem=stem, remove_stopwords=stop)
+        scores = bm25.score(' '.join(tokens))
+        top = np.argsort(-scores, kind='stable')[:depth]
+        top = top[scores[top] > 0]
+        run[i, :len(top)] = top
+
+    row = summarize(per_query_table(run, _qrels, queries, k))
+    row.update({'variant': name, 'k1': k1, 'b': b})
+    return row
+
+def tune(corpus_file, judgments_file, workers=None, k=10):
+    with open(corpus_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    original_texts = [item.get('original_text', item['text']) for item in data]
+
+    with open(judgments_file, 'r', encoding='utf-8') as f:
+        qrels = Qrels(json.load(f))
+
+    indexes = build_variant_indexes(original_texts, VARIANTS)
+
+    configs = [(name, stem, stop, k1, b)
+               for (name, stem, stop), k1, b in itertools.product(VARIANTS, K1_VALUES, B_VALUES)]
+    print(f"evaluating {len(configs)} configurations...")
+
+    start = time.time()
+    with Pool(workers, initializer=init_worker, initargs=(indexes, qrels)) as pool:
+        rows = pool.map(evaluate_config, configs, chunksize=max(1, len(configs) // 32))
+    print(f"sweep took {time.time() - start:.2f}s")
+
+    rows.sort(key=lambda r: (r['AP'], r[f'NDCG@{k}']), reverse=True)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="grid search over bm25 settings")
+    parser.add_argument('--corpus', default='data/processed_corpus.json')
+    parser.add_argument('--judgments', default='data/relevance_judgments.json')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='results/bm25_tuning.json')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    rows = tune(args.corpus, args.judgments, args.workers)
+
+    table = {f"{r['variant']} k1={r['k1']} b={r['b']}": {c: v for c, v in r.items() if c not in ('variant', 'k1', 'b')}
+             for r in rows[:args.top]}
+    print(format_table(table, first_col='config'))
+
+    best = rows[0]
+    print(f"\nbest: variant={best['variant']} k1={best['k1']} b={best['b']} MAP={best['AP']:.4f}")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'best': best, 'results': rows}, f, ensure_ascii=False, indent=2)
+    print(f"results saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
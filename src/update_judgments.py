@@ -1,52 +1,111 @@
+import os
 import json
-import re
+import hashlib
+import argparse
+from keywords import documents_by_label
 
-def update_judgments():
+# Define queries and keywords
+QUERIES = {
+    "vaarttha": ["വാർത്ത"],
+    "kaayikam": ["കായികം", "സ്പോർട്സ്", "ക്രിക്കറ്റ്", "ഫുട്ബോൾ"], # Sports related terms
+    "rashtreeyam": ["രാഷ്ട്രീയം", "രാഷ്ട്രീയ"],
+    "cinema": ["സിനിമ", "ചലച്ചിത്രം"],
+    "technology": ["സാങ്കേതികവിദ്യ", "ടെക്നോളജി"]
+}
+
+def load_documents(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def judge(texts, queries, offset=0):
+    # a doc is relevant if it contains any keyword as a whole word;
+    # one automaton for all queries, one pass per document
+    return documents_by_label(queries, texts, offset, whole_words=True)
+
+def texts_digest(texts):
+    # judgments hold positions, so reuse needs the very same texts in the same order
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def load_json(filename):
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def update_judgments(corpus_files=('data/processed_corpus.json',), queries=None,
+                     output='data/relevance_judgments.json', state_file=None, full=False):
     print("Updating relevance judgments based on new corpus...")
-    
-    with open('data/processed_corpus.json', 'r', encoding='utf-8') as f:
-        documents = json.load(f)
-    
-    # Define queries and keywords
-    queries = {
-        "vaarttha": ["വാർത്ത"],
-        "kaayikam": ["കായികം", "സ്പോർട്സ്", "ക്രിക്കറ്റ്", "ഫുട്ബോൾ"], # Sports related terms
-        "rashtreeyam": ["രാഷ്ട്രീയം", "രാഷ്ട്രീയ"],
-        "cinema": ["സിനിമ", "ചലച്ചിത്രം"],
-        "technology": ["സാങ്കേതികവിദ്യ", "ടെക്നോളജി"]
-    }
-    
+    queries = queries or QUERIES
+    state_file = state_file or output.replace('.json', '.state.json')
+
+    # corpora are treated as consecutive shards, doc ids run across all of them
+    texts = []
+    counts = []
+    for filename in corpus_files:
+        docs = load_documents(filename)
+        texts.extend(doc['original_text'] for doc in docs)
+        counts.append(len(docs))
+
+    state = None if full else load_json(state_file)
+    existing = load_json(output) if state else None
+
+    # only new docs at the end of the last shard can be judged incrementally, and
+    # only when the docs judged last time are still the same ones: a recrawl or
+    # dedupe can move texts around without changing the counts
+    start = 0
+    if state and existing and state.get('files') == list(corpus_files):
+        old = state['counts']
+        if old[:-1] == counts[:-1] and old[-1] <= counts[-1] and \
+                state.get('digest') == texts_digest(texts[:sum(old)]):
+            start = sum(old)
+        else:
+            print("corpus changed under the saved judgments, judging everything again")
+
+    # queries that are new or whose keywords changed need the whole corpus
+    old_queries = state.get('queries', {}) if start else {}
+    changed = {q: kws for q, kws in queries.items() if old_queries.get(q) != kws or q not in existing}
+    unchanged = {q: kws for q, kws in queries.items() if q not in changed}
+
     new_judgments = {}
-    
-    for q_key, keywords in queries.items():
-        relevant_ids = []
-        for i, doc in enumerate(documents):
-            # Check for keywords
-            # Use original text
-            text = doc['original_text']
-            
-            # Check if keyword exists
-            # Split text into words
-            words = set(text.split())
-            
-            is_relevant = False
-            for kw in keywords:
-                # Check for exact match
-                if kw in words:
-                    is_relevant = True
-                    break
-            
-            if is_relevant:
-                relevant_ids.append(i)
-        
+    if unchanged:
+        print(f"matching {len(texts) - start} new docs...")
+        added = judge(texts[start:], unchanged, offset=start)
+        for q_key in unchanged:
+            new_judgments[q_key] = existing[q_key] + added[q_key]
+    if changed:
+        print(f"matching all {len(texts)} docs for {len(changed)} new or changed queries...")
+        new_judgments.update(judge(texts, changed))
+
+    # keep the query order stable
+    new_judgments = {q: new_judgments[q] for q in queries}
+    for q_key, relevant_ids in new_judgments.items():
         print(f"Query '{q_key}': found {len(relevant_ids)} relevant docs")
-        new_judgments[q_key] = relevant_ids
 
     # Save new judgments
-    with open('data/relevance_judgments.json', 'w', encoding='utf-8') as f:
+    with open(output, 'w', encoding='utf-8') as f:
         json.dump(new_judgments, f, ensure_ascii=False, indent=2)
-    
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump({'files': list(corpus_files), 'counts': counts, 'digest': texts_digest(texts),
+                   'queries': queries}, f, ensure_ascii=False, indent=2)
+
     print("Saved new relevance judgments.")
+    return new_judgments
 
 if __name__ == '__main__':
-    update_judgments()
+    parser = argparse.ArgumentParser(description="generate keyword based relevance judgments")
+    parser.add_argument('--corpus', nargs='+', default=['data/processed_corpus.json'])
+    parser.add_argument('--queries', default=None, help="json file of {query_id: [keywords]}")
+    parser.add_argument('--output', default='data/relevance_judgments.json')
+    parser.add_argument('--full', action='store_true', help="ignore saved state and rejudge everything")
+    args = parser.parse_args()
+
+    queries = None
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = json.load(f)
+
+    update_judgments(args.corpus, queries, args.output, full=args.full)
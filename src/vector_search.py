@@ -0,0 +1,177 @@
+# Vector retrieval over the tf-idf document vectors
+# models/vectorizer_ir.pkl + models/doc_vectors.pkl
+
+import os
+import pickle
+import hashlib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from instrument import timed
+from retrieval import load_corpus, search, top_k_indices
+
+class VectorIndex:
+    def __init__(self, vectorizer, doc_vectors, quantize=False):
+        self.vectorizer = vectorizer
+        if hasattr(doc_vectors, 'toarray'):
+            doc_vectors = doc_vectors.toarray()
+        mat = np.ascontiguousarray(doc_vectors, dtype=np.float32)
+
+        # unit rows so a dot product is the cosine; a new array, mat can be the
+        # caller's own float32 matrix
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        mat = mat / np.where(norms > 0, norms, 1)
+
+        self.quantized = quantize
+        if quantize:
+            # int8 with one scale per row, 4x smaller than float32
+            scale = np.abs(mat).max(axis=1) / 127
+            scale[scale == 0] = 1
+            self.codes = np.round(mat / scale[:, None]).astype(np.int8)
+            self.scales = scale.astype(np.float32)
+            self.matrix = None
+        else:
+            self.matrix = mat
+        self.ann = None
+        self.digest = None  # vectors_digest() of the stored vectors, set by load_vector_index
+
+    def __len__(self):
+        return len(self.scales) if self.quantized else len(self.matrix)
+
+    def encode(self, texts):
+        vecs = self.vectorizer.transform(texts).toarray().astype(np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        return vecs / np.where(norms > 0, norms, 1)
+
+    def doc_block(self, start, end):
+        if self.quantized:
+            return self.codes[start:end].astype(np.float32) * self.scales[start:end, None]
+        return self.matrix[start:end]
+
+    def similarities(self, query_vecs, block=65536):
+        # (num queries x num docs) cosine, docs processed in blocks
+        out = np.empty((len(query_vecs), len(self)), dtype=np.float32)
+        for start in range(0, len(self), block):
+            end = min(start + block, len(self))
+            out[:, start:end] = query_vecs @ self.doc_block(start, end).T
+        return out
+
+    @timed('vector_score')
+    def score(self, query):
+        # same shape as BM25.score so search() can use either
+        return self.similarities(self.encode([query]))[0]
+
+    def rows(self, ids):
+        if self.quantized:
+            return self.codes[ids].astype(np.float32) * self.scales[ids, None]
+        return self.matrix[ids]
+
+    def use_ann(self, ann, nprobe=None, refine=4):
+        # route top_k through an approximate index (see ann_index.py);
+        # the best k * refine candidates are re-scored exactly
+        self.ann = ann
+        self.refine = refine
+        if nprobe:
+            ann.nprobe = nprobe
+
+    def ann_top_k(self, qvecs, k, nprobe=None, refine=None):
+        refine = refine or getattr(self, 'refine', 1)
+        ids, scores = self.ann.search(qvecs, k * refine, nprobe)
+        out_ids = np.full((len(qvecs), k), -1, dtype=np.int64)
+        out_scores = np.full((len(qvecs), k), -np.inf, dtype=np.float32)
+        for i, q in enumerate(qvecs):
+            cand = ids[i][ids[i] >= 0]
+            exact = self.rows(cand) @ q if refine > 1 else scores[i][:len(cand)]
+            top = top_k_indices(exact, k)
+            out_ids[i, :len(top)] = cand[top]
+            out_scores[i, :len(top)] = exact[top]
+        return out_ids, out_scores
+
+    def top_k(self, query, k=10):
+        # ids and cosine scores of the k closest docs to a processed query
+        qvec = self.encode([query])
+        if self.ann is not None:
+            ids, scores = self.ann_top_k(qvec, k)
+            keep = ids[0] >= 0
+            return ids[0][keep], scores[0][keep]
+        sims = self.similarities(qvec)[0]
+        top = top_k_indices(sims, k)
+        return top, sims[top]
+
+    def search_batch(self, queries, top_k=10, batch_size=256):
+        # queries are processed strings, returns (ids, scores) per query
+        results = []
+        for start in range(0, len(queries), batch_size):
+            sims = self.similarities(self.encode(queries[start:start + batch_size]))
+            top = top_k_indices(sims, top_k)
+            top_scores = np.take_along_axis(sims, top, axis=1)
+            results.extend(zip(top, top_scores))
+        return results
+
+def build_vectors(documents, max_features=1000):
+    # same token pattern as the svm vectorizer so Malayalam words stay whole
+    vectorizer = TfidfVectorizer(max_features=max_features, token_pattern=r"(?u)\S+")
+    doc_vectors = vectorizer.fit_transform(documents)
+    return vectorizer, doc_vectors
+
+def vectors_digest(doc_vectors):
+    # sha256 of the stored document vectors; the sparse tf-idf arrays as saved,
+    # a few bytes per nonzero rather than the dense matrix
+    digest = hashlib.sha256()
+    if hasattr(doc_vectors, 'tocsr'):
+        m = doc_vectors.tocsr()
+        arrays = (m.data, m.indices, m.indptr)
+    else:
+        m = np.asarray(doc_vectors)
+        arrays = (m,)
+    digest.update(repr(m.shape).encode('utf-8'))
+    for a in arrays:
+        digest.update(np.ascontiguousarray(a).tobytes())
+    return digest.hexdigest()
+
+def load_vector_index(vectorizer_file='models/vectorizer_ir.pkl', vectors_file='models/doc_vectors.pkl',
+                      quantize=False, ann_dir='models/ann_index'):
+    with open(vectorizer_file, 'rb') as f:
+        vectorizer = pickle.load(f)
+    with open(vectors_file, 'rb') as f:
+        doc_vectors = pickle.load(f)
+    index = VectorIndex(vectorizer, doc_vectors, quantize=quantize)
+    index.digest = vectors_digest(doc_vectors)
+    
+    # use the ann index when one was built for these vectors; a count check alone
+    # passes an index built from vectors that were since rebuilt
+    if ann_dir and os.path.exists(os.path.join(ann_dir, 'meta.json')):
+        from ann_index import IVFPQIndex
+        ann = IVFPQIndex.load(ann_dir)
+        if len(ann) == len(index) and ann.vectors_digest == index.digest:
+            index.use_ann(ann)
+        else:
+            print(f"{ann_dir} was built from other vectors, searching exactly; rebuild it with src/ann_index.py")
+    return index
+
+def main():
+    documents = load_corpus('data/processed_corpus.json')
+    if not documents:
+        print("no documents")
+        return
+
+    print("building document vectors...")
+    vectorizer, doc_vectors = build_vectors(documents)
+
+    print("saving vectors...")
+    with open('models/vectorizer_ir.pkl', 'wb') as f:
+        pickle.dump(vectorizer, f)
+    with open('models/doc_vectors.pkl', 'wb') as f:
+        pickle.dump(doc_vectors, f)
+
+    index = VectorIndex(vectorizer, doc_vectors)
+
+    query = "വാർത്ത" # news
+    print(f"\nvector search results for query: {query}\n")
+    for i, res in enumerate(search(query, None, documents, mode='vector', vectors=index)):
+        print(f"{i+1}. score: {res['score']:.3f}")
+        print(f"   text: {res['text']}...\n")
+
+    print("done!")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Crawler against a local aiohttp server serving the pages in fixtures/
+# the first run downloads every page, a rerun with the saved state only gets
+# 304s back, and a page that starts failing drops out of the corpus
+#
+#   python -m pytest tests
+
+import os
+import sys
+import asyncio
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from crawler import Crawler
+from collect_data import parse_page
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+PAGES = ['index.html', 'kerala.html', 'sports.html']
+
+class FixtureServer:
+    def __init__(self):
+        self.served = []     # (path, status) in request order
+        self.failing = set() # pages answered with 500
+
+    async def handle(self, request):
+        name = request.match_info['name']
+        path = os.path.join(FIXTURES, name)
+        if name in self.failing:
+            response = web.Response(status=500)
+        elif not os.path.exists(path):
+            response = web.Response(status=404)
+        else:
+            etag = f'"{name}-{os.path.getsize(path)}"'
+            if request.headers.get('If-None-Match') == etag:
+                response = web.Response(status=304, headers={'ETag': etag})
+            else:
+                with open(path, 'rb') as f:
+                    response = web.Response(body=f.read(), headers={'ETag': etag, 'Content-Type': 'text/html'})
+        self.served.append((name, response.status))
+        return response
+
+    async def crawl_twice(self, state_file, between=None):
+        # two crawler runs against one server, so urls (and the port) stay the same
+        app = web.Application()
+        app.router.add_get('/{name}', self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        seed = f"http://127.0.0.1:{runner.addresses[0][1]}/index.html"
+        runs = []
+        try:
+            for i in range(2):
+                if i and between:
+                    between(self)
+                self.served.clear()
+                crawler = Crawler(parse_page, state_file=state_file, max_depth=1, delay=0)
+                stats = await crawler.run([seed])
+                runs.append((crawler, dict(stats), list(self.served)))
+        finally:
+            await runner.cleanup()
+        return runs
+
+def statuses(served):
+    return {name: status for name, status in served if name != 'robots.txt'}
+
+def test_rerun_only_gets_not_modified(tmp_path):
+    server = FixtureServer()
+    (first, first_stats, first_served), (second, second_stats, second_served) = \
+        asyncio.run(server.crawl_twice(str(tmp_path / 'crawl_state.json')))
+
+    assert statuses(first_served) == {name: 200 for name in PAGES}
+    assert first_stats['fetched'] == len(PAGES)
+    assert first_stats['blocked'] == 1  # private.html, disallowed by robots.txt
+    # the page with an xml declaration was parsed too
+    assert any('മഴ' in text for text in first.corpus())
+
+    assert statuses(second_served) == {name: 304 for name in PAGES}
+    assert second_stats['fetched'] == 0
+    assert second_stats['not_modified'] == len(PAGES)
+    assert second.corpus() == first.corpus()
+
+def test_failing_page_drops_its_texts(tmp_path):
+    server = FixtureServer()
+    (first, _, _), (second, second_stats, second_served) = asyncio.run(
+        server.crawl_twice(str(tmp_path / 'crawl_state.json'), lambda s: s.failing.add('sports.html')))
+
+    assert any('ഗോളുകൾക്ക്' in text for text in first.corpus())
+    assert statuses(second_served)['sports.html'] == 500
+    assert second_stats['errors'] == 1
+    assert not any('ഗോളുകൾക്ക്' in text for text in second.corpus())
+    assert any('മഴ' in text for text in second.corpus())